@@ -0,0 +1,332 @@
+import asyncio
+import itertools
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List
+
+from firebase_admin import credentials
+from google.api_core.exceptions import Conflict, FailedPrecondition, NotFound
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from game_state_repository import (GameStateRepository, VERSION_FIELD, VersionConflict, apply_delta, field_paths,
+                                   state_version)
+from metrics import Counter, Histogram
+
+
+# 非同步的遊戲狀態儲存介面：等待網路 I/O 時不會卡住 event loop，其他群組的指令照常執行
+class AsyncGameStateRepository(ABC):
+    @abstractmethod
+    async def save_game_state(self, chat_id: str, state: dict):
+        """儲存指定 chat_id 的遊戲狀態 (dict 結構)"""
+        pass
+
+    @abstractmethod
+    async def load_game_state(self, chat_id: str) -> dict | None:
+        """讀取指定 chat_id 的遊戲狀態，無資料則回傳 None"""
+        pass
+
+    @abstractmethod
+    async def delete_game_state(self, chat_id: str):
+        """刪除指定 chat_id 的遊戲狀態"""
+        pass
+
+    async def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        """只更新有變動的欄位 ({欄位路徑: 值})，預設讀出整份套用後再存回"""
+        state = await self.load_game_state(chat_id)
+        if state is None:
+            raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+        await self.save_game_state(chat_id, apply_delta(state, delta))
+
+    async def append_events(self, chat_id: str, events: List[dict]):
+        """記錄遊戲事件，預設不保存事件"""
+        pass
+
+    async def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        """一次更新多個 chat 的變動欄位，回傳寫入失敗的 {chat_id: 例外}；預設同時逐一更新"""
+        chat_ids = list(deltas)
+        results = await asyncio.gather(
+            *(self.update_game_state(chat_id, deltas[chat_id], (events or {}).get(chat_id)) for chat_id in chat_ids),
+            return_exceptions=True)
+        return {chat_id: result for chat_id, result in zip(chat_ids, results) if isinstance(result, Exception)}
+
+    async def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        """一次讀取多個 chat 的遊戲狀態，不存在的 chat 不會出現在結果中"""
+        chat_ids = list(chat_ids)
+        states = await asyncio.gather(*(self.load_game_state(chat_id) for chat_id in chat_ids))
+        return {chat_id: state for chat_id, state in zip(chat_ids, states) if state is not None}
+
+    async def save_many(self, states: Dict[str, dict]):
+        """一次儲存多個 chat 的遊戲狀態"""
+        await asyncio.gather(*(self.save_game_state(chat_id, state) for chat_id, state in states.items()))
+
+    async def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        """資料庫中的版本等於 expected_version（-1 表示還不存在）時，才寫入完整狀態或差異並遞增版本，
+        回傳新的版本號；版本不符時丟出 VersionConflict。預設先讀後寫，不是原子操作"""
+        current = await self.load_game_state(chat_id)
+        actual = state_version(current)
+        if actual != expected_version:
+            raise VersionConflict(chat_id, expected_version, actual)
+        version = expected_version + 1
+        if state is None:
+            if current is None:
+                raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+            state = apply_delta(current, delta)
+        await self.save_game_state(chat_id, {**state, VERSION_FIELD: version})
+        return version
+
+    async def list_started_games(self, limit: int = None) -> List[str]:
+        """列出進行中的遊戲（啟動時預先載入用），不支援時回傳空的清單"""
+        return []
+
+    async def list_turn_deadlines(self) -> Dict[str, float]:
+        """列出有回合期限的遊戲 {chat_id: turn_deadline}（啟動時排程回合計時用，不必載入遊戲），不支援時回傳空的 dict"""
+        return {}
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+# 把同步的 repository（SQLite、本地檔案、事件紀錄）放到它的執行緒池執行
+class ExecutorGameStateRepository(AsyncGameStateRepository):
+    def __init__(self, repository: GameStateRepository):
+        self.repository = repository
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.repository.executor, func, *args)
+
+    async def save_game_state(self, chat_id: str, state: dict):
+        await self._run(self.repository.save_game_state, chat_id, state)
+
+    async def load_game_state(self, chat_id: str) -> dict | None:
+        return await self._run(self.repository.load_game_state, chat_id)
+
+    async def delete_game_state(self, chat_id: str):
+        await self._run(self.repository.delete_game_state, chat_id)
+
+    async def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        await self._run(self.repository.update_game_state, chat_id, delta, events)
+
+    async def append_events(self, chat_id: str, events: List[dict]):
+        await self._run(self.repository.append_events, chat_id, events)
+
+    async def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        return await self._run(self.repository.update_many, deltas, events)
+
+    async def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        return await self._run(self.repository.load_many, list(chat_ids))
+
+    async def save_many(self, states: Dict[str, dict]):
+        await self._run(self.repository.save_many, states)
+
+    async def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        return await self._run(self.repository.compare_and_save, chat_id, expected_version, state, delta)
+
+    async def list_started_games(self, limit: int = None) -> List[str]:
+        return await self._run(self.repository.list_started_games, limit)
+
+    async def list_turn_deadlines(self) -> Dict[str, float]:
+        return await self._run(self.repository.list_turn_deadlines)
+
+    async def close(self):
+        # close 會關閉 repository 自己的執行緒池，要在其他執行緒等待
+        if hasattr(self.repository, 'close'):
+            await asyncio.get_running_loop().run_in_executor(None, self.repository.close)
+
+    def stats(self) -> dict:
+        return self.repository.stats() if hasattr(self.repository, 'stats') else {}
+
+
+# 記錄每個儲存操作的延遲與失敗次數（/metrics、/stats），其餘行為與被包裝的 repository 相同
+class InstrumentedGameStateRepository(AsyncGameStateRepository):
+    def __init__(self, repository: AsyncGameStateRepository, latency: Histogram, errors: Counter):
+        self.repository = repository
+        self.latency = latency  # 以 operation 標籤區分
+        self.errors = errors
+
+    async def _timed(self, operation: str, call):
+        start = time.perf_counter()
+        try:
+            return await call
+        except VersionConflict:
+            # 版本衝突是正常的結果，不算失敗
+            raise
+        except Exception:
+            self.errors.inc(operation=operation)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - start, operation=operation)
+
+    async def save_game_state(self, chat_id: str, state: dict):
+        await self._timed('save', self.repository.save_game_state(chat_id, state))
+
+    async def load_game_state(self, chat_id: str) -> dict | None:
+        return await self._timed('load', self.repository.load_game_state(chat_id))
+
+    async def delete_game_state(self, chat_id: str):
+        await self._timed('delete', self.repository.delete_game_state(chat_id))
+
+    async def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        await self._timed('update', self.repository.update_game_state(chat_id, delta, events))
+
+    async def append_events(self, chat_id: str, events: List[dict]):
+        await self._timed('append_events', self.repository.append_events(chat_id, events))
+
+    async def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        failures = await self._timed('update_many', self.repository.update_many(deltas, events))
+        if failures:
+            self.errors.inc(len(failures), operation='update_many')
+        return failures
+
+    async def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        return await self._timed('load_many', self.repository.load_many(chat_ids))
+
+    async def save_many(self, states: Dict[str, dict]):
+        await self._timed('save_many', self.repository.save_many(states))
+
+    async def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        return await self._timed('compare_and_save',
+                                 self.repository.compare_and_save(chat_id, expected_version, state, delta))
+
+    async def list_started_games(self, limit: int = None) -> List[str]:
+        return await self._timed('list_started_games', self.repository.list_started_games(limit))
+
+    async def list_turn_deadlines(self) -> Dict[str, float]:
+        return await self._timed('list_turn_deadlines', self.repository.list_turn_deadlines())
+
+    async def close(self):
+        await self.repository.close()
+
+    def stats(self) -> dict:
+        return self.repository.stats()
+
+
+# 使用 Firestore 的非同步 client；每個 client 各有一條 gRPC 連線，輪流使用分散負載
+class AsyncFirestoreGameStateRepository(AsyncGameStateRepository):
+    def __init__(self, clients: List[firestore.AsyncClient], collection_name: str = "PayUpPal"):
+        self.clients = clients
+        self.collection_name = collection_name
+        self._next_client = itertools.cycle(clients)
+        self._update_times: Dict[str, tuple] = {}  # chat_id: (這個 bot 最後寫入的版本, 文件的更新時間)
+
+    @staticmethod
+    def from_credentials(cred_path: str, collection_name: str = "PayUpPal", pool_size: int = 4):
+        cred = credentials.Certificate(cred_path)
+        clients = [
+            firestore.AsyncClient(project=cred.project_id, credentials=cred.get_credential())
+            for _ in range(pool_size)
+        ]
+        return AsyncFirestoreGameStateRepository(clients, collection_name)
+
+    def _client(self) -> firestore.AsyncClient:
+        return next(self._next_client)
+
+    def _document(self, chat_id: str, client: firestore.AsyncClient = None):
+        return (client or self._client()).collection(self.collection_name).document(str(chat_id))
+
+    async def save_game_state(self, chat_id: str, state: dict):
+        await self._document(chat_id).set(state)
+
+    async def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        # map 的 key 是數字（位置、user_id），欄位路徑需要經過 FieldPath 加上引號
+        await self._document(chat_id).update(field_paths(delta))
+
+    async def load_game_state(self, chat_id: str) -> dict | None:
+        doc = await self._document(chat_id).get()
+        if doc.exists:
+            return doc.to_dict()
+        return None
+
+    async def delete_game_state(self, chat_id: str):
+        self._update_times.pop(chat_id, None)
+        await self._document(chat_id).delete()
+
+    async def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        # 以文件的更新時間作為寫入的前置條件：其他 bot 寫入過，更新時間就不同，寫入會失敗
+        client = self._client()
+        document = self._document(chat_id, client)
+        version = expected_version + 1
+        known = self._update_times.get(chat_id)
+        if known is not None and known[0] == expected_version:
+            # 上一版是這個 bot 寫入的，已知更新時間，不必再讀取
+            update_time = known[1]
+        else:
+            snapshot = await document.get(field_paths=[VERSION_FIELD])
+            actual = state_version(snapshot.to_dict() if snapshot.exists else None)
+            if actual != expected_version:
+                raise VersionConflict(chat_id, expected_version, actual)
+            update_time = snapshot.update_time if snapshot.exists else None
+        try:
+            if update_time is None:
+                if state is None:
+                    raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+                result = await document.create({**state, VERSION_FIELD: version})
+            else:
+                # set 不支援前置條件，完整狀態改用 update 覆蓋所有頂層欄位
+                fields = {**(state if state is not None else delta), VERSION_FIELD: version}
+                result = await document.update(field_paths(fields),
+                                               option=client.write_option(last_update_time=update_time))
+        except (Conflict, FailedPrecondition, NotFound):
+            self._update_times.pop(chat_id, None)
+            raise VersionConflict(chat_id, expected_version)
+        self._update_times[chat_id] = (version, result.update_time)
+        return version
+
+    async def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        client = self._client()
+        refs = [self._document(chat_id, client) for chat_id in chat_ids]
+        return {doc.id: doc.to_dict() async for doc in client.get_all(refs) if doc.exists}
+
+    async def save_many(self, states: Dict[str, dict]):
+        # Firestore 一個 batch 最多 500 筆寫入，各個 batch 同時送出
+        items = list(states.items())
+        batches = []
+        for i in range(0, len(items), 500):
+            client = self._client()
+            batch = client.batch()
+            for chat_id, state in items[i:i + 500]:
+                batch.set(self._document(chat_id, client), state)
+            batches.append(batch.commit())
+        await asyncio.gather(*batches)
+
+    async def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        # 每 500 筆一個 batch 同時送出；文件不存在時整個 batch 失敗，改為逐一更新找出是哪些 chat
+        items = list(deltas.items())
+        failures = {}
+
+        async def commit(chunk: list):
+            client = self._client()
+            batch = client.batch()
+            for chat_id, delta in chunk:
+                batch.update(self._document(chat_id, client), field_paths(delta))
+            try:
+                await batch.commit()
+            except NotFound:
+                failures.update(await super(AsyncFirestoreGameStateRepository, self).update_many(dict(chunk)))
+
+        await asyncio.gather(*(commit(items[i:i + 500]) for i in range(0, len(items), 500)))
+        return failures
+
+    async def list_started_games(self, limit: int = None) -> List[str]:
+        # 只取文件 id，不讀取內容
+        query = (self._client().collection(self.collection_name)
+                 .where(filter=FieldFilter('started', '==', True))
+                 .select([FieldPath.document_id()]))
+        if limit is not None:
+            query = query.limit(limit)
+        return [doc.id async for doc in query.stream()]
+
+    async def list_turn_deadlines(self) -> Dict[str, float]:
+        # 只讀取 turn_deadline 欄位（單一欄位的索引由 Firestore 自動建立）
+        query = (self._client().collection(self.collection_name)
+                 .where(filter=FieldFilter('turn_deadline', '>', 0))
+                 .select(['turn_deadline']))
+        return {doc.id: doc.get('turn_deadline') async for doc in query.stream()}
+
+    async def close(self):
+        for client in self.clients:
+            client.close()
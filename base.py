@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Tuple
 from enum import Enum, auto
 
 from game_setting import *
@@ -11,52 +11,97 @@ class SquareType(Enum):
     START = auto()
 
 
-class Square:
-    def __init__(self, 
-                 name: str, 
-                 color: str = None,
-                 price: int = None, 
-                 tolls: list = None, 
-                 house_cost: int = None):
-        
-        # base info
-        self.name = name
-        self.position = 0  # 棋盤位置 初始化統一設定
-        if name == "起點":
-            self.type: SquareType = SquareType.START
-        elif name == "監獄":
-            self.type: SquareType = SquareType.JAIL
-        elif name in ["機會", "命運"]:
-            self.type: SquareType = SquareType.CHANCE
-        else:
-            self.type: SquareType = SquareType.PROPERTY
-
-        # property info only
-        self.color = color
-        self._price = price
-        self.house_cost = house_cost  # 蓋每棟房屋的金額
-        self.tolls: list = tolls  # 過路費（空屋~5棟房屋）
+# 方格的靜態資料，由棋盤模板建立後所有遊戲共用，不可修改
+class SquareSpec(NamedTuple):
+    name: str
+    type: SquareType
+    position: int
+    color: str = None
+    price: int = None
+    tolls: Tuple[int, ...] = None  # 過路費（空屋~5棟房屋）
+    house_cost: int = None  # 蓋每棟房屋的金額
+
+
+# 記錄上次儲存後變動過的欄位，每個欄位佔一個位元，每個物件只多一個整數
+class Tracked:
+    __slots__ = ('_dirty',)
+    TRACKED_FIELDS: Tuple[str, ...] = ()
+    _FIELD_BITS: Dict[str, int] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._FIELD_BITS = {name: 1 << i for i, name in enumerate(cls.TRACKED_FIELDS)}
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        bit = self._FIELD_BITS.get(name)
+        if bit:
+            object.__setattr__(self, '_dirty', self._dirty | bit)
+
+    def mark_dirty(self, *fields: str):
+        # properties 等 dict 的內容變動不會經過 __setattr__，需要手動標記
+        for name in fields:
+            self._dirty |= self._FIELD_BITS[name]
+
+    def dirty_fields(self) -> List[str]:
+        return [name for name, bit in self._FIELD_BITS.items() if self._dirty & bit]
+
+    def pop_dirty(self) -> List[str]:
+        fields = self.dirty_fields()
+        self._dirty = 0
+        return fields
+
+
+class Square(Tracked):
+    __slots__ = ('spec', 'owner', 'level', 'mortgaged')
+    # 遊戲中會變動的欄位，變動時記錄下來只儲存差異
+    TRACKED_FIELDS = ('owner', 'level', 'mortgaged')
+
+    def __init__(self, spec: SquareSpec):
+        self._dirty = 0
+        self.spec = spec  # 名稱、價格、過路費等不會變動的資料
 
         # property info only, change when gaming
         self.owner: Player = None
         self.level = 0  # 地產等級
         self.mortgaged = False  # 是否抵押中
+        self._dirty = 0
+
+    # base info，直接讀取共用的 spec
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    @property
+    def type(self) -> SquareType:
+        return self.spec.type
+
+    @property
+    def position(self) -> int:
+        return self.spec.position
+
+    @property
+    def color(self) -> str:
+        return self.spec.color
+
+    @property
+    def house_cost(self) -> int:
+        return self.spec.house_cost
+
+    @property
+    def tolls(self) -> Tuple[int, ...]:
+        return self.spec.tolls
 
     @property
     def price(self):
         if self.mortgaged:
-            return self._price // 2
+            return self.spec.price // 2
         if self.level > 0:
-            return self.house_cost * self.level + self._price
-        return self._price
-    
-    @price.setter
-    def price(self, value):
-        self._price = value
+            return self.house_cost * self.level + self.spec.price
+        return self.spec.price
 
     def get_rent(self) -> int:
-        # 過路費 要加上不同顏色的地產
-        # 目前只考慮單一地產
+        # 單一地產的過路費，同色加成與抵押由 GameState.rent 處理
         return self.tolls[self.level]
     
     def reset(self):
@@ -66,8 +111,15 @@ class Square:
         self.mortgaged = False
 
     
-class Player:
+class Player(Tracked):
+    __slots__ = ('name', 'user_id', 'money', 'position', 'jail_turns', 'properties', 'mortgage_properties')
+    # 遊戲中會變動的欄位，變動時記錄下來只儲存差異
+    TRACKED_FIELDS = ('name', 'money', 'position', 'jail_turns', 'properties', 'mortgage_properties')
+    # 存檔的欄位
+    FIELDS = ('name', 'user_id', 'money', 'position', 'jail_turns', 'properties', 'mortgage_properties')
+
     def __init__(self, name: str, user_id: int):
+        self._dirty = 0
         self.name = name
         self.user_id = user_id
         self.money = START_MONEY  # 起始金額 如果小於0則破產   
@@ -75,6 +127,7 @@ class Player:
         self.jail_turns = 0
         self.properties: Dict[str, Square] = {}
         self.mortgage_properties: Dict[str, Square] = {}
+        self._dirty = 0
 
     def move(self, steps: int, board_size: int) -> int:
         self.position = (self.position + steps) % board_size
@@ -88,3 +141,53 @@ class Player:
 
     def receive(self, amount: int):
         self.money += amount
+
+
+if __name__ == '__main__':
+    # 量測進行中的遊戲（棋盤上的 Square 與 Player 佔大部分）常駐記憶體時每場佔用的空間
+    import argparse
+    import asyncio
+    import gc
+    import logging
+    import tracemalloc
+
+    from game_state import GameState
+
+    async def _discard(message):
+        pass
+
+    async def make_game(players: int) -> GameState:
+        game = GameState(_discard)
+        for i in range(players):
+            await game.add_player(f"玩家{i}", 1000 + i)
+        await game.start_game()
+        # 模擬進行中的遊戲：地產輪流分給玩家並升級
+        for i, square in enumerate(game.board):
+            if square.tolls:
+                owner = game.players[i % players]
+                square.owner = owner
+                square.level = i % 3
+                owner.properties[square.name] = square
+                owner.money -= square.price
+        game.mark_clean()
+        return game
+
+    async def main(args):
+        logging.disable(logging.INFO)
+        await make_game(args.players)  # 先載入模組與共用的棋盤模板
+        games = []
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(args.games):
+            games.append(await make_game(args.players))
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print(f"{args.games} 場遊戲（每場 {args.players} 人）: {used / args.games:.0f} bytes/場，"
+              f"共 {used / 1024 / 1024:.1f} MB")
+
+    parser = argparse.ArgumentParser(description="遊戲常駐記憶體用量")
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -1,28 +1,258 @@
-from typing import List
-from base import Square
+import json
+import os
+import tomllib
+from typing import Dict, Iterator, List, Optional, Tuple
+from base import Square, SquareSpec, SquareType
+
+BUILTIN_BOARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'boards')  # 內建棋盤的資料檔
+
+
+# 棋盤模板：所有遊戲共用同一份不可變的方格資料，每場遊戲只保存擁有者、等級、抵押狀態
+# 修改既有棋盤時要遞增 version 並保留舊版，已存檔的遊戲才能用原本的棋盤還原
+# 建立時一次算好查詢用的表格，之後每個指令都是查表，不會因為棋盤變大而變慢
+class BoardTemplate:
+    __slots__ = ('id', 'version', 'name', 'squares', 'positions', 'groups', 'types', 'next_start', 'next_jail')
+
+    def __init__(self, id: str, version: int, squares: Tuple[SquareSpec, ...], name: str = None):
+        self.id = id
+        self.version = version
+        self.name = name or id  # 顯示用的名稱
+        self.squares = tuple(squares)
+        self.positions: Dict[str, int] = {spec.name: spec.position for spec in self.squares}  # 名稱: 位置
+        self.groups: Dict[str, int] = {}  # 顏色: 同色地產數
+        for spec in self.squares:
+            if spec.type == SquareType.PROPERTY and spec.color:
+                self.groups[spec.color] = self.groups.get(spec.color, 0) + 1
+        self.types: Tuple[SquareType, ...] = tuple(spec.type for spec in self.squares)
+        # 從每個位置往前走到下一個起點 / 監獄的步數（1 ~ 格數），棋盤上沒有這種格子時為 0
+        self.next_start = _offsets(self.types, SquareType.START)
+        self.next_jail = _offsets(self.types, SquareType.JAIL)
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        return (self.id, self.version)
+
+    def __len__(self):
+        return len(self.squares)
+
+    def distance_to(self, square_type: SquareType, position: int) -> int:
+        """從 position 往前到下一個起點或監獄的步數，沒有這種格子時為 0"""
+        return self.next_start[position] if square_type == SquareType.START else self.next_jail[position]
+
+    def passes_start(self, position: int, steps: int) -> bool:
+        """從 position 前進 steps 步是否經過起點（剛好停在起點不算）"""
+        return 0 < self.next_start[position] < steps
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'version': self.version,
+            'name': self.name,
+            'squares': [
+                {**spec._asdict(), 'type': spec.type.name, 'tolls': list(spec.tolls) if spec.tolls else None}
+                for spec in self.squares
+            ],
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'BoardTemplate':
+        return BoardTemplate(data['id'], data['version'], _specs_from_dicts(data['squares']), data.get('name'))
+
+    def scaled(self, toll_scale: float) -> 'BoardTemplate':
+        """調整過路費倍率的版本（模擬用，不會註冊）"""
+        squares = tuple(
+            spec._replace(tolls=tuple(int(toll * toll_scale) for toll in spec.tolls)) if spec.tolls else spec
+            for spec in self.squares
+        )
+        return BoardTemplate(f"{self.id}*{toll_scale}", self.version, squares, self.name)
+
+
+def _offsets(types: Tuple[SquareType, ...], target: SquareType) -> Tuple[int, ...]:
+    n = len(types)
+    offsets = [0] * n
+    ahead = None  # 後面最近的 target（索引繞兩圈，處理從終點繞回起點的情況）
+    for i in range(2 * n - 1, -1, -1):
+        if i < n and ahead is not None:
+            offsets[i] = ahead - i
+        if types[i % n] == target:
+            ahead = i
+    return tuple(offsets)
+
+
+# 一場遊戲的棋盤：方格的靜態資料都在共用的模板中，只有用到的方格才建立 Square
+# 有擁有者或還有未儲存變動的方格會一直保留，其他的在 release() 時丟掉，常駐記憶體只跟持有的地產數有關
+class Board:
+    __slots__ = ('template', 'squares')
+
+    def __init__(self, template: BoardTemplate):
+        self.template = template
+        self.squares: Dict[int, Square] = {}  # 位置: 已建立的方格
+
+    def __len__(self):
+        return len(self.template)
+
+    def __getitem__(self, position: int) -> Square:
+        square = self.squares.get(position)
+        if square is None:
+            square = self.squares[position] = Square(self.template.squares[position])
+        return square
+
+    def peek(self, position: int) -> Optional[Square]:
+        """已建立的方格，沒有建立過時回傳 None（不會建立）"""
+        return self.squares.get(position)
+
+    def __iter__(self) -> Iterator[Square]:
+        # 顯示整個棋盤時才會用到，會建立所有方格，下次 release() 時再丟掉
+        return (self[position] for position in range(len(self.template)))
+
+    def active(self) -> Iterator[Square]:
+        """目前已建立的方格（有擁有者的一定在其中）"""
+        return iter(list(self.squares.values()))
+
+    def release(self):
+        """丟掉沒有擁有者、沒有升級或抵押、也沒有未儲存變動的方格"""
+        for position in [p for p, s in self.squares.items()
+                         if s.owner is None and not s.level and not s.mortgaged and not s.dirty_fields()]:
+            del self.squares[position]
+
+
+_TEMPLATES: Dict[Tuple[str, int], BoardTemplate] = {}
+
+
+def register_board_template(template: BoardTemplate) -> BoardTemplate:
+    _TEMPLATES[template.key] = template
+    return template
+
+
+def get_board_template(id: str, version: int = None) -> Optional[BoardTemplate]:
+    """version 為 None 時取最新版本"""
+    if version is None:
+        versions = [template for key, template in _TEMPLATES.items() if key[0] == id]
+        return max(versions, key=lambda template: template.version) if versions else None
+    return _TEMPLATES.get((id, version))
+
+
+def list_board_templates() -> List[BoardTemplate]:
+    """可供選擇的棋盤（每個 id 的最新版本）"""
+    latest = {}
+    for template in _TEMPLATES.values():
+        if template.id not in latest or template.version > latest[template.id].version:
+            latest[template.id] = template
+    return sorted(latest.values(), key=lambda template: template.id)
+
+
+def is_registered(template: BoardTemplate) -> bool:
+    return _TEMPLATES.get(template.key) is template
+
+
+def find_board_template(squares: Tuple[SquareSpec, ...]) -> BoardTemplate:
+    """找出方格資料完全相同的已註冊模板（舊存檔用），找不到就建立一個未註冊的模板"""
+    squares = tuple(squares)
+    for template in _TEMPLATES.values():
+        if template.squares == squares:
+            return template
+    return BoardTemplate('custom', 0, squares)
+
+
+def _specs_from_dicts(squares: List[dict]) -> Tuple[SquareSpec, ...]:
+    return tuple(
+        SquareSpec(
+            name=s['name'],
+            type=SquareType[s['type']],
+            position=s['position'],
+            color=s['color'],
+            price=s['price'],
+            tolls=tuple(s['tolls']) if s['tolls'] else None,
+            house_cost=s['house_cost'],
+        )
+        for s in squares
+    )
+
+
+def _positive_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def compile_board(data: dict, source: str = '<board>') -> BoardTemplate:
+    """檢查棋盤資料並建立模板，資料有誤時丟出 ValueError
+    格式：{"id", "version", "name", "squares": [...]}，方格依排列順序決定位置；
+    type 省略時為 PROPERTY，地產需要 color、price、tolls（空屋~最高等級）、house_cost"""
+    def error(message: str):
+        return ValueError(f"{source}: {message}")
+
+    if not isinstance(data.get('id'), str) or not data['id'] or '*' in data['id']:
+        raise error("id 必須是非空字串且不能包含 *")
+    if not _positive_int(data.get('version')):
+        raise error("version 必須是正整數")
+    squares = data.get('squares')
+    if not isinstance(squares, list) or not squares:
+        raise error("squares 必須是非空的陣列")
+
+    specs = []
+    property_names = set()
+    for position, s in enumerate(squares):
+        where = f"第 {position} 格"
+        if not isinstance(s, dict) or not isinstance(s.get('name'), str) or not s['name']:
+            raise error(f"{where} 需要 name")
+        type_name = s.get('type', SquareType.PROPERTY.name)
+        if type_name not in SquareType.__members__:
+            raise error(f"{where}（{s['name']}）的 type 必須是 {', '.join(SquareType.__members__)} 之一")
+        square_type = SquareType[type_name]
+        if square_type == SquareType.PROPERTY:
+            if s['name'] in property_names:
+                raise error(f"地產名稱重複: {s['name']}")
+            property_names.add(s['name'])
+            tolls = s.get('tolls')
+            if not isinstance(s.get('color'), str) or not s['color']:
+                raise error(f"{where}（{s['name']}）需要 color")
+            if not _positive_int(s.get('price')) or not _positive_int(s.get('house_cost')):
+                raise error(f"{where}（{s['name']}）的 price、house_cost 必須是正整數")
+            if (not isinstance(tolls, list) or not tolls
+                    or not all(isinstance(t, int) and not isinstance(t, bool) and t >= 0 for t in tolls)):
+                raise error(f"{where}（{s['name']}）的 tolls 必須是非負整數的陣列")
+            specs.append(SquareSpec(s['name'], square_type, position, s['color'], s['price'], tuple(tolls),
+                                    s['house_cost']))
+        else:
+            extra = [key for key in ('color', 'price', 'tolls', 'house_cost') if s.get(key) is not None]
+            if extra:
+                raise error(f"{where}（{s['name']}）不是地產，不能設定 {', '.join(extra)}")
+            specs.append(SquareSpec(s['name'], square_type, position))
+    if SquareType.START not in (spec.type for spec in specs):
+        raise error("至少需要一個起點（START）")
+    if any(spec.type != SquareType.PROPERTY and spec.name in property_names for spec in specs):
+        raise error("其他格子不能和地產同名")
+    return BoardTemplate(data['id'], data['version'], tuple(specs), data.get('name'))
+
+
+def load_board_file(path: str) -> BoardTemplate:
+    """讀取 .json 或 .toml 棋盤資料檔"""
+    if path.endswith('.toml'):
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    return compile_board(data, os.path.basename(path))
+
+
+def load_board_dir(directory: str) -> List[BoardTemplate]:
+    """載入並註冊目錄中所有的棋盤資料檔；同一個 id/版本重複時丟出 ValueError"""
+    templates = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(('.json', '.toml')):
+            continue
+        template = load_board_file(os.path.join(directory, filename))
+        existing = _TEMPLATES.get(template.key)
+        if existing is not None and existing.squares != template.squares:
+            raise ValueError(f"{filename}: 棋盤 {template.id} v{template.version} 已經存在且內容不同，修改棋盤請遞增 version")
+        templates.append(register_board_template(template))
+    return templates
+
 
 # 棋盤
-def initialize_board() -> List[Square]:
-    board = [
-        Square("起點"),
-        Square("台北", color="紅色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        # Square("機會"),
-        # Square("命運"),
-        Square("監獄"),
-        Square("台南", color="綠色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        Square("高雄", color="藍色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        # Square("機會"),
-        Square("花蓮", color="黃色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        Square("台東", color="紫色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        # Square("命運"),
-        Square("澎湖", color="橘色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        Square("基隆", color="紅色", price=600, tolls=[220, 1500, 3000, 6000, 12000], house_cost=2000),
-        Square("監獄"),
-
-    ]
-
-    # 照加入順序設定每個方格的 position
-    for i in range(len(board)):
-        board[i].position = i
-
-    return board
+load_board_dir(BUILTIN_BOARD_DIR)
+DEFAULT_BOARD = get_board_template('taiwan', 2)
+
+
+def initialize_board(template: BoardTemplate = DEFAULT_BOARD) -> Board:
+    return Board(template)
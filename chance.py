@@ -1,27 +1,38 @@
-# 機會命運卡牌
+# 機會命運卡牌：所有遊戲共用一份不可變的卡牌目錄，每場遊戲只保存洗好的牌堆（卡牌在目錄中的編號）
 
 import random
+from typing import List, NamedTuple, Tuple
 
-class Chance:
-    def __init__(self, 
-                 card: str,
-                 lost: int = 0,
-                 gain: int = 0,
-                 move: int = 0):
-        self.card = card
-        self.lost = lost
-        self.gain = gain
-        self.move = move
-
-def get_chance_card() -> Chance:
-    cards = [
-        Chance("獲得$100獎金", gain=100),
-        Chance("獲得$50獎金", gain=50),
-        Chance("繳交$30罰款", lost=30),
-        Chance("繳交$75罰款", lost=75),
-        Chance("獲得$200獎金", gain=200),
-        Chance("繳交$100罰款", lost=100),
-        Chance("獲得$150獎金", gain=150),
-        Chance("繳交$20罰款", lost=20),
-    ]
-    return random.choice(cards)
\ No newline at end of file
+from base import SquareType
+
+
+class Chance(NamedTuple):
+    card: str
+    lost: int = 0
+    gain: int = 0
+    move: int = 0  # 正數前進、負數後退
+    to: SquareType = None  # 直接前進到下一個這種格子（START / JAIL），不領經過起點的獎勵
+
+
+# 只能在最後面新增卡牌，存檔中的牌堆以編號記錄
+CHANCE_CARDS: Tuple[Chance, ...] = (
+    Chance("獲得$100獎金", gain=100),
+    Chance("獲得$50獎金", gain=50),
+    Chance("繳交$30罰款", lost=30),
+    Chance("繳交$75罰款", lost=75),
+    Chance("獲得$200獎金", gain=200),
+    Chance("繳交$100罰款", lost=100),
+    Chance("獲得$150獎金", gain=150),
+    Chance("繳交$20罰款", lost=20),
+    Chance("前進3格", move=3),
+    Chance("後退2格", move=-2),
+    Chance("前進5格", move=5),
+    Chance("直接前往最近的監獄", to=SquareType.JAIL),
+)
+
+
+def shuffled_pile(rng: random.Random) -> List[int]:
+    """洗好的一副牌（卡牌編號），從最後面抽"""
+    pile = list(range(len(CHANCE_CARDS)))
+    rng.shuffle(pile)
+    return pile
@@ -3,4 +3,62 @@ from dotenv import load_dotenv
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-FIREBASE_CRED_PATH = os.getenv("FIREBASE_CRED_PATH", "firebase_service_account.json")
\ No newline at end of file
+FIREBASE_CRED_PATH = os.getenv("FIREBASE_CRED_PATH", "firebase_service_account.json")
+
+# 遊戲狀態儲存位置：firebase / sqlite / local
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firebase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "payuppal.db")
+LOCAL_STATE_DIR = os.getenv("LOCAL_STATE_DIR", "game_states")
+FIRESTORE_POOL_SIZE = int(os.getenv("FIRESTORE_POOL_SIZE", "4"))  # 非同步 Firestore client（gRPC 連線）數量
+
+# 事件紀錄：設定目錄後，指令只追加事件與變動欄位，每 SNAPSHOT_EVERY 筆才存一次完整快照
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "")  # 空字串表示不使用
+SNAPSHOT_EVERY = int(os.getenv("SNAPSHOT_EVERY", "50"))
+
+# 多個 bot 實例共用同一個資料庫：每個指令結束時以版本比對直接寫入，被其他實例搶先時重新載入再執行一次
+SHARED_STORAGE = os.getenv("SHARED_STORAGE", "0") == "1"  # 不能與 EVENT_LOG_DIR、TIER_CACHE_DIR 同時使用
+COMMIT_RETRIES = int(os.getenv("COMMIT_RETRIES", "3"))  # 版本衝突時最多重新執行幾次
+
+# 分層儲存（只用於 firebase）：設定目錄後，讀寫先經過本地磁碟快照，再由背景執行緒複寫到 Firebase
+TIER_CACHE_DIR = os.getenv("TIER_CACHE_DIR", "")  # 空字串表示不使用
+TIER_REPLICATE_INTERVAL = float(os.getenv("TIER_REPLICATE_INTERVAL", "5"))  # 複寫間隔（秒）
+TIER_VERIFY_LOCAL = os.getenv("TIER_VERIFY_LOCAL", "1") == "1"  # 只有一台機器時可設為 0，本地副本不再和遠端比對版本
+
+# 延遲寫入設定
+SAVE_FLUSH_INTERVAL = float(os.getenv("SAVE_FLUSH_INTERVAL", "1.0"))  # 秒
+SAVE_BATCH_SIZE = int(os.getenv("SAVE_BATCH_SIZE", "50"))
+
+# 遊戲快取設定
+GAME_CACHE_SIZE = int(os.getenv("GAME_CACHE_SIZE", "10000"))  # 記憶體中最多保留的遊戲數
+GAME_IDLE_TTL = float(os.getenv("GAME_IDLE_TTL", "1800"))  # 閒置多久（秒）後移出記憶體
+
+# 啟動時預先載入進行中的遊戲
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") == "1"
+WARMUP_LIMIT = int(os.getenv("WARMUP_LIMIT", "10000"))  # 最多載入幾場（不超過 GAME_CACHE_SIZE）
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "100"))  # 每次批次讀取的數量
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))  # 同時進行的批次讀取數
+
+# 送出訊息限速（Telegram flood limit：每個群組約每秒 1 則，全部約每秒 30 則）
+SEND_PER_CHAT_RATE = float(os.getenv("SEND_PER_CHAT_RATE", "1.0"))  # 每秒則數
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30.0"))  # 每秒則數（webhook 模式下由所有 worker 平分）
+
+# webhook 模式（python webhook_server.py）：aiohttp 接收更新後依群組分給多個 worker 行程
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # 對外的完整網址，設定後啟動時向 Telegram 註冊 webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # 比對 X-Telegram-Bot-Api-Secret-Token，空字串表示不檢查
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # 每個 worker 排隊的更新上限，滿了回 503 讓 Telegram 重送
+OFFLINE_BOT_API = os.getenv("OFFLINE_BOT_API", "0") == "1"  # 不連線 Telegram（壓力測試用），訊息只模擬送出
+
+# 自訂棋盤：目錄中的 .json / .toml 棋盤資料檔會在啟動時載入，可用 /map 選擇（共用資料庫的實例要放相同的檔案）
+CUSTOM_BOARD_DIR = os.getenv("CUSTOM_BOARD_DIR", "")  # 空字串表示只用內建的棋盤
+
+# 回合逾時：所有群組共用一個計時器，同時處理的逾時數上限（重新啟動後可能一次有很多已經到期）
+TURN_TIMER_CONCURRENCY = int(os.getenv("TURN_TIMER_CONCURRENCY", "16"))
+
+# 監控：設定 METRICS_PORT 後以 Prometheus 文字格式提供 GET /metrics（webhook worker 使用 METRICS_PORT + 編號）
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 表示不啟用
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(',') if user_id.strip()}  # 可使用 /stats 的使用者
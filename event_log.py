@@ -0,0 +1,367 @@
+# 事件紀錄：每個指令只在紀錄尾端追加一行（事件 + 變動欄位），每隔一段時間才存一份完整快照
+# 載入時讀取快照再重播之後的紀錄；被快照涵蓋的紀錄會壓縮掉，只把事件留在稽核檔中
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from game_state_repository import GameStateRepository, apply_delta
+
+SEQ_FIELD = '_log_seq'  # 快照中記錄涵蓋到第幾筆紀錄的欄位
+
+
+# 每個 chat 一個 JSON Lines 檔：<chat_id>.log.jsonl 為尚未被快照涵蓋的紀錄，
+# <chat_id>.audit.jsonl 為已壓縮的事件，重置遊戲時封存成 <chat_id>.<時間>.audit.jsonl
+class FileEventLog:
+    def __init__(self, directory: str = "game_events", durable: bool = False):
+        self.directory = directory
+        self.durable = durable  # 每次追加後 fsync
+        self._last_seq: Dict[str, int] = {}
+        self._archived_seq: Dict[str, int] = {}  # 稽核檔中最後一筆的序號
+        self._lock = threading.Lock()  # repository 的方法會在執行緒池中執行
+        self.bytes_written = 0  # 統計寫入量（追加與壓縮重寫）
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, chat_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{chat_id}.{kind}.jsonl")
+
+    @staticmethod
+    def _read(path: str) -> List[dict]:
+        entries = []
+        try:
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # 寫到一半當掉，最後一行不完整，之後的都不可信
+                        logging.warning(f"事件紀錄 {path} 有不完整的紀錄，略過之後的內容")
+                        break
+        except FileNotFoundError:
+            pass
+        return entries
+
+    @staticmethod
+    def _encode(entry: dict) -> bytes:
+        return (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _append_lines(self, path: str, entries: List[dict]):
+        data = b''.join(self._encode(entry) for entry in entries)
+        self.bytes_written += len(data)
+        with open(path, 'ab') as f:
+            f.write(data)
+            if self.durable:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def last_seq(self, chat_id: str) -> int:
+        """最後一筆紀錄的序號，沒有紀錄時為 0"""
+        with self._lock:
+            return self._current_seq(chat_id)
+
+    def _current_seq(self, chat_id: str) -> int:
+        seq = self._last_seq.get(chat_id)
+        if seq is None:
+            entries = self._read(self._path(chat_id, 'log'))
+            seq = self._last_seq[chat_id] = entries[-1]['seq'] if entries else 0
+        return seq
+
+    def append(self, chat_id: str, entry: dict) -> int:
+        """追加一筆紀錄，回傳它的序號"""
+        with self._lock:
+            seq = self._current_seq(chat_id) + 1
+            self._append_lines(self._path(chat_id, 'log'), [{'seq': seq, **entry}])
+            self._last_seq[chat_id] = seq
+            return seq
+
+    def chat_ids(self) -> List[str]:
+        """有紀錄檔的 chat"""
+        suffix = '.log.jsonl'
+        return [name[:-len(suffix)] for name in os.listdir(self.directory)
+                if name.endswith(suffix) and not name.startswith('.')]
+
+    def read(self, chat_id: str, after_seq: int = 0) -> List[dict]:
+        """讀取序號大於 after_seq 的紀錄"""
+        return [entry for entry in self._read(self._path(chat_id, 'log'))
+                if entry['seq'] > after_seq and not entry.get('compacted')]
+
+    def compact(self, chat_id: str, upto_seq: int):
+        """移除已被快照涵蓋（序號 <= upto_seq）的紀錄，其中的事件搬到稽核檔"""
+        with self._lock:
+            path = self._path(chat_id, 'log')
+            entries = self._read(path)
+            if not any(entry['seq'] <= upto_seq and not entry.get('compacted') for entry in entries):
+                return
+            self._archive_events(chat_id, [e for e in entries if e['seq'] <= upto_seq])
+
+            # 保留一行標記壓縮到的序號，重新啟動後序號才能接續
+            remaining = [{'seq': upto_seq, 'compacted': True}] + [e for e in entries if e['seq'] > upto_seq]
+            data = b''.join(self._encode(entry) for entry in remaining)
+            self.bytes_written += len(data)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{chat_id}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                    if self.durable:
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def _archive_events(self, chat_id: str, entries: List[dict]):
+        audit_path = self._path(chat_id, 'audit')
+        # 壓縮到一半當掉時，已經搬過的事件不要重複寫入
+        archived_seq = self._archived_seq.get(chat_id)
+        if archived_seq is None:
+            archived = self._read(audit_path)
+            archived_seq = archived[-1]['seq'] if archived else 0
+        lines = [{'seq': e['seq'], 'events': e['events']}
+                 for e in entries if e.get('events') and e['seq'] > archived_seq]
+        if lines:
+            self._append_lines(audit_path, lines)
+            archived_seq = lines[-1]['seq']
+        self._archived_seq[chat_id] = archived_seq
+
+    def archive(self, chat_id: str):
+        """遊戲重置時封存所有事件並清除紀錄，下一場遊戲從序號 1 開始"""
+        with self._lock:
+            path = self._path(chat_id, 'log')
+            self._archive_events(chat_id, [e for e in self._read(path) if not e.get('compacted')])
+            audit_path = self._path(chat_id, 'audit')
+            if os.path.exists(audit_path):
+                os.replace(audit_path, self._path(chat_id, f"{time.strftime('%Y%m%d%H%M%S')}.audit"))
+            if os.path.exists(path):
+                os.remove(path)
+            self._last_seq.pop(chat_id, None)
+            self._archived_seq.pop(chat_id, None)
+
+    def events(self, chat_id: str) -> Iterator[Tuple[int, dict]]:
+        """依序列出目前這場遊戲的所有事件 (序號, 事件)，用於重播爭議的遊戲"""
+        with self._lock:
+            archived = self._read(self._path(chat_id, 'audit'))
+            entries = self._read(self._path(chat_id, 'log'))
+        archived_seq = archived[-1]['seq'] if archived else 0
+        for entry in archived + [e for e in entries if e['seq'] > archived_seq and not e.get('compacted')]:
+            for event in entry.get('events', ()):
+                yield entry['seq'], event
+
+
+# 以事件紀錄儲存遊戲狀態：快照存放在另一個 repository（Firebase / SQLite / 本地檔案），
+# 變動只追加到紀錄，每 snapshot_every 筆才更新一次快照
+class EventSourcedGameStateRepository(GameStateRepository):
+    def __init__(self, snapshots: GameStateRepository, log: FileEventLog, snapshot_every: int = 50):
+        self.snapshots = snapshots
+        self.log = log
+        self.snapshot_every = snapshot_every
+        self.executor = snapshots.executor
+        self._snapshot_seq: Dict[str, Optional[int]] = {}  # chat_id: 快照涵蓋到的序號，None 表示沒有快照
+
+        # 統計數據
+        self.appended = 0  # 追加的紀錄數
+        self.snapshots_taken = 0
+        self.replayed = 0  # 載入時重播的紀錄數
+
+    def _load_snapshot(self, chat_id: str) -> dict | None:
+        state = self.snapshots.load_game_state(chat_id)
+        self._snapshot_seq[chat_id] = state.pop(SEQ_FIELD, 0) if state is not None else None
+        return state
+
+    def _snapshot_saved(self, chat_id: str, seq: int):
+        self._snapshot_seq[chat_id] = seq
+        self.snapshots_taken += 1
+        self.log.compact(chat_id, seq)
+
+    def save_game_state(self, chat_id: str, state: dict):
+        seq = self.log.last_seq(chat_id)
+        self.snapshots.save_game_state(chat_id, {**state, SEQ_FIELD: seq})
+        self._snapshot_saved(chat_id, seq)
+
+    def save_many(self, states: Dict[str, dict]):
+        seqs = {chat_id: self.log.last_seq(chat_id) for chat_id in states}
+        self.snapshots.save_many({chat_id: {**state, SEQ_FIELD: seqs[chat_id]} for chat_id, state in states.items()})
+        for chat_id, seq in seqs.items():
+            self._snapshot_saved(chat_id, seq)
+
+    def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        if chat_id not in self._snapshot_seq:
+            self._load_snapshot(chat_id)
+        snapshot_seq = self._snapshot_seq[chat_id]
+        if snapshot_seq is None:
+            raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+        seq = self.log.append(chat_id, {'delta': delta, 'events': events or []})
+        self.appended += 1
+        if seq - snapshot_seq >= self.snapshot_every:
+            self.save_game_state(chat_id, self.load_game_state(chat_id))
+
+    def append_events(self, chat_id: str, events: List[dict]):
+        self.log.append(chat_id, {'events': events})
+        self.appended += 1
+
+    def load_game_state(self, chat_id: str) -> dict | None:
+        state = self._load_snapshot(chat_id)
+        if state is None:
+            return None
+        entries = self.log.read(chat_id, self._snapshot_seq[chat_id])
+        for entry in entries:
+            if 'delta' in entry:
+                apply_delta(state, entry['delta'])
+        self.replayed += len(entries)
+        return state
+
+    def delete_game_state(self, chat_id: str):
+        self.snapshots.delete_game_state(chat_id)
+        self.log.archive(chat_id)
+        self._snapshot_seq[chat_id] = None
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        # 依快照判斷，快照之後才開始的遊戲不會列出
+        return self.snapshots.list_started_games(limit)
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        # 快照之後的期限在紀錄中（每個紀錄檔只有快照之後的幾筆），以最後一次變動為準
+        deadlines = self.snapshots.list_turn_deadlines()
+        for chat_id in self.log.chat_ids():
+            for entry in self.log.read(chat_id):
+                if 'turn_deadline' in entry.get('delta', {}):
+                    deadlines[chat_id] = entry['delta']['turn_deadline']
+        return {chat_id: deadline for chat_id, deadline in deadlines.items() if deadline}
+
+    def events(self, chat_id: str) -> Iterator[Tuple[int, dict]]:
+        return self.log.events(chat_id)
+
+    def stats(self) -> dict:
+        return {
+            'appended': self.appended,
+            'snapshots_taken': self.snapshots_taken,
+            'replayed': self.replayed,
+            **(self.snapshots.stats() if hasattr(self.snapshots, 'stats') else {}),
+        }
+
+
+if __name__ == '__main__':
+    # show：列出某個 chat 的事件；bench：比較每次存完整快照與事件紀錄的寫入量與載入（重播）速度
+    import argparse
+    import shutil
+
+    from game_state import GameState, SquareType
+    from game_state_repository import LocalGameStateRepository
+    from simulation import Strategy
+
+    def record_commands(commands: int, seed: int) -> List[Tuple[Optional[dict], dict, List[dict]]]:
+        """模擬遊戲，記錄每個指令後的 (差異, 完整快照, 事件)；差異為 None 表示需要完整快照"""
+        game = GameState(None, seed=seed)
+        strategy = Strategy()
+        records = []
+
+        def record():
+            delta = game.collect_delta()
+            records.append((delta, game.to_dict(), [e.to_dict() for e in game.pop_events()]))
+            game.mark_clean()
+
+        while len(records) < commands:
+            if not game.started:
+                for i in range(4):
+                    game.apply_add_player(f"玩家{i}", 1000 + i)
+                    record()
+                game.apply_start_game()
+                record()
+                continue
+            player = game.get_current_player()
+            game.apply_roll_dice(player)
+            record()
+            if game.started and game.get_current_player() is player and game.rolled:
+                square = game.get_square(player.position)
+                if game.ledger:
+                    strategy.raise_cash(game, player, game.ledger['amount'])
+                    game.apply_pay(player)
+                    record()
+                elif square.type == SquareType.PROPERTY and square.owner is None and strategy.want_buy(game, player, square):
+                    game.apply_buy_property(player, square)
+                    record()
+            if game.started and game.get_current_player() is player and game.rolled and not game.ledger:
+                game.apply_next_turn(player)
+                record()
+        return records[:commands]
+
+    def bench(args):
+        records = record_commands(args.commands, args.seed)
+        events = sum(len(r[2]) for r in records)
+        print(f"模擬 {len(records)} 個指令，{events} 個事件")
+
+        # 每個指令都寫入完整快照
+        repository = LocalGameStateRepository(os.path.join(args.directory, 'full'))
+        start = time.perf_counter()
+        written = 0
+        for _, state, _ in records:
+            repository.save_game_state('bench', state)
+            written += os.path.getsize(repository._path('bench', False))
+        elapsed = time.perf_counter() - start
+        print(f"{'完整快照':>12}: 寫入 {written / 1024:7.0f} KB，{len(records) / elapsed:6.0f} 指令/秒")
+
+        load_every = max(1, len(records) // args.loads)
+        for every in args.snapshot_every:
+            directory = os.path.join(args.directory, f'log{every}')
+            snapshots = LocalGameStateRepository(os.path.join(directory, 'snapshots'))
+            log = FileEventLog(os.path.join(directory, 'events'))
+            repository = EventSourcedGameStateRepository(snapshots, log, every)
+            snapshot_bytes = 0
+            write_elapsed = load_elapsed = 0.0
+            loads = replayed = 0
+            for i, (delta, state, events) in enumerate(records):
+                taken = repository.snapshots_taken
+                start = time.perf_counter()
+                if delta is None:
+                    repository.save_game_state('bench', state)
+                    repository.append_events('bench', events)
+                elif delta or events:
+                    repository.update_game_state('bench', delta, events)
+                write_elapsed += time.perf_counter() - start
+                if repository.snapshots_taken > taken:
+                    snapshot_bytes += os.path.getsize(snapshots._path('bench', False))
+
+                # 在快照週期的不同位置載入（讀快照 + 重播之後的紀錄），並確認與當時的狀態一致
+                if i % load_every == 0:
+                    before = repository.replayed
+                    start = time.perf_counter()
+                    loaded = repository.load_game_state('bench')
+                    load_elapsed += time.perf_counter() - start
+                    assert loaded == state, "重播結果與當時的狀態不一致"
+                    loads += 1
+                    replayed += repository.replayed - before
+
+            written = snapshot_bytes + log.bytes_written
+            print(f"{f'每 {every} 筆快照':>12}: 寫入 {written / 1024:7.0f} KB，{len(records) / write_elapsed:6.0f} 指令/秒，"
+                  f"載入 {loads / load_elapsed:6.0f} 次/秒（平均重播 {replayed / loads:.1f} 筆，"
+                  f"{replayed / load_elapsed:7.0f} 筆/秒），快照 {repository.snapshots_taken} 次")
+
+    def show(args):
+        log = FileEventLog(args.directory)
+        for seq, event in log.events(args.chat_id):
+            print(seq, json.dumps(event, ensure_ascii=False))
+
+    parser = argparse.ArgumentParser(description="事件紀錄工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    show_parser = subparsers.add_parser('show', help="依序列出一場遊戲的事件")
+    show_parser.add_argument('chat_id')
+    show_parser.add_argument('--directory', default='game_events')
+    bench_parser = subparsers.add_parser('bench', help="寫入量與重播速度測試")
+    bench_parser.add_argument('--commands', type=int, default=5000)
+    bench_parser.add_argument('--snapshot-every', type=int, nargs='+', default=[10, 50, 200])
+    bench_parser.add_argument('--loads', type=int, default=200)
+    bench_parser.add_argument('--seed', type=int, default=0)
+    bench_parser.add_argument('--directory', default='bench_game_events')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        show(args)
+    else:
+        try:
+            bench(args)
+        finally:
+            shutil.rmtree(args.directory, ignore_errors=True)
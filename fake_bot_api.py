@@ -0,0 +1,121 @@
+# 離線測試用的 Telegram Bot API 替身，模擬網路延遲與 flood limit (429)
+
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import defaultdict, deque
+
+from telegram import User
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from send_scheduler import SendScheduler
+
+
+class FakeBot:
+    def __init__(self,
+                 per_chat_limit: int = 1,
+                 global_limit: int = 30,
+                 window: float = 1.0,
+                 latency: float = 0.03,
+                 tolerance: float = 0.05):
+        self.per_chat_limit = per_chat_limit  # 每個 chat 每 window 秒最多幾則
+        self.global_limit = global_limit  # 全部 chat 每 window 秒最多幾則
+        self.window = window
+        self.latency = latency  # 模擬 API 往返時間（秒）
+        self.tolerance = tolerance  # 計時誤差容許值
+        self._chat_sent = defaultdict(deque)  # chat_id: 送出時間
+        self._global_sent = deque()
+        self.messages = defaultdict(list)  # chat_id: [text]
+        self.accepted = 0
+        self.rejected = 0  # 回傳 429 的次數
+
+    def _expire(self, sent: deque, now: float):
+        while sent and sent[0] <= now - self.window + self.tolerance:
+            sent.popleft()
+
+    async def send_message(self, chat_id: int, text: str):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        now = time.monotonic()
+        chat_sent = self._chat_sent[chat_id]
+        self._expire(chat_sent, now)
+        self._expire(self._global_sent, now)
+        if len(chat_sent) >= self.per_chat_limit or len(self._global_sent) >= self.global_limit:
+            self.rejected += 1
+            oldest = chat_sent[0] if len(chat_sent) >= self.per_chat_limit else self._global_sent[0]
+            raise RetryAfter(max(1, math.ceil(oldest + self.window - now)))
+        chat_sent.append(now)
+        self._global_sent.append(now)
+        self.messages[chat_id].append(text)
+        self.accepted += 1
+
+
+# 不連線 Telegram 的 bot（壓力測試用）：get_me 回傳固定的帳號，送出訊息只模擬延遲並計數
+class OfflineBot(ExtBot):
+    def __init__(self, token: str = "0:offline", latency: float = 0.03):
+        super().__init__(token)
+        self._latency = latency
+        self._sent = 0
+
+    async def get_me(self, *args, **kwargs) -> User:
+        self._bot_user = User(0, "PayUpPal", True, username="payuppal_offline_bot")
+        return self._bot_user
+
+    async def send_message(self, chat_id: int, text: str, *args, **kwargs):
+        await asyncio.sleep(self._latency * random.uniform(0.5, 1.5))
+        self._sent += 1
+
+
+async def run_direct(bot: FakeBot, chats: int, messages: int):
+    """沒有排程，每則訊息直接送出，被限速就算失敗"""
+    async def send(chat_id, i):
+        try:
+            await bot.send_message(chat_id, f"{chat_id}-{i}")
+        except RetryAfter:
+            pass
+
+    async def chat_task(chat_id):
+        for i in range(messages):
+            await send(chat_id, i)
+
+    await asyncio.gather(*(chat_task(c) for c in range(chats)))
+
+
+async def run_scheduled(bot: FakeBot, chats: int, messages: int, info_ratio: float):
+    scheduler = SendScheduler()
+    scheduler.start(bot.send_message)
+    futures = []
+    for i in range(messages):
+        for chat_id in range(chats):
+            priority = 1 if random.random() < info_ratio else 0
+            futures.append(scheduler.submit(chat_id, f"{chat_id}-{i}", priority))
+    await asyncio.gather(*futures)
+    await scheduler.close()
+    return scheduler
+
+
+async def main(args):
+    for name in ('direct', 'scheduled'):
+        bot = FakeBot(latency=args.latency)
+        start = time.perf_counter()
+        if name == 'direct':
+            await run_direct(bot, args.chats, args.messages)
+            extra = ''
+        else:
+            scheduler = await run_scheduled(bot, args.chats, args.messages, args.info_ratio)
+            extra = f" retried={scheduler.retried} failed={scheduler.failed}"
+        elapsed = time.perf_counter() - start
+        total = args.chats * args.messages
+        print(f"{name:>9}: {bot.accepted}/{total} 則送達，429 {bot.rejected} 次，"
+              f"{elapsed:.2f} 秒，{bot.accepted / elapsed:.1f} 則/秒{extra}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="用假的 Bot API 測試送出排程的吞吐量與 429 行為")
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.03)
+    parser.add_argument('--info-ratio', type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,370 @@
+# 離線測試用的 Firestore 非同步 client 替身，資料只存在記憶體中，可模擬網路延遲
+
+import argparse
+import asyncio
+import copy
+import itertools
+import logging
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+_clock = itertools.count(1)  # 文件的更新時間，每次寫入遞增，不會有兩次寫入相同
+
+
+class FakeWriteResult:
+    def __init__(self, update_time: int):
+        self.update_time = update_time
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time=None, exists: bool = None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, id: str, data: dict | None, update_time: int = None):
+        self.id = id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> dict | None:
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path: str):
+        # 與 Firestore 相同，欄位不存在時丟出 KeyError
+        return copy.deepcopy(self._data[field_path])
+
+
+class FakeDocumentReference:
+    def __init__(self, client: 'FakeAsyncClient', collection: str, id: str):
+        self._client = client
+        self._collection = collection
+        self.id = id
+
+    @property
+    def _documents(self) -> Dict[str, dict]:
+        return self._client.data[self._collection]
+
+    @property
+    def _update_times(self) -> Dict[str, int]:
+        return self._client.update_times[self._collection]
+
+    def _snapshot(self, field_paths: List[str] = None) -> FakeDocumentSnapshot:
+        data = self._documents.get(self.id)
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeDocumentSnapshot(self.id, data, self._update_times.get(self.id))
+
+    def _written(self) -> FakeWriteResult:
+        self._client.writes += 1
+        update_time = self._update_times[self.id] = next(_clock)
+        return FakeWriteResult(update_time)
+
+    async def get(self, field_paths: List[str] = None) -> FakeDocumentSnapshot:
+        await self._client._round_trip()
+        self._client.reads += 1
+        return self._snapshot(field_paths)
+
+    async def create(self, data: dict) -> FakeWriteResult:
+        await self._client._round_trip()
+        if self.id in self._documents:
+            raise AlreadyExists(f"Document already exists: {self._collection}/{self.id}")
+        return self._set(data)
+
+    async def set(self, data: dict) -> FakeWriteResult:
+        await self._client._round_trip()
+        return self._set(data)
+
+    async def update(self, field_updates: Dict[str, object], option: FakeWriteOption = None) -> FakeWriteResult:
+        await self._client._round_trip()
+        return self._update(field_updates, option)
+
+    async def delete(self):
+        await self._client._round_trip()
+        self._delete()
+
+    def _set(self, data: dict) -> FakeWriteResult:
+        self._documents[self.id] = copy.deepcopy(data)
+        return self._written()
+
+    def _update(self, field_updates: Dict[str, object], option: FakeWriteOption = None) -> FakeWriteResult:
+        # 與 Firestore 相同：文件不存在時 update 會失敗
+        if self.id not in self._documents:
+            raise NotFound(f"No document to update: {self._collection}/{self.id}")
+        if option is not None and option.last_update_time is not None \
+                and self._update_times.get(self.id) != option.last_update_time:
+            raise FailedPrecondition(f"The document was modified: {self._collection}/{self.id}")
+        document = self._documents[self.id]
+        for path, value in field_updates.items():
+            keys = FieldPath.from_api_repr(path).parts
+            target = document
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = copy.deepcopy(value)
+        return self._written()
+
+    def _delete(self):
+        self._client.writes += 1
+        self._documents.pop(self.id, None)
+        self._update_times.pop(self.id, None)
+
+
+class FakeQuery:
+    # 只支援 ==、> 條件、select 與 limit
+    def __init__(self, client: 'FakeAsyncClient', collection: str, filters=(), projection=None, limit=None):
+        self._client = client
+        self._collection = collection
+        self._filters = filters
+        self._projection = projection
+        self._limit = limit
+
+    def _copy(self, **changes) -> 'FakeQuery':
+        fields = dict(filters=self._filters, projection=self._projection, limit=self._limit)
+        fields.update(changes)
+        return FakeQuery(self._client, self._collection, **fields)
+
+    def where(self, *, filter) -> 'FakeQuery':
+        if filter.op_string not in ('==', '>'):
+            raise NotImplementedError(f"不支援的條件: {filter.op_string}")
+        return self._copy(filters=self._filters + ((filter.field_path, filter.op_string, filter.value),))
+
+    @staticmethod
+    def _matches(data: dict, field: str, op: str, value) -> bool:
+        if field not in data:
+            return False
+        if op == '==':
+            return data[field] == value
+        # 和 Firestore 一樣，型別不同的值不會符合範圍條件
+        actual = data[field]
+        return isinstance(actual, (int, float)) == isinstance(value, (int, float)) and actual > value
+
+    def select(self, field_paths) -> 'FakeQuery':
+        return self._copy(projection=[path for path in field_paths if path != FieldPath.document_id()])
+
+    def limit(self, count: int) -> 'FakeQuery':
+        return self._copy(limit=count)
+
+    async def stream(self):
+        await self._client._round_trip()
+        matched = 0
+        for id, data in list(self._client.data[self._collection].items()):
+            if self._limit is not None and matched >= self._limit:
+                break
+            if all(self._matches(data, *condition) for condition in self._filters):
+                matched += 1
+                self._client.reads += 1
+                if self._projection is not None:
+                    data = {field: data[field] for field in self._projection if field in data}
+                yield FakeDocumentSnapshot(id, data)
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client: 'FakeAsyncClient', name: str):
+        super().__init__(client, name)
+        self.name = name
+
+    def document(self, id: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self._client, self.name, id)
+
+
+class FakeWriteBatch:
+    def __init__(self, client: 'FakeAsyncClient'):
+        self._client = client
+        self._writes = []
+        self._updated: List[FakeDocumentReference] = []  # update 的文件，commit 前檢查是否存在
+
+    def set(self, reference: FakeDocumentReference, data: dict):
+        self._writes.append((reference._set, data))
+
+    def update(self, reference: FakeDocumentReference, field_updates: Dict[str, object]):
+        self._writes.append((reference._update, field_updates))
+        self._updated.append(reference)
+
+    def delete(self, reference: FakeDocumentReference):
+        self._writes.append((reference._delete,))
+
+    async def commit(self):
+        if len(self._writes) > 500:
+            raise ValueError("一個 batch 最多 500 筆寫入")
+        await self._client._round_trip()
+        # 與 Firestore 相同：batch 是原子操作，有 update 的文件不存在時全部不寫入
+        for reference in self._updated:
+            if reference.id not in reference._documents:
+                raise NotFound(f"No document to update: {reference._collection}/{reference.id}")
+        for write, *args in self._writes:
+            write(*args)
+        self._writes.clear()
+        self._updated.clear()
+
+
+# 介面與 google.cloud.firestore.AsyncClient 相同的部分，多個 client 可共用同一份資料
+class FakeAsyncClient:
+    def __init__(self,
+                 data: Dict[str, Dict[str, dict]] = None,
+                 latency: float = 0.0,
+                 update_times: Dict[str, Dict[str, int]] = None):
+        self.data = data if data is not None else defaultdict(dict)  # collection: {document id: 資料}
+        self.update_times = update_times if update_times is not None else defaultdict(dict)  # collection: {document id: 更新時間}
+        self.latency = latency  # 每次往返的平均延遲（秒）
+        self.reads = 0
+        self.writes = 0
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    @staticmethod
+    def pool(size: int, latency: float = 0.0) -> List['FakeAsyncClient']:
+        """共用同一份資料的多個 client，模擬連線池或多台機器連到同一個資料庫"""
+        data, update_times = defaultdict(dict), defaultdict(dict)
+        return [FakeAsyncClient(data, latency, update_times) for _ in range(size)]
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def write_option(self, **kwargs) -> FakeWriteOption:
+        return FakeWriteOption(**kwargs)
+
+    async def get_all(self, references: List[FakeDocumentReference]):
+        # 一次往返取得多份文件
+        await self._round_trip()
+        for reference in references:
+            self.reads += 1
+            yield reference._snapshot()
+
+    def close(self):
+        pass
+
+
+async def compare_latency(args):
+    """比較在 event loop 中同步讀取與非同步讀取：一個群組的慢速讀取是否拖慢其他群組"""
+    from async_repository import AsyncFirestoreGameStateRepository
+
+    clients = FakeAsyncClient.pool(args.pool_size, args.latency)
+    data = clients[0].data
+    repository = AsyncFirestoreGameStateRepository(clients)
+    await repository.save_many({str(chat_id): {'started': True, 'chat': chat_id} for chat_id in range(args.chats)})
+
+    def blocking_load(chat_id):
+        # 舊版 firestore.client() 的行為：等待網路時整個 event loop 停住
+        time.sleep(args.latency)
+        return data['PayUpPal'].get(str(chat_id))
+
+    async def command(load, chat_id, arrived):
+        # 從指令到達開始計算，包含等待其他群組的時間
+        state = await load(chat_id)
+        assert state['chat'] == chat_id
+        return time.perf_counter() - arrived
+
+    async def sync_load(chat_id):
+        return blocking_load(chat_id)
+
+    for name, load in (('blocking', sync_load), ('async', repository.load_game_state)):
+        start = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(command(load, chat_id, start) for chat_id in range(args.chats))))
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {args.chats} 個群組同時載入 {elapsed:.2f} 秒，"
+              f"p50 {latencies[len(latencies) // 2] * 1000:.0f} ms，max {latencies[-1] * 1000:.0f} ms")
+
+
+async def compare_replicas(args):
+    """多個 bot 實例同時修改同一批群組：直接覆蓋會遺失更新，版本比對寫入在衝突時重新載入再執行"""
+    from async_repository import AsyncFirestoreGameStateRepository
+    from game_setting import START_MONEY
+    from game_state import GameState
+    from game_state_repository import VersionConflict
+    from sharding import HashRing
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def discard(message):
+        pass
+
+    async def run(cas: bool, ring: HashRing = None):
+        clients = FakeAsyncClient.pool(args.replicas, args.latency)
+        replicas = [AsyncFirestoreGameStateRepository([client]) for client in clients]
+        for chat_id in range(args.chats):
+            game = GameState(discard)
+            await game.add_player("玩家", 1)
+            await replicas[0].save_game_state(str(chat_id), {**game.to_dict(), '_version': 0})
+
+        conflicts = 0
+
+        async def command(repository: AsyncFirestoreGameStateRepository, games: dict, chat_id: int):
+            # 一個指令：讓玩家的錢加 1
+            nonlocal conflicts
+            for _ in range(args.retries + 1):
+                if chat_id not in games:
+                    games[chat_id] = GameState.from_dict(await repository.load_game_state(str(chat_id)), discard)
+                game = games[chat_id]
+                game.players[0].money += 1
+                if not cas:
+                    await repository.update_game_state(str(chat_id), game.collect_delta())
+                    game.mark_clean()
+                    return
+                try:
+                    game.version = await repository.compare_and_save(str(chat_id), game.version,
+                                                                     delta=game.collect_delta())
+                    game.mark_clean()
+                    return
+                except VersionConflict:
+                    conflicts += 1
+                    games.pop(chat_id, None)
+            raise RuntimeError(f"chat_id: {chat_id} 重試 {args.retries} 次仍然衝突")
+
+        caches = [{} for _ in replicas]  # 每個實例記憶體中的遊戲
+        locks = [defaultdict(asyncio.Lock) for _ in replicas]  # 與 bot 相同，同一個實例中每個群組一次一個指令
+
+        async def replica(index: int):
+            rng = random.Random(index)
+            for _ in range(args.commands):
+                chat_id = rng.randrange(args.chats)
+                if ring is not None:
+                    # 指令轉給負責這個群組的實例執行
+                    index = int(ring.node_for(chat_id))
+                async with locks[index][chat_id]:
+                    await command(replicas[index], caches[index], chat_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(replica(i) for i in range(len(replicas))))
+        elapsed = time.perf_counter() - start
+        states = await replicas[0].load_many(str(chat_id) for chat_id in range(args.chats))
+        applied = sum(GameState.from_dict(state, discard).players[0].money - START_MONEY for state in states.values())
+        return elapsed, applied, conflicts, sum(client.reads for client in clients)
+
+    total = args.replicas * args.commands
+    print(f"{args.replicas} 個實例各執行 {args.commands} 個指令，共 {total} 次加 1，分散在 {args.chats} 個群組")
+    ring = HashRing(str(i) for i in range(args.replicas))
+    for name, cas, routing in (('直接覆蓋', False, None), ('版本比對', True, None), ('版本比對 + 一致性雜湊', True, ring)):
+        elapsed, applied, conflicts, reads = await run(cas, routing)
+        print(f"{name}: 結果 {applied}（遺失 {total - applied}），衝突重試 {conflicts} 次，"
+              f"讀取 {reads} 次，耗時 {elapsed:.2f} 秒")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="用假的 Firestore 測試非同步讀取與多個 bot 實例共用資料庫")
+    parser.add_argument('scenario', nargs='?', choices=['latency', 'replicas'], default='latency')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--replicas', type=int, default=3, help="replicas：bot 實例數")
+    parser.add_argument('--commands', type=int, default=200, help="replicas：每個實例執行的指令數")
+    parser.add_argument('--retries', type=int, default=10, help="replicas：衝突時最多重新執行幾次")
+    args = parser.parse_args()
+    asyncio.run(compare_latency(args) if args.scenario == 'latency' else compare_replicas(args))
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from game_state import GameState
+
+
+class _CacheEntry:
+    __slots__ = ('game', 'lock', 'last_access', 'users', 'stale')
+
+    def __init__(self):
+        self.game: Optional[GameState] = None  # 尚未載入時為 None
+        self.lock = asyncio.Lock()
+        self.last_access = time.monotonic()
+        self.users = 0  # 正在使用（等待或持有鎖）的指令數量
+        self.stale = False  # 使用中被標記為過期，指令結束時才丟掉遊戲
+
+
+# 有上限的遊戲快取：依最近使用順序 (LRU) 與閒置時間淘汰，鎖跟著遊戲一起清除
+class GameCache:
+    def __init__(self,
+                 max_size: int = 10000,
+                 idle_ttl: float = 1800,
+                 on_evict: Callable[[int, GameState], Awaitable[None]] = None,
+                 on_invalidate: Callable[[int], None] = None):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl  # 閒置多久（秒）後淘汰
+        self.on_evict = on_evict  # 淘汰前呼叫，用來把遊戲狀態寫回資料庫，失敗時丟出例外會保留遊戲
+        self.on_invalidate = on_invalidate  # 過期的遊戲真正丟掉時呼叫（重新載入之前），例如捨棄尚未寫入的變動
+        self._entries: OrderedDict[int, _CacheEntry] = OrderedDict()
+        self._loading: Dict[int, asyncio.Task] = {}  # chat_id: 載入中的任務，同一個 chat 同時只載入一次
+        self._sweeping = False
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計數據
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0  # 從資料庫載入的次數
+        self.coalesced_loads = 0  # 等待其他指令正在進行的載入，不重複讀取的次數
+        self.warmed = 0  # 啟動時預先載入的遊戲數
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _touch(self, chat_id: int, entry: _CacheEntry):
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(chat_id)
+
+    def acquire(self, chat_id: int) -> asyncio.Lock:
+        """指令開始時呼叫，回傳該 chat 的鎖；使用中的遊戲不會被淘汰"""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            entry = self._entries[chat_id] = _CacheEntry()
+        entry.users += 1
+        self._touch(chat_id, entry)
+        return entry.lock
+
+    def release(self, chat_id: int):
+        """指令結束時呼叫"""
+        entry = self._entries[chat_id]
+        entry.users -= 1
+        self._touch(chat_id, entry)
+        # 等待中的指令要取得鎖後才會讀取遊戲，這時丟掉就會拿到重新載入的版本
+        if entry.stale:
+            self._drop(chat_id, entry)
+
+    def in_use(self, chat_id: int) -> bool:
+        """是否有指令正在使用（等待或持有鎖）"""
+        entry = self._entries.get(chat_id)
+        return entry is not None and entry.users > 0
+
+    def waiting(self) -> int:
+        """正在等待其他指令釋放鎖的指令數"""
+        return sum(entry.users - 1 for entry in self._entries.values() if entry.lock.locked() and entry.users > 1)
+
+    def get(self, chat_id: int) -> Optional[GameState]:
+        entry = self._entries.get(chat_id)
+        if entry is None or entry.game is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(chat_id, entry)
+        return entry.game
+
+    def peek(self, chat_id: int) -> Optional[GameState]:
+        """不影響統計與使用順序的讀取"""
+        entry = self._entries.get(chat_id)
+        return entry.game if entry else None
+
+    async def load(self, chat_id: int, loader: Callable[[int], Awaitable[GameState]]) -> GameState:
+        """取得遊戲，不在記憶體中時以 loader 載入；同一個 chat 同時有多個指令時只會載入一次"""
+        game = self.get(chat_id)
+        if game is not None:
+            return game
+        task = self._loading.get(chat_id)
+        if task is None:
+            self.loads += 1
+            task = self._loading[chat_id] = asyncio.create_task(loader(chat_id))
+            task.add_done_callback(lambda t: self._loaded(chat_id, t))
+        else:
+            self.coalesced_loads += 1
+        # 其中一個指令被取消不會中斷載入，其他等待的指令仍會拿到結果
+        game = await asyncio.shield(task)
+        return self.peek(chat_id) or game
+
+    def _loaded(self, chat_id: int, task: asyncio.Task):
+        del self._loading[chat_id]
+        if task.cancelled() or task.exception() is not None:
+            return
+        # 載入期間已經有遊戲放進來（例如預先載入），以記憶體中的為準
+        if self.peek(chat_id) is None:
+            self.put(chat_id, task.result())
+
+    async def warm_up(self,
+                      chat_ids: List[int],
+                      load_batch: Callable[[List[int]], Awaitable[Dict[int, GameState]]],
+                      batch_size: int = 100,
+                      concurrency: int = 4) -> int:
+        """分批載入多個遊戲（例如啟動時載入所有進行中的遊戲），回傳實際放入的數量"""
+        chat_ids = [chat_id for chat_id in chat_ids if self.peek(chat_id) is None][:self.max_size]
+        semaphore = asyncio.Semaphore(concurrency)
+        warmed = 0
+
+        async def warm(batch: List[int]):
+            nonlocal warmed
+            async with semaphore:
+                games = await load_batch(batch)
+            for chat_id, game in games.items():
+                # 載入期間已經有指令載入或修改了遊戲，不要覆蓋
+                if self.peek(chat_id) is None and chat_id not in self._loading:
+                    self.put(chat_id, game)
+                    warmed += 1
+
+        await asyncio.gather(*(warm(chat_ids[i:i + batch_size]) for i in range(0, len(chat_ids), batch_size)))
+        self.warmed += warmed
+        return warmed
+
+    def invalidate(self, chat_id: int, force: bool = False):
+        """丟掉記憶體中的遊戲（例如已經不是最新版本），下次使用時重新載入；鎖保留給正在等待的指令
+        有指令正在使用時延到指令結束，避免指令改動的遊戲和重新載入的遊戲同時存在；
+        持有鎖的指令自己要重新載入時使用 force 立即丟掉"""
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return
+        if entry.users and not force:
+            entry.stale = True
+        else:
+            self._drop(chat_id, entry)
+
+    def _drop(self, chat_id: int, entry: _CacheEntry):
+        entry.game = None
+        entry.stale = False
+        if self.on_invalidate is not None:
+            self.on_invalidate(chat_id)
+
+    def put(self, chat_id: int, game: GameState):
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            entry = self._entries[chat_id] = _CacheEntry()
+        entry.game = game
+        self._touch(chat_id, entry)
+
+    async def sweep(self):
+        """淘汰超過上限或閒置過久的遊戲，最舊的排在最前面，通常只需檢查第一筆"""
+        if self._sweeping:
+            return
+        self._sweeping = True
+        try:
+            now = time.monotonic()
+            budget = len(self._entries)  # 每筆最多檢查一次，避免全部使用中時無限循環
+            while self._entries and budget > 0:
+                chat_id, entry = next(iter(self._entries.items()))
+                over_size = len(self._entries) > self.max_size
+                idle = now - entry.last_access >= self.idle_ttl
+                if not over_size and not idle:
+                    break
+                budget -= 1
+                if entry.users:
+                    # 使用中的遊戲視為最近使用
+                    self._entries.move_to_end(chat_id)
+                    continue
+                await self._evict(chat_id, entry)
+        finally:
+            self._sweeping = False
+
+    async def _evict(self, chat_id: int, entry: _CacheEntry):
+        last_access = entry.last_access
+        if entry.game is not None and self.on_evict is not None:
+            try:
+                await self.on_evict(chat_id, entry.game)
+            except Exception:
+                logging.exception(f"淘汰遊戲前儲存失敗，保留 chat_id: {chat_id}")
+                self._touch(chat_id, entry)
+                return
+        # 儲存期間有新的指令進來，這次不淘汰
+        if entry.users or entry.last_access != last_access or self._entries.get(chat_id) is not entry:
+            return
+        del self._entries[chat_id]
+        self.evictions += 1
+
+    def start(self, interval: float = None):
+        """定時清除閒置的遊戲"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval or min(60, self.idle_ttl)))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logging.exception("清除閒置遊戲失敗")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'loads': self.loads,
+            'coalesced_loads': self.coalesced_loads,
+            'warmed': self.warmed,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
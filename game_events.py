@@ -0,0 +1,48 @@
+# 遊戲中發生的領域事件，記錄「發生了什麼」，用於事件紀錄與重播爭議的遊戲
+
+# 事件種類
+JOINED = 'joined'  # u, name
+STARTED = 'started'  # order
+ROLLED = 'rolled'  # u, dice
+MOVED = 'moved'  # u, position
+PASSED_GO = 'passed_go'  # u, amount
+JAILED = 'jailed'  # u, turns
+JAIL_WAIT = 'jail_wait'  # u, turns（剩餘回合）
+CHANCE = 'chance'  # u, card
+BOUGHT = 'bought'  # u, square, price
+SOLD = 'sold'  # u, square, price
+UPGRADED = 'upgraded'  # u, square, level, cost
+DOWNGRADED = 'downgraded'  # u, square, level, refund
+MORTGAGED = 'mortgaged'  # u, square, amount
+RENT_PAID = 'rent_paid'  # u, to, amount
+DEBT = 'debt'  # u, to, amount（付不出租金或罰款，記入欠款；to 為 None 表示欠銀行）
+DEBT_PAID = 'debt_paid'  # u, to, amount
+BANKRUPT = 'bankrupt'  # u
+TURN = 'turn'  # u（輪到的玩家）
+WON = 'won'  # u, money
+RESET = 'reset'
+BOARD_CHOSEN = 'board_chosen'  # board, version（棋盤模板 id 與版本）
+TIMEOUT_SET = 'timeout_set'  # seconds, action（回合時間限制，0 表示關閉）
+TIMED_OUT = 'timed_out'  # u, action（超過時間沒有動作，自動擲骰子或跳過）
+
+
+class GameEvent:
+    __slots__ = ('type', 'data')
+
+    def __init__(self, type: str, **data):
+        self.type = type
+        self.data = data  # 只放 id、位置、金額等基本型別，方便序列化
+
+    def to_dict(self) -> dict:
+        return {'type': self.type, **self.data}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'GameEvent':
+        data = dict(data)
+        return GameEvent(data.pop('type'), **data)
+
+    def __repr__(self):
+        return f"GameEvent({self.type}, {self.data})"
+
+    def __eq__(self, other):
+        return isinstance(other, GameEvent) and self.type == other.type and self.data == other.data
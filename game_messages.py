@@ -0,0 +1,144 @@
+# 把規則核心的結果（Outcome）與遊戲狀態轉成要送給玩家的中文訊息
+
+from typing import Callable, Dict, List, Union
+
+from base import Player, Square, SquareType
+from board import BoardTemplate
+from game_outcomes import *
+
+RAISE_CASH_HINT = "使用 /mortgage 抵押地產\n使用 /downgrade 降級地產\n使用 /sell 出售地產\n或使用 /autopay 自動以損失最小的方式變賣並支付"
+BANK = "銀行"
+ACTION_NAMES = {'upgrade': '升級', 'downgrade': '降級', 'mortgage': '再次抵押'}
+TIMEOUT_ACTION_NAMES = {'roll': '自動擲骰子', 'skip': '跳過這回合'}
+
+
+def _sold(data: dict) -> str:
+    state = '（抵押中）' if data['mortgaged'] else f" level: {data['level']}"
+    return f"{data['name']} 出售 {data['square']}{state} {data['price']} 元！"
+
+
+# 結果種類: 訊息模板（以 data 填入），或由 data 產生訊息的函數
+MESSAGES: Dict[str, Union[str, Callable[[dict], str]]] = {
+    JOIN_CLOSED: "遊戲已經開始，無法加入。",
+    ALREADY_JOINED: "{name} 已經加入遊戲！",
+    JOINED: "{name} 加入遊戲！",
+    GAME_FULL: "玩家人數已滿，無法加入。",
+    ALREADY_STARTED: "遊戲已經開始。",
+    NOT_ENOUGH_PLAYERS: "至少需要兩名玩家才能開始遊戲。",
+    STARTED: "遊戲開始！",
+    PLAYER_ORDER: lambda data: '玩家順序\n' + '\n'.join(f"{i+1}. {name}" for i, name in enumerate(data['names'])),
+    NOT_STARTED: "遊戲尚未開始。",
+    NOT_YOUR_TURN: "現在不是你的回合！",
+    NOT_JOINED: "你還沒有加入遊戲，使用 /join 加入。",
+    JAIL_WAIT: "{name}在監獄中，無法擲骰子。\n還需{turns}回合才能出獄。",
+    ALREADY_ROLLED: "{name} 已經擲過骰子了！",
+    NOT_ROLLED: "請先擲骰子！",
+    ROLLED: "{name} 擲出了 {dice} 點！",
+    MOVED: "移動到了 {square}！",
+    PASSED_GO: "{name} 經過起點，獲得 {amount} 元！",
+    JAILED: "{name} 被送進監獄！",
+    CHANCE: "{card}",
+    CHANCE_GAIN: "{name} 獲得了 {amount} 元獎金！",
+    FINE_PAID: "{name} 繳交了 {amount} 元罰款！",
+    FINE_UNPAID: "{name} 無法繳交罰款！\n" + RAISE_CASH_HINT,
+    VACANT: "這是一塊空地！價格: {price} 元\n使用 /buy 購買此地產",
+    OWN_SQUARE: "{name} 擁有這塊地產！\n使用 /upgrade 升級此地產。升級價格: {cost} 元",
+    RENT_DUE: lambda data: (f"{data['name']} 需要支付 {data['amount']} 元租金給 {data['owner']}！"
+                            + ("（擁有全部同色地產）" if data['monopoly'] else "")),
+    NO_RENT: "{square} 抵押中，{name} 不用支付租金！",
+    RENT_PAID: "{name} 支付了租金！",
+    DEBT: "{name} 無法支付租金！\n" + RAISE_CASH_HINT,
+    NOT_HERE: "{square} 不是你當前的位置！",
+    NOT_PROPERTY: "{square} 不是地產！",
+    OWNED: "{square} 已經被 {owner} 擁有！",
+    NOT_OWNER: "{square} 不是你的地產！",
+    CANNOT_AFFORD: "{name} 無法購買 {square}！\n" + RAISE_CASH_HINT,
+    BOUGHT: "{name} 購買了 {square}！",
+    SOLD: _sold,
+    IS_MORTGAGED: lambda data: f"{data['square']} 已經抵押了，無法{ACTION_NAMES[data['action']]}！",
+    IS_UPGRADED: "{square} 已經升級了，無法抵押！",
+    MAX_LEVEL: "{square} 已經是最高級了！",
+    MIN_LEVEL: "{square} 已經是最低級了！",
+    UPGRADE_UNAFFORDABLE: "{name} 沒有足夠的錢來升級 {square}！",
+    UPGRADED: "{name} 升級了 {square} 到 {level} 級！",
+    DOWNGRADED: "{name} 降級 {square} 到 {level} 級！",
+    MORTGAGED: "{name} 抵押了 {square}！",
+    NO_DEBT: "{name} 沒有欠款！",
+    AUTOPAY: "{name} 自動變賣地產，共籌得 {cash} 元！",
+    MUST_SELL: "{name} 的金額不足！ 請變賣地產！",
+    BANKRUPT: "{name} 已破產！",
+    DEBT_PAID: lambda data: f"{data['name']} 支付了 {data['amount']} 元給 {data['to'] or BANK}！",
+    WON: "{name} 獲勝了！ 共有 {money} 元！",
+    UNSETTLED_DEBT: "{name} 你有未結清的債務！",
+    TURN: "輪到 {name} 了！",
+    SKIP_BANKRUPT: "{name} 已破產！自動跳下一位玩家。",
+    ALL_BANKRUPT: "所有玩家都已破產，遊戲結束！",
+    RESET: "遊戲已重置！",
+    BOARD_CHOSEN: "已換成「{board}」棋盤（{squares} 格）！",
+    TIMEOUT_SET: lambda data: (f"已設定{format_turn_timeout(data['seconds'], data['action'])}！"
+                               if data['seconds'] else "已關閉回合時間限制！"),
+    TIMEOUT_INVALID: "時間限制必須是 {min} ~ {max} 秒（0 或 off 表示關閉）！",
+    TIMED_OUT: lambda data: f"{data['name']} 超過 {data['seconds']} 秒沒有動作，{TIMEOUT_ACTION_NAMES[data['action']]}！",
+    TIMEOUT_PAUSED: "所有玩家都沒有回應，暫停回合計時，任何玩家操作後繼續。",
+}
+
+
+def render(outcome: Outcome) -> str:
+    message = MESSAGES[outcome.type]
+    if callable(message):
+        return message(outcome.data)
+    return message.format(**outcome.data)
+
+
+def render_all(outcomes: List[Outcome]) -> List[str]:
+    return [render(outcome) for outcome in outcomes]
+
+
+def format_player_info(player: Player, board: List[Square], ledger: dict) -> str:
+    message = [f"{player.name}:{player.user_id}，現金: {player.money} 元"]
+    message.append(f"當前位置: {board[player.position].name}")
+    if player.properties:
+        message.append(f"地產: {'\n'.join([f'\t{p.name} level: {p.level}' for p in player.properties.values()])}")
+    if player.mortgage_properties:
+        message.append(f"抵押地產: {'\n'.join([p.name for p in player.mortgage_properties.values()])}")
+    if ledger:
+        message.append(f"欠{ledger['to'].name if ledger['to'] else BANK}{ledger['amount']} 元")
+    return '\n'.join(message)
+
+
+def format_players(players: List[Player]) -> str:
+    players_info = ["目前玩家: "]
+    for player in players:
+        players_info.append(f"  {player.name}:{player.user_id}，現金: {player.money} 元")
+    return '\n'.join(players_info)
+
+
+def format_turn_timeout(seconds: int, action: str) -> str:
+    if not seconds:
+        return "沒有回合時間限制"
+    return f"回合時間限制 {seconds} 秒，逾時{TIMEOUT_ACTION_NAMES[action]}"
+
+
+def format_board_choices(templates: List[BoardTemplate], current: BoardTemplate) -> str:
+    lines = ["可選擇的棋盤（遊戲開始前使用 /map <代號> 更換）: "]
+    for template in templates:
+        properties = sum(1 for square_type in template.types if square_type == SquareType.PROPERTY)
+        line = f"  {template.id}: {template.name}，{len(template)} 格，{properties} 塊地產"
+        if template.id == current.id:
+            line += "（目前）"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def format_board(board: List[Square]) -> str:
+    board_info = ["遊戲板: "]
+    for i, square in enumerate(board):
+        line = f"{i:2}: {square.name}"
+        if square.spec.price and square.owner is None:
+            line += f" ({square.spec.price})"
+        if square.owner:
+            line += f" {square.owner.name} level: {square.level}"
+        if square.mortgaged:
+            line += " (抵押中)"
+        board_info.append(line)
+    return '\n'.join(board_info)
@@ -0,0 +1,69 @@
+# 規則核心執行指令的結果，記錄「要告訴玩家什麼」，由 game_messages 轉成文字
+# 與領域事件（game_events）不同：包含被拒絕的指令與提示，且資料放的是顯示用的名稱，不會存進資料庫
+
+from typing import List
+
+# 與領域事件同名的結果沿用相同的種類
+from game_events import (JOINED, STARTED, ROLLED, MOVED, PASSED_GO, JAILED, JAIL_WAIT, CHANCE, BOUGHT, SOLD,
+                         UPGRADED, DOWNGRADED, MORTGAGED, RENT_PAID, DEBT, DEBT_PAID, BANKRUPT, TURN, WON, RESET,
+                         BOARD_CHOSEN, TIMEOUT_SET, TIMED_OUT)
+
+# 結果種類（註解為 data 的欄位）
+# JOINED: name / STARTED / ROLLED: name, dice / MOVED: square / PASSED_GO: name, amount / JAILED: name
+# JAIL_WAIT: name, turns / CHANCE: card / BOUGHT: name, square / SOLD: name, square, mortgaged, level, price
+# UPGRADED / DOWNGRADED: name, square, level / MORTGAGED: name, square / RENT_PAID: name
+# DEBT: name（付不出租金） / DEBT_PAID: name, amount, to（None 表示銀行） / BANKRUPT: name / TURN: name / WON: name, money / RESET
+# BOARD_CHOSEN: board（棋盤名稱）, squares / TIMEOUT_SET: seconds, action / TIMED_OUT: name, seconds, action
+JOIN_CLOSED = 'join_closed'  # 遊戲已開始，無法加入
+ALREADY_JOINED = 'already_joined'  # name
+GAME_FULL = 'game_full'
+ALREADY_STARTED = 'already_started'
+NOT_ENOUGH_PLAYERS = 'not_enough_players'
+PLAYER_ORDER = 'player_order'  # names
+NOT_STARTED = 'not_started'
+NOT_YOUR_TURN = 'not_your_turn'
+NOT_JOINED = 'not_joined'  # 送出指令的人不是玩家
+ALREADY_ROLLED = 'already_rolled'  # name
+NOT_ROLLED = 'not_rolled'
+CHANCE_GAIN = 'chance_gain'  # name, amount
+FINE_PAID = 'fine_paid'  # name, amount
+FINE_UNPAID = 'fine_unpaid'  # name（付不出機會卡的罰款，記入欠銀行的款項）
+VACANT = 'vacant'  # price（停在空地）
+OWN_SQUARE = 'own_square'  # name, cost（停在自己的地產）
+RENT_DUE = 'rent_due'  # name, amount, owner, monopoly（同色獨佔加倍）
+NO_RENT = 'no_rent'  # name, square（停在別人抵押中的地產）
+NOT_HERE = 'not_here'  # square
+NOT_PROPERTY = 'not_property'  # square
+OWNED = 'owned'  # square, owner
+NOT_OWNER = 'not_owner'  # square
+CANNOT_AFFORD = 'cannot_afford'  # name, square
+IS_MORTGAGED = 'is_mortgaged'  # square, action（upgrade / downgrade / mortgage）
+IS_UPGRADED = 'is_upgraded'  # square（升級過的地產無法抵押）
+MAX_LEVEL = 'max_level'  # square
+MIN_LEVEL = 'min_level'  # square
+UPGRADE_UNAFFORDABLE = 'upgrade_unaffordable'  # name, square
+NO_DEBT = 'no_debt'  # name
+AUTOPAY = 'autopay'  # name, cash（自動變賣地產拿到的錢）
+MUST_SELL = 'must_sell'  # name（錢不夠還債，但還有地產可以變賣）
+UNSETTLED_DEBT = 'unsettled_debt'  # name
+SKIP_BANKRUPT = 'skip_bankrupt'  # name
+ALL_BANKRUPT = 'all_bankrupt'
+TIMEOUT_INVALID = 'timeout_invalid'  # min, max
+TIMEOUT_PAUSED = 'timeout_paused'  # 所有玩家都逾時，暫停計時
+
+
+class Outcome:
+    __slots__ = ('type', 'data')
+
+    def __init__(self, type: str, **data):
+        self.type = type
+        self.data = data
+
+    def __repr__(self):
+        return f"Outcome({self.type}, {self.data})"
+
+    def __eq__(self, other):
+        return isinstance(other, Outcome) and self.type == other.type and self.data == other.data
+
+
+Outcomes = List[Outcome]
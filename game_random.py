@@ -0,0 +1,57 @@
+# 每場遊戲自己的亂數產生器：第 n 個亂數只由 (種子, n) 決定（splitmix64），
+# 存檔只需要種子與已使用的次數，載入後從相同位置繼續，不同行程、重播或回報問題時都能重現同一串骰子與卡牌
+
+import os
+import random
+from typing import Tuple
+
+_MASK = (1 << 64) - 1
+_GAMMA = 0x9E3779B97F4A7C15
+
+
+def _splitmix64(value: int) -> int:
+    z = value & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+
+def new_seed() -> int:
+    return int.from_bytes(os.urandom(8), 'big') >> 1  # 63 位元，Firestore 的整數欄位放得下
+
+
+class GameRandom(random.Random):
+    """random.Random 的子類別，randint、shuffle、choice 等方法照常使用，狀態只有 (seed, position)"""
+
+    def __init__(self, seed: int = None, position: int = 0):
+        super().__init__(seed)
+        self.position = position
+
+    def seed(self, a: int = None, version: int = 2):
+        self._seed = new_seed() if a is None else int(a) & (_MASK >> 1)
+        self.position = 0
+        self.gauss_next = None
+
+    def _next(self) -> int:
+        self.position += 1
+        return _splitmix64(self._seed + self.position * _GAMMA)
+
+    def random(self) -> float:
+        return (self._next() >> 11) * (1.0 / (1 << 53))
+
+    def getrandbits(self, k: int) -> int:
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+        bits = 0
+        filled = 0
+        while filled < k:
+            bits |= self._next() << filled
+            filled += 64
+        return bits & ((1 << k) - 1)
+
+    def getstate(self) -> Tuple[int, int]:
+        return self._seed, self.position
+
+    def setstate(self, state: Tuple[int, int]):
+        self._seed, self.position = state
+        self.gauss_next = None
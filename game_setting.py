@@ -1,3 +1,7 @@
 START_MONEY = 22000
 JAIL_TIME = 2
 PASS_GO_MONEY = 2000
+MONOPOLY_RENT_MULTIPLIER = 2  # 擁有同色的全部地產（且都未抵押）時過路費的倍數
+TURN_TIMEOUT_MIN = 30  # /timeout 可設定的回合時間限制（秒）
+TURN_TIMEOUT_MAX = 86400
+TIMEOUT_ACTIONS = ('roll', 'skip')  # 逾時自動擲骰子 / 跳過這回合
@@ -1,11 +1,15 @@
 import asyncio
-import random
 import logging
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from base import *
-from board import initialize_board
+from board import *
 from chance import *
+from game_events import *
+from game_random import GameRandom
+from liquidation import LiquidationOption, plan_liquidation
+from game_messages import format_board, format_player_info, format_players, render, render_all
+from game_outcomes import *
 
 
 # 設定日誌
@@ -16,17 +20,51 @@ logging.basicConfig(
 
 # 遊戲狀態
 class GameState:
-    def __init__(self, message_handler):
+    # 會變動的頂層欄位，變動時記錄下來只儲存差異
+    TRACKED_FIELDS = ('started', 'current_player_index', 'ledger', 'rolled', 'double_confirm', 'chance_pile',
+                      'turn_timeout', 'timeout_action', 'turn_deadline', 'timed_out_turns')
+
+    def __init__(self, message_handler, board_template: BoardTemplate = DEFAULT_BOARD, seed: int = None):
+        self._dirty = set()  # 上次儲存後變動過的頂層欄位
+        self._full_save = True  # 尚未儲存過完整快照，下次需要存整份
         self.players: List[Player] = []
         self.player_dict: Dict[int, Player] = {}
         self.started = False
         self.current_player_index = 0
-        self.board: List[Square] = initialize_board()
-        self.board_dict: Dict[str, Square] = {square.name: square for square in self.board}
+        self.board_template = board_template  # 共用的棋盤模板
+        self.board: Board = initialize_board(board_template)  # 只建立用到的方格
         self.message_handler = message_handler  # 訊息處理器
         self.ledger = {}  # 紀錄玩家的交易紀錄
         self.rolled = False  # 是否已經擲骰子
         self.double_confirm = False  # 確認是否reeset用
+        self.rng = GameRandom(seed)  # 這場遊戲的骰子與洗牌，種子與位置會存檔，相同種子的遊戲可以完整重現
+        self._saved_rng = self.rng.getstate()
+        self.chance_pile: List[int] = []  # 機會牌堆（CHANCE_CARDS 的編號），從最後面抽
+        self.turn_timeout = 0  # 回合時間限制（秒），0 表示不限制；重置遊戲後保留
+        self.timeout_action = TIMEOUT_ACTIONS[0]  # 逾時時自動擲骰子（roll）或跳過（skip）
+        self.turn_deadline = 0.0  # 目前回合的期限（time.time()），0 表示沒有計時
+        self.timed_out_turns = 0  # 連續逾時的回合數，所有玩家都逾時就暫停計時
+        # 顏色: {user_id: 持有的未抵押地產數}，買賣、抵押、破產時增減，查同色加成不必掃整個棋盤；不存檔，載入時由地產擁有者重建
+        self.group_holdings: Dict[str, Dict[int, int]] = {}
+        self.events: List[GameEvent] = []  # 尚未寫入事件紀錄的領域事件
+        self.version = -1  # 資料庫中的版本號，多個 bot 共用資料庫時用來偵測衝突；-1 表示尚未存檔
+        self.revision = 0  # 記憶體中的狀態版本，每次改變狀態都會增加，用來判斷快取的畫面是否還能用
+        self._views: Dict[tuple, Tuple[int, str]] = {}  # (畫面, user_id): (產生時的 revision, 文字)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.TRACKED_FIELDS:
+            self._dirty.add(name)
+
+    def _emit(self, type: str, **data):
+        # 每個改變狀態的操作都會產生事件，同時讓快取的畫面失效
+        self.events.append(GameEvent(type, **data))
+        self.revision += 1
+
+    def pop_events(self) -> List[GameEvent]:
+        """取出上次儲存後發生的事件"""
+        events, self.events = self.events, []
+        return events
 
     def get_current_player(self) -> Optional[Player]:
         if not self.players:
@@ -40,7 +78,44 @@ class GameState:
         return self.board[position]
     
     def get_square_by_name(self, name: str) -> Optional[Square]:
-        return self.board_dict.get(name)
+        position = self.board_template.positions.get(name)
+        return self.board[position] if position is not None else None
+
+    def _hold(self, square: Square, count: int):
+        """地產擁有者的同色持有數加減 count（只計未抵押的地產）"""
+        if not square.color:
+            return
+        holdings = self.group_holdings.setdefault(square.color, {})
+        total = holdings.get(square.owner.user_id, 0) + count
+        if total:
+            holdings[square.owner.user_id] = total
+        else:
+            del holdings[square.owner.user_id]
+
+    def is_monopoly(self, square: Square) -> bool:
+        """擁有者是否持有這個顏色的全部地產且都未抵押（只有一塊的顏色不算）"""
+        size = self.board_template.groups.get(square.color, 0)
+        if size < 2 or square.owner is None:
+            return False
+        return self.group_holdings.get(square.color, {}).get(square.owner.user_id, 0) == size
+
+    def rent(self, square: Square) -> int:
+        """停在別人地產要付的過路費：抵押中不收，同色獨佔時乘上 MONOPOLY_RENT_MULTIPLIER"""
+        if square.mortgaged:
+            return 0
+        if self.is_monopoly(square):
+            return square.get_rent() * MONOPOLY_RENT_MULTIPLIER
+        return square.get_rent()
+
+    def _release_properties(self, player: Player):
+        """破產玩家剩下的地產回到銀行"""
+        for estate in list(player.properties.values()) + list(player.mortgage_properties.values()):
+            if not estate.mortgaged:
+                self._hold(estate, -1)
+            estate.reset()
+        if player.properties or player.mortgage_properties:
+            player.properties = {}
+            player.mortgage_properties = {}
 
     def check_winner(self) -> Optional[Player]:
         active_players = [p for p in self.players if p.money >= 0]
@@ -48,554 +123,851 @@ class GameState:
             return active_players[0]
         return None
 
-    async def add_player(self, name: str, user_id: int) -> bool:
+    # 規則核心：同步執行指令並回傳結果（Outcome），不產生訊息也不需要 event loop
+    # 模擬與重播直接呼叫 apply_*；bot 使用下方的 async 介面，把結果轉成訊息送出
+
+    def apply_add_player(self, name: str, user_id: int) -> Outcomes:
         logging.info(f"玩家 {name} ，ID: {user_id}")
 
         if self.started:
-            await self.message_handler("遊戲已經開始，無法加入。")
-            return
+            return [Outcome(JOIN_CLOSED)]
 
         # 檢查玩家是否已經加入
         if self.get_player(user_id):
-            await self.message_handler(f"{name} 已經加入遊戲！")
-            return
+            return [Outcome(ALREADY_JOINED, name=name)]
         
         # 檢查玩家人數
-        if len(self.players) < 6:
-            player = Player(name, user_id)
-            self.players.append(player)
-            self.player_dict[user_id] = player
+        if len(self.players) >= 6:
+            return [Outcome(GAME_FULL)]
 
-            await self.message_handler(f"{name} 加入遊戲！")
-        else:
-            await self.message_handler("玩家人數已滿，無法加入。")
+        player = Player(name, user_id)
+        self.players.append(player)
+        self.player_dict[user_id] = player
+        self._dirty.add('players')
+        self._emit(JOINED, u=user_id, name=name)
+        return [Outcome(JOINED, name=name)]
         
-    async def start_game(self):
+    def apply_start_game(self) -> Outcomes:
         if self.started:
-            await self.message_handler("遊戲已經開始。")
-            return
+            return [Outcome(ALREADY_STARTED)]
         
         if len(self.players) < 2:
-            await self.message_handler("至少需要兩名玩家才能開始遊戲。")
-            return
+            return [Outcome(NOT_ENOUGH_PLAYERS)]
 
         self.started = True
-        await self.message_handler("遊戲開始！")
 
         # 隨機洗牌玩家順序
-        random.shuffle(self.players)
-        logging.info("遊戲開始~")
-        await self.message_handler('玩家順序\n' + '\n'.join([f"{i+1}. {player.name}" for i, player in enumerate(self.players)]))
+        self.rng.shuffle(self.players)
+        self._dirty.add('player_order')
+        self._emit(STARTED, order=[p.user_id for p in self.players])
+        logging.info(f"遊戲開始~ 亂數種子: {self.rng.getstate()[0]}")
+        return [Outcome(STARTED), Outcome(PLAYER_ORDER, names=[p.name for p in self.players])]
 
-    async def roll_dice(self, player: Player):
+    def apply_roll_dice(self, player: Player) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查玩家是否在監獄中
         if current_player.jail_turns > 0:
             current_player.jail_turns -= 1
             self.rolled = True
-            await self.message_handler(f"{player.name}在監獄中，無法擲骰子。\n還需{current_player.jail_turns}回合才能出獄。")
-            await self.next_turn(player)
-            return
+            self._emit(JAIL_WAIT, u=player.user_id, turns=current_player.jail_turns)
+            return [Outcome(JAIL_WAIT, name=player.name, turns=current_player.jail_turns)] + self.apply_next_turn(player)
         
         # 檢查是否已經擲骰子
         if self.rolled:
-            await self.message_handler(f"{player.name} 已經擲過骰子了！")
-            return
+            return [Outcome(ALREADY_ROLLED, name=player.name)]
 
         # 擲骰子
         self.rolled = True
-        dice_roll = random.randint(1, 6) + random.randint(1, 6)
-        await self.message_handler(f"{player.name} 擲出了 {dice_roll} 點！")
-        old_position = current_player.position
-        new_position = current_player.move(dice_roll, len(self.board))
+        dice_roll = self.rng.randint(1, 6) + self.rng.randint(1, 6)
+        self._emit(ROLLED, u=player.user_id, dice=dice_roll)
+        return [Outcome(ROLLED, name=player.name, dice=dice_roll)] + self._move(current_player, dice_roll)
+
+    def _move(self, player: Player, steps: int, pass_go: bool = True) -> Outcomes:
+        """移動玩家並處理停下的格子"""
+        old_position = player.position
+        new_position = player.move(steps, len(self.board))
+        self._emit(MOVED, u=player.user_id, position=new_position)
 
         current_square = self.get_square(new_position)
-        await self.message_handler(f"移動到了 {current_square.name}！")
+        outcomes = [Outcome(MOVED, square=current_square.name)]
 
-        # 經過起點獲得獎勵
-        if new_position != 0 and new_position < old_position:
-            current_player.receive(PASS_GO_MONEY)
-            await self.message_handler(f"{current_player.name} 經過起點，獲得 {PASS_GO_MONEY} 元！")
+        # 經過起點獲得獎勵（機會卡後退、直接進監獄不算）
+        if pass_go and steps > 0 and self.board_template.passes_start(old_position, steps):
+            player.receive(PASS_GO_MONEY)
+            self._emit(PASSED_GO, u=player.user_id, amount=PASS_GO_MONEY)
+            outcomes.append(Outcome(PASSED_GO, name=player.name, amount=PASS_GO_MONEY))
 
         # 處理不同類型的格子
         if current_square.type == SquareType.JAIL:
-            current_player.jail_turns = JAIL_TIME
-            await self.message_handler(f"{current_player.name} 被送進監獄！")
-            await self.next_turn(player)
-            return
+            player.jail_turns = JAIL_TIME
+            self._emit(JAILED, u=player.user_id, turns=JAIL_TIME)
+            outcomes.append(Outcome(JAILED, name=player.name))
+            return outcomes + self.apply_next_turn(player)
         if current_square.type == SquareType.START:
-            await self.next_turn(player)
-            return
+            return outcomes + self.apply_next_turn(player)
         
         if current_square.type == SquareType.CHANCE:
-            chance_card = get_chance_card()
-            await self.message_handler(chance_card.card)
-            await self.message_handler("尚未實作")
-            # if chance_card.lost > 0:
-            #     current_player.pay(chance_card.lost)
-            #     await self.message_handler(f"{current_player.name} 繳交了 {chance_card.lost} 元罰款！")
-            # if chance_card.gain > 0:
-            #     current_player.receive(chance_card.gain)
-            #     await self.message_handler(f"{current_player.name} 獲得了 {chance_card.gain} 元獎金！")
-            return
+            return outcomes + self._chance(player)
         
         if current_square.type == SquareType.PROPERTY:
             if current_square.owner == None:
-                await self.message_handler(f"這是一塊空地！價格: {current_square.price} 元")
-                await self.message_handler(f"使用 /buy 購買此地產")
-            elif current_square.owner == current_player:
-                await self.message_handler(f"{current_player.name} 擁有這塊地產！")
-                await self.message_handler(f"使用 /upgrade 升級此地產。升級價格: {current_square.house_cost} 元")
+                outcomes.append(Outcome(VACANT, price=current_square.price))
+            elif current_square.owner == player:
+                outcomes.append(Outcome(OWN_SQUARE, name=player.name, cost=current_square.house_cost))
+            elif current_square.mortgaged:
+                outcomes.append(Outcome(NO_RENT, name=player.name, square=current_square.name))
+                outcomes += self.apply_next_turn(player)
             else:
-                await self.message_handler(f"{current_player.name} 需要支付 {current_square.get_rent()} 元租金給 {current_square.owner.name}！")
-                if current_player.pay(current_square.get_rent()):
-                    await self.message_handler(f"{current_player.name} 支付了租金！")
-                    await self.next_turn(player)
+                rent = self.rent(current_square)
+                outcomes.append(Outcome(RENT_DUE, name=player.name, amount=rent, owner=current_square.owner.name,
+                                        monopoly=self.is_monopoly(current_square)))
+                if player.pay(rent):
+                    current_square.owner.receive(rent)
+                    self._emit(RENT_PAID, u=player.user_id, to=current_square.owner.user_id, amount=rent)
+                    outcomes.append(Outcome(RENT_PAID, name=player.name))
+                    outcomes += self.apply_next_turn(player)
                 else:
-                    self.ledger = {'from': current_player, 'amount': current_square.get_rent(), 'to': current_square.owner}
-                    await self.message_handler(f"{current_player.name} 無法支付租金！")
-                    await self.message_handler(f"使用 /mortgage 抵押地產")
-                    await self.message_handler(f"使用 /downgrade 降級地產")
-                    await self.message_handler(f"使用 /sell 出售地產")
+                    self.ledger = {'from': player, 'amount': rent, 'to': current_square.owner}
+                    self._emit(DEBT, u=player.user_id, to=current_square.owner.user_id, amount=rent)
+                    outcomes.append(Outcome(DEBT, name=player.name))
         else:
-            logging.error(f"未知的地產擁有者: {current_square.owner.name}，玩家: {current_player.name}")
-
-    async def buy_property(self, player: Player, estate: Square):
+            logging.error(f"未知的地產擁有者: {current_square.owner.name}，玩家: {player.name}")
+        return outcomes
+
+    def draw_chance_card(self) -> Chance:
+        """從這場遊戲的牌堆抽一張，抽完再洗一副新的"""
+        pile = list(self.chance_pile) or shuffled_pile(self.rng)
+        card = CHANCE_CARDS[pile.pop()]
+        self.chance_pile = pile
+        return card
+
+    def _chance(self, player: Player) -> Outcomes:
+        card = self.draw_chance_card()
+        self._emit(CHANCE, u=player.user_id, card=card.card)
+        outcomes = [Outcome(CHANCE, card=card.card)]
+        if card.gain:
+            player.receive(card.gain)
+            outcomes.append(Outcome(CHANCE_GAIN, name=player.name, amount=card.gain))
+        if card.lost:
+            if player.pay(card.lost):
+                outcomes.append(Outcome(FINE_PAID, name=player.name, amount=card.lost))
+            else:
+                # 罰款付給銀行（to 為 None），和租金一樣要先籌錢再 /pay
+                self.ledger = {'from': player, 'amount': card.lost, 'to': None}
+                self._emit(DEBT, u=player.user_id, to=None, amount=card.lost)
+                outcomes.append(Outcome(FINE_UNPAID, name=player.name))
+                return outcomes
+        if card.move:
+            outcomes += self._move(player, card.move)
+        elif card.to is not None:
+            steps = self.board_template.distance_to(card.to, player.position)
+            if steps:
+                outcomes += self._move(player, steps, pass_go=False)
+        return outcomes
+
+    def apply_buy_property(self, player: Player, estate: Square) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
         
         # 檢查是否已經擲骰子
         if not self.rolled:
-            await self.message_handler("請先擲骰子！")
-            return
+            return [Outcome(NOT_ROLLED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查地產是否是使用者當前位置
         if current_player.position != estate.position:
-            await self.message_handler(f"{estate.name} 不是你當前的位置！")
-            return
+            return [Outcome(NOT_HERE, square=estate.name)]
 
         # 檢查地產是否存在
         if estate.type != SquareType.PROPERTY:
-            await self.message_handler(f"{estate.name} 不是地產！")
-            return
+            return [Outcome(NOT_PROPERTY, square=estate.name)]
         
         # 檢查地產擁有者
         if estate.owner is not None:
-            await self.message_handler(f"{estate.name} 已經被 {estate.owner.name} 擁有！")
-            return
+            return [Outcome(OWNED, square=estate.name, owner=estate.owner.name)]
         
         # 檢查玩家金額是否足夠
         if player.money < estate.price:
-            await self.message_handler(f"{player.name} 無法購買 {estate.name}！")
-            await self.message_handler(f"使用 /mortgage 抵押地產")
-            await self.message_handler(f"使用 /downgrade 降級地產")
-            await self.message_handler(f"使用 /sell 出售地產")
-            return
+            return [Outcome(CANNOT_AFFORD, name=player.name, square=estate.name)]
         
         if estate.mortgaged:
             del player.mortgage_properties[estate.name]
+            player.mark_dirty('mortgage_properties')
             estate.mortgaged = False
         player.pay(estate.price)
         estate.owner = player
         player.properties[estate.name] = estate
-        await self.message_handler(f"{player.name} 購買了 {estate.name}！")
-        await self.next_turn(player)
+        player.mark_dirty('properties')
+        self._hold(estate, 1)
+        self._emit(BOUGHT, u=player.user_id, square=estate.position, price=estate.price)
+        return [Outcome(BOUGHT, name=player.name, square=estate.name)] + self.apply_next_turn(player)
 
-    async def sell_property(self, player: Player, estate: Square):
+    def apply_sell_property(self, player: Player, estate: Square) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查地產是否存在
         if estate.type != SquareType.PROPERTY:
-            await self.message_handler(f"{estate.name} 不是地產！")
-            return
+            return [Outcome(NOT_PROPERTY, square=estate.name)]
         
         # 檢查地產擁有者
         if estate.owner != player:
-            await self.message_handler(f"{estate.name} 不是你的地產！")
-            return
+            return [Outcome(NOT_OWNER, square=estate.name)]
         
         # 出售地產
-        message = f"{player.name} 出售 {estate.name}{'（抵押中）' if estate.mortgaged else ' level: ' + str(estate.level)} {estate.price} 元！"
+        outcome = Outcome(SOLD, name=player.name, square=estate.name, mortgaged=estate.mortgaged, level=estate.level, price=estate.price)
         player.receive(estate.price)
+        self._emit(SOLD, u=player.user_id, square=estate.position, price=estate.price)
+        if estate.mortgaged:
+            del player.mortgage_properties[estate.name]
+            player.mark_dirty('mortgage_properties')
+        else:
+            del player.properties[estate.name]
+            player.mark_dirty('properties')
+            self._hold(estate, -1)
         estate.reset()
-        del player.properties[estate.name]
-        await self.message_handler(message)
+        return [outcome]
 
-    async def upgrade_property(self, player: Player, estate: Square):
+    def apply_upgrade_property(self, player: Player, estate: Square) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
         
         # 檢查是否已經擲骰子
         if not self.rolled:
-            await self.message_handler("請先擲骰子！")
-            return
+            return [Outcome(NOT_ROLLED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查地產是否是使用者當前位置
         if current_player.position != estate.position:
-            await self.message_handler(f"{estate.name} 不是你當前的位置！")
-            return
+            return [Outcome(NOT_HERE, square=estate.name)]
         
         # 檢查地產是否存在
         if estate.type != SquareType.PROPERTY:
-            await self.message_handler(f"{estate.name} 不是地產！")
-            return
+            return [Outcome(NOT_PROPERTY, square=estate.name)]
         
         # 檢查地產擁有者
         if estate.owner != player:
-            await self.message_handler(f"{estate.name} 不是你的地產！")
-            return
+            return [Outcome(NOT_OWNER, square=estate.name)]
         
         # 檢查地產是否抵押
         if estate.mortgaged:
-            await self.message_handler(f"{estate.name} 已經抵押了，無法升級！")
-            return
+            return [Outcome(IS_MORTGAGED, square=estate.name, action='upgrade')]
         
-        # 檢查地產等級
-        if estate.level >= 5:
-            await self.message_handler(f"{estate.name} 已經是最高級了！")
-            return
+        # 檢查地產等級（tolls 只列到最高等級的過路費）
+        if estate.level >= len(estate.tolls) - 1:
+            return [Outcome(MAX_LEVEL, square=estate.name)]
         
         # 檢查玩家金額是否足夠
         if player.money < estate.house_cost:
-            await self.message_handler(f"{player.name} 沒有足夠的錢來升級 {estate.name}！")
-            return
+            return [Outcome(UPGRADE_UNAFFORDABLE, name=player.name, square=estate.name)]
 
         # 升級地產
         player.pay(estate.house_cost)
         estate.level += 1
-        await self.message_handler(f"{player.name} 升級了 {estate.name} 到 {estate.level} 級！")
-        await self.next_turn(player)
+        self._emit(UPGRADED, u=player.user_id, square=estate.position, level=estate.level, cost=estate.house_cost)
+        return [Outcome(UPGRADED, name=player.name, square=estate.name, level=estate.level)] + self.apply_next_turn(player)
 
-    async def downgrade_property(self, player: Player, estate: Square):
+    def apply_downgrade_property(self, player: Player, estate: Square) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查地產是否存在
         if estate.type != SquareType.PROPERTY:
-            await self.message_handler(f"{estate.name} 不是地產！")
-            return
+            return [Outcome(NOT_PROPERTY, square=estate.name)]
         
         # 檢查地產擁有者
         if estate.owner != player:
-            await self.message_handler(f"{estate.name} 不是你的地產！")
-            return
+            return [Outcome(NOT_OWNER, square=estate.name)]
         
         # 檢查地產是否抵押
         if estate.mortgaged:
-            await self.message_handler(f"{estate.name} 已經抵押了，無法降級！")
-            return
+            return [Outcome(IS_MORTGAGED, square=estate.name, action='downgrade')]
         
         # 檢查地產等級
         if estate.level <= 0:
-            await self.message_handler(f"{estate.name} 已經是最低級了！")
-            return
+            return [Outcome(MIN_LEVEL, square=estate.name)]
         
         # 降級地產
         downgrade_cost = estate.house_cost
         player.receive(downgrade_cost)
         estate.level -= 1
-        await self.message_handler(f"{player.name} 降級 {estate.name} 到 {estate.level} 級！")
+        self._emit(DOWNGRADED, u=player.user_id, square=estate.position, level=estate.level, refund=downgrade_cost)
+        return [Outcome(DOWNGRADED, name=player.name, square=estate.name, level=estate.level)]
 
-    async def mortgage_property(self, player: Player, estate: Square):
+    def apply_mortgage_property(self, player: Player, estate: Square) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
 
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if not current_player or current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查地產是否存在
         if estate.type != SquareType.PROPERTY:
-            await self.message_handler(f"{estate.name} 不是地產！")
-            return
+            return [Outcome(NOT_PROPERTY, square=estate.name)]
         
         # 檢查地產擁有者
         if estate.owner != player:
-            await self.message_handler(f"{estate.name} 不是你的地產！")
-            return
+            return [Outcome(NOT_OWNER, square=estate.name)]
         
         # 抵押地產
         if estate.mortgaged:
-            await self.message_handler(f"{estate.name} 已經抵押了，無法再次抵押！")
-            return
+            return [Outcome(IS_MORTGAGED, square=estate.name, action='mortgage')]
         
         # 檢查地產等級
         if estate.level > 0:
-            await self.message_handler(f"{estate.name} 已經升級了，無法抵押！")
-            return
+            return [Outcome(IS_UPGRADED, square=estate.name)]
 
         estate.mortgaged = True
+        self._hold(estate, -1)
         player.receive(estate.price)
         player.mortgage_properties[estate.name] = estate
         del player.properties[estate.name]
-        await self.message_handler(f"{player.name} 抵押了 {estate.name}！")
+        player.mark_dirty('properties', 'mortgage_properties')
+        self._emit(MORTGAGED, u=player.user_id, square=estate.position, amount=estate.price)
+        return [Outcome(MORTGAGED, name=player.name, square=estate.name)]
 
-    async def pay(self, player: Player):
+    def apply_pay(self, player: Player) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
         
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if current_player.user_id != player.user_id:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
         
         # 檢查是否有欠款
         if not self.ledger:
-            await self.message_handler(f"{player.name} 沒有欠款！")
-            return
+            return [Outcome(NO_DEBT, name=player.name)]
         
         # 檢查玩家金額是否足夠
         if player.money < self.ledger['amount']:
             if player.properties or player.mortgage_properties:
-                await self.message_handler(f"{player.name} 的金額不足！ 請變賣地產！")
-                return
-            else:
-                # self.ledger['to'].receive(self.ledger['from'].money)
-                self.ledger['from'].money = -1
-                await self.message_handler(f"{player.name} 已破產！")
-                await self.next_turn(player)
+                return [Outcome(MUST_SELL, name=player.name)]
+            # self.ledger['to'].receive(self.ledger['from'].money)
+            self.ledger['from'].money = -1
+            self._release_properties(player)  # 目前要先變賣完地產才會走到這裡，地產規則改變時也不會留下無主的擁有者
+            self._emit(BANKRUPT, u=player.user_id)
+            outcomes = [Outcome(BANKRUPT, name=player.name)] + self.apply_next_turn(player)
         else:
-            # 支付欠款
+            # 支付欠款（欠銀行的罰款沒有收款人）
+            creditor = self.ledger['to']
             player.pay(self.ledger['amount'])
-            self.ledger['to'].receive(self.ledger['amount'])
-            await self.message_handler(f"{player.name} 支付了 {self.ledger['amount']} 元給 {self.ledger['to'].name}！")
+            if creditor is not None:
+                creditor.receive(self.ledger['amount'])
+            self._emit(DEBT_PAID, u=player.user_id, to=creditor.user_id if creditor else None, amount=self.ledger['amount'])
+            outcomes = [Outcome(DEBT_PAID, name=player.name, amount=self.ledger['amount'], to=creditor.name if creditor else None)]
         
         self.ledger.clear()
+        self._dirty.add('ledger')
 
         # 下一回合
         winner = self.check_winner()
         if winner:
-            await self.message_handler(f"{winner.name} 獲勝了！ 共有 {winner.money} 元！")
-            await self.reset_game()
+            self._emit(WON, u=winner.user_id, money=winner.money)
+            outcomes.append(Outcome(WON, name=winner.name, money=winner.money))
+            outcomes += self.apply_reset_game()
+        return outcomes
+
+    def _liquidation_options(self, player: Player) -> List[List[LiquidationOption]]:
+        """每塊地產可以怎麼變現；損失是以後每次有人停下時少收的過路費
+        抵押或出售會拆掉同色獨佔，同色其他地產少收的部分也算進去；出售後別人可以買下向自己收租，再加上空地的過路費"""
+        groups = []
+        for estate in player.mortgage_properties.values():
+            groups.append([LiquidationOption(estate, 0, False, True, estate.price, estate.tolls[0])])
+        for estate in player.properties.values():
+            factor = MONOPOLY_RENT_MULTIPLIER if self.is_monopoly(estate) else 1
+            rent = estate.tolls[estate.level] * factor
+            broken = 0  # 拆掉獨佔後，同色其他地產少收的過路費
+            if factor > 1:
+                broken = sum(other.tolls[other.level] * (factor - 1) for other in player.properties.values()
+                             if other.color == estate.color and other is not estate)
+            houses = estate.house_cost * estate.level
+            options = [
+                LiquidationOption(estate, levels, False, False, estate.house_cost * levels,
+                                  rent - estate.tolls[estate.level - levels] * factor)
+                for levels in range(1, estate.level + 1)
+            ]
+            options.append(LiquidationOption(estate, estate.level, True, False, houses + estate.spec.price // 2, rent + broken))
+            options.append(LiquidationOption(estate, 0, False, True, estate.price, rent + broken + estate.tolls[0]))
+            groups.append(options)
+        return groups
+
+    def apply_autopay(self, player: Optional[Player]) -> Outcomes:
+        """找出損失最小的降級、抵押、出售組合籌到欠款並支付，變賣全部也不夠時全部賣掉後破產"""
+        # 檢查遊戲是否開始
+        if not self.started:
+            return [Outcome(NOT_STARTED)]
 
-    async def next_turn(self, player: Player):
+        # 檢查當前回合玩家（沒有加入遊戲的人也可能送出指令）
+        if player is None:
+            return [Outcome(NOT_JOINED)]
+        current_player = self.get_current_player()
+        if current_player.user_id != player.user_id:
+            return [Outcome(NOT_YOUR_TURN)]
+
+        # 檢查是否有欠款
+        if not self.ledger:
+            return [Outcome(NO_DEBT, name=player.name)]
+
+        groups = self._liquidation_options(player)
+        plan = plan_liquidation(groups, self.ledger['amount'] - player.money)
+        if plan is None:
+            # 怎麼賣都不夠，結果和手動賣光一樣是破產
+            plan = [options[-1] for options in groups]
+        outcomes = []
+        if plan:
+            outcomes.append(Outcome(AUTOPAY, name=player.name, cash=sum(option.cash for option in plan)))
+        for option in plan:
+            for _ in range(option.downgrades):
+                outcomes += self.apply_downgrade_property(player, option.square)
+            if option.mortgage:
+                outcomes += self.apply_mortgage_property(player, option.square)
+            if option.sell:
+                outcomes += self.apply_sell_property(player, option.square)
+        return outcomes + self.apply_pay(player)
+
+    def apply_next_turn(self, player: Player) -> Outcomes:
         # 檢查遊戲是否開始
         if not self.started:
-            await self.message_handler("遊戲尚未開始。")
-            return
+            return [Outcome(NOT_STARTED)]
         
         # 檢查當前回合玩家
         current_player = self.get_current_player()
         if current_player != player:
-            await self.message_handler("現在不是你的回合！")
-            return
+            return [Outcome(NOT_YOUR_TURN)]
 
         # 檢查是否已經擲骰子
         if not self.rolled:
-            await self.message_handler("請先擲骰子！")
-            return
+            return [Outcome(NOT_ROLLED)]
         
         # 檢查是否欠賬
         if self.ledger:
-            await self.message_handler(f"{current_player.name} 你有未結清的債務！")
-            return
+            return [Outcome(UNSETTLED_DEBT, name=current_player.name)]
 
         self.current_player_index = (self.current_player_index + 1) % len(self.players)
-        await self.message_handler(f"輪到 {self.players[self.current_player_index].name} 了！")
+        outcomes = [Outcome(TURN, name=self.players[self.current_player_index].name)]
         bankrupt_count = 0
         while self.players[self.current_player_index].money < 0:
-            await self.message_handler(f"{self.players[self.current_player_index].name} 已破產！自動跳下一位玩家。")
+            outcomes.append(Outcome(SKIP_BANKRUPT, name=self.players[self.current_player_index].name))
             self.current_player_index = (self.current_player_index + 1) % len(self.players)
             bankrupt_count += 1
             if bankrupt_count >= len(self.players):  # Check if all players are bankrupt 不太可能發生
-                await self.message_handler("所有玩家都已破產，遊戲結束！")
-                await self.reset_game()
-                return
-            await self.message_handler(f"輪到 {self.players[self.current_player_index].name} 了！")
+                outcomes.append(Outcome(ALL_BANKRUPT))
+                return outcomes + self.apply_reset_game()
+            outcomes.append(Outcome(TURN, name=self.players[self.current_player_index].name))
 
+        self._emit(TURN, u=self.players[self.current_player_index].user_id)
         self.rolled = False
+        return outcomes
 
-    async def info(self, player: Player):
-        # 顯示當前玩家資訊
-        if not self.players:
-            await self.message_handler("目前沒有玩家參加遊戲。")
-            return
-        
-        message = [f"{player.name}:{player.user_id}，現金: {player.money} 元"]
-        message.append(f"當前位置: {self.board[player.position].name}")
-        if player.properties:
-            message.append(f"地產: {'\n'.join([f'\t{p.name} level: {p.level}' for p in player.properties.values()])}")
-        if player.mortgage_properties:
-            message.append(f"抵押地產: {'\n'.join([p.name for p in player.mortgage_properties.values()])}")
-        if self.ledger:
-            message.append(f"欠{self.ledger['to'].name}{self.ledger['amount']} 元")
-        await self.message_handler('\n'.join(message))
-
-    async def show_players(self):
-        # 顯示所有玩家資訊
-        if not self.players:
-            await self.message_handler("目前沒有玩家參加遊戲。")
-            return
-        
-        players_info = ["目前玩家: "]
-        for player in self.players:
-            players_info.append(f"  {player.name}:{player.user_id}，現金: {player.money} 元")
-        await self.message_handler('\n'.join(players_info))
-
-    async def show_board(self):
-        # 顯示遊戲板
-        board_info = ["遊戲板: "]
-        for i, square in enumerate(self.board):
-            line = f"{i:2}: {square.name}"
-            if square._price and square.owner is None:  
-                line += f" ({square._price})"
-            if square.owner:
-                line += f" {square.owner.name} level: {square.level}"
-            if square.mortgaged:
-                line += " (抵押中)"
-            board_info.append(line)
-        await self.message_handler('\n'.join(board_info))
-
-    async def reset_game(self):
+    def apply_reset_game(self) -> Outcomes:
         self.double_confirm = False
         self.players.clear()
         self.player_dict.clear()
+        self._dirty.add('players')
         self.started = False
         self.current_player_index = 0
         self.ledger.clear()
+        self._dirty.add('ledger')
         self.rolled = False
-        for square in self.board:
+        self.chance_pile = []
+        self.turn_deadline = 0.0
+        self.timed_out_turns = 0
+        for square in self.board.active():
             square.reset()
-        await self.message_handler("遊戲已重置！")
+        self.group_holdings.clear()
+        self._emit(RESET)
+        return [Outcome(RESET)]
+
+    def apply_choose_board(self, template: BoardTemplate) -> Outcomes:
+        # 遊戲開始後不能換棋盤
+        if self.started:
+            return [Outcome(ALREADY_STARTED)]
+
+        self.board_template = template
+        self.board = initialize_board(template)
+        self.group_holdings.clear()
+        for player in self.players:
+            player.position = 0
+        self._full_save = True  # 棋盤模板換了，整份重新存
+        self._emit(BOARD_CHOSEN, board=template.id, version=template.version)
+        return [Outcome(BOARD_CHOSEN, board=template.name, squares=len(template))]
+
+    def apply_set_turn_timeout(self, seconds: int, action: str) -> Outcomes:
+        """設定回合時間限制，0 表示關閉；新的期限由 touch_turn_timer 計算"""
+        if seconds and not TURN_TIMEOUT_MIN <= seconds <= TURN_TIMEOUT_MAX:
+            return [Outcome(TIMEOUT_INVALID, min=TURN_TIMEOUT_MIN, max=TURN_TIMEOUT_MAX)]
+
+        self.turn_timeout = seconds
+        self.timeout_action = action
+        self._emit(TIMEOUT_SET, seconds=seconds, action=action)
+        return [Outcome(TIMEOUT_SET, seconds=seconds, action=action)]
+
+    def _arm_turn_timer(self, now: float):
+        self.turn_deadline = now + self.turn_timeout if self.started and self.turn_timeout else 0.0
+
+    def touch_turn_timer(self, now: float):
+        """玩家的指令改變了狀態：從現在重新計時（遊戲沒有進行或沒有設定時間限制時取消計時）"""
+        if self.timed_out_turns:
+            self.timed_out_turns = 0
+        self._arm_turn_timer(now)
+
+    def apply_expire_turn(self, now: float) -> Outcomes:
+        """目前的玩家超過時間限制沒有動作：依 timeout_action 自動擲骰子或跳過，有欠款時自動變賣支付，再換下一位
+        所有玩家都連續逾時就暫停計時，遊戲不會在沒有人的群組中一直自己進行"""
+        if not self.started or not self.turn_deadline or now < self.turn_deadline:
+            return []
+
+        player = self.get_current_player()
+        self._emit(TIMED_OUT, u=player.user_id, action=self.timeout_action)
+        outcomes = [Outcome(TIMED_OUT, name=player.name, seconds=self.turn_timeout, action=self.timeout_action)]
+        if not self.rolled:
+            if self.timeout_action == 'roll' or player.jail_turns > 0:
+                # 在監獄中跳過等於等待一回合
+                outcomes += self.apply_roll_dice(player)
+            else:
+                self.rolled = True
+        if self.started and self.get_current_player() is player and self.ledger:
+            outcomes += self.apply_autopay(player)
+        if self.started and self.get_current_player() is player and self.rolled and not self.ledger:
+            outcomes += self.apply_next_turn(player)
+
+        self.timed_out_turns += 1
+        if self.started and self.timed_out_turns >= len([p for p in self.players if p.money >= 0]):
+            self.turn_deadline = 0.0
+            outcomes.append(Outcome(TIMEOUT_PAUSED))
+        else:
+            self._arm_turn_timer(now)
+        return outcomes
+
+    # async 介面：執行規則核心後把結果轉成訊息送出
+
+    async def send(self, outcomes: Outcomes):
+        for message in render_all(outcomes):
+            await self.message_handler(message)
+
+    async def add_player(self, name: str, user_id: int):
+        await self.send(self.apply_add_player(name, user_id))
+
+    async def start_game(self):
+        await self.send(self.apply_start_game())
+
+    async def roll_dice(self, player: Player):
+        await self.send(self.apply_roll_dice(player))
+
+    async def buy_property(self, player: Player, estate: Square):
+        await self.send(self.apply_buy_property(player, estate))
+
+    async def sell_property(self, player: Player, estate: Square):
+        await self.send(self.apply_sell_property(player, estate))
+
+    async def upgrade_property(self, player: Player, estate: Square):
+        await self.send(self.apply_upgrade_property(player, estate))
+
+    async def downgrade_property(self, player: Player, estate: Square):
+        await self.send(self.apply_downgrade_property(player, estate))
+
+    async def mortgage_property(self, player: Player, estate: Square):
+        await self.send(self.apply_mortgage_property(player, estate))
+
+    async def pay(self, player: Player):
+        await self.send(self.apply_pay(player))
+
+    async def autopay(self, player: Player):
+        await self.send(self.apply_autopay(player))
+
+    async def next_turn(self, player: Player):
+        await self.send(self.apply_next_turn(player))
+
+    async def reset_game(self):
+        await self.send(self.apply_reset_game())
+
+    async def choose_board(self, template: BoardTemplate):
+        await self.send(self.apply_choose_board(template))
+
+    async def set_turn_timeout(self, seconds: int, action: str):
+        await self.send(self.apply_set_turn_timeout(seconds, action))
+
+    async def expire_turn(self, now: float):
+        await self.send(self.apply_expire_turn(now))
+
+    # 唯讀畫面：狀態沒有變動（revision 相同）時直接回傳上次產生的文字
+
+    def view(self, name: str, render: Callable[[], str], user_id: int = None) -> str:
+        key = (name, user_id)
+        cached = self._views.get(key)
+        if cached is not None and cached[0] == self.revision:
+            return cached[1]
+        text = render()
+        self._views[key] = (self.revision, text)
+        return text
+
+    def info_text(self, player: Optional[Player]) -> str:
+        if not self.players:
+            return "目前沒有玩家參加遊戲。"
+        if player is None:
+            return render(Outcome(NOT_JOINED))
+        return self.view('info', lambda: format_player_info(player, self.board, self.ledger), player.user_id)
+
+    def players_text(self) -> str:
+        if not self.players:
+            return "目前沒有玩家參加遊戲。"
+        return self.view('players', lambda: format_players(self.players))
+
+    def board_text(self) -> str:
+        return self.view('board', lambda: format_board(self.board))
+
+    async def info(self, player: Player):
+        # 顯示當前玩家資訊
+        await self.message_handler(self.info_text(player))
+
+    async def show_players(self):
+        # 顯示所有玩家資訊
+        await self.message_handler(self.players_text())
+
+    async def show_board(self):
+        # 顯示遊戲板
+        await self.message_handler(self.board_text())
 
     def to_dict(self):
         """將 GameState 轉為可序列化 dict"""
-        return {
-            'players': [self._player_to_dict(p) for p in self.players],
+        # players / board 以 id 為 key 存成 map，才能用欄位路徑只更新變動的部分
+        # 棋盤只存模板 id/版本與會變動的欄位，載入時再套回共用的模板
+        data = {
+            'players': {str(p.user_id): self._player_to_dict(p) for p in self.players},
+            'player_order': [p.user_id for p in self.players],
             'started': self.started,
             'current_player_index': self.current_player_index,
-            'board': [self._square_to_dict(s) for s in self.board],
+            'board_template': self.board_template.id,
+            'board_version': self.board_template.version,
+            # 沒有建立的方格就是初始狀態，不必為了存檔建立
+            'board': {str(position): self._square_to_dict(self.board.peek(position)) for position in range(len(self.board))},
             'ledger': self._ledger_to_dict(self.ledger),
             'rolled': self.rolled,
-            'double_confirm': self.double_confirm
+            'double_confirm': self.double_confirm,
+            'rng': self._rng_to_dict(),
+            'chance_pile': self.chance_pile,
+            'turn_timeout': self.turn_timeout,
+            'timeout_action': self.timeout_action,
+            'turn_deadline': self.turn_deadline,
+            'timed_out_turns': self.timed_out_turns,
         }
+        if not is_registered(self.board_template):
+            # 沒有註冊的模板（舊存檔的自訂棋盤）需要連同方格資料一起存
+            data['board_spec'] = self.board_template.to_dict()
+        return data
+
+    def collect_delta(self) -> Optional[dict]:
+        """收集上次儲存後變動的欄位，回傳 {欄位路徑: 值}；需要存完整快照時回傳 None"""
+        if self._full_save:
+            return None
+
+        delta = {}
+        if 'players' in self._dirty:
+            # 玩家加入或重置，整個 players 重寫
+            delta['players'] = {str(p.user_id): self._player_to_dict(p) for p in self.players}
+            delta['player_order'] = [p.user_id for p in self.players]
+        else:
+            if 'player_order' in self._dirty:
+                delta['player_order'] = [p.user_id for p in self.players]
+            for p in self.players:
+                for field in p.dirty_fields():
+                    delta[f"players.{p.user_id}.{field}"] = self._player_field(p, field)
+        for field in self._dirty:
+            if field == 'ledger':
+                delta['ledger'] = self._ledger_to_dict(self.ledger)
+            elif field in self.TRACKED_FIELDS:
+                delta[field] = getattr(self, field)
+        for s in self.board.active():
+            for field in s.dirty_fields():
+                delta[f"board.{s.position}.{field}"] = self._square_field(s, field)
+        # 亂數每次使用都會前進，與上次存檔時不同就存
+        if self.rng.getstate() != self._saved_rng:
+            delta['rng'] = self._rng_to_dict()
+        return delta
+
+    def mark_clean(self):
+        """儲存完成後清除所有變動紀錄"""
+        self._dirty.clear()
+        self._full_save = False
+        self._saved_rng = self.rng.getstate()
+        for p in self.players:
+            p.pop_dirty()
+        for s in self.board.active():
+            s.pop_dirty()
+        self.board.release()
+
+    def mark_unsaved(self):
+        """儲存的資料被刪除後呼叫，下次改存完整快照"""
+        self._full_save = True
+
+    def is_unsaved(self) -> bool:
+        """下次儲存是否要存完整快照（新遊戲、儲存的資料已被刪除或換了棋盤）"""
+        return self._full_save
 
     @staticmethod
     def from_dict(data, message_handler):
         """從 dict 還原 GameState 物件"""
-        obj = GameState(message_handler)
-        obj.players = [obj._player_from_dict(p) for p in data['players']]
+        template, squares = GameState._board_from_dict(data)
+        obj = GameState(message_handler, template)
+        players = data['players']
+        if isinstance(players, dict):
+            players = [players[str(user_id)] for user_id in data['player_order']]
+        obj.players = [obj._player_from_dict(p) for p in players]
         obj.player_dict = {p.user_id: p for p in obj.players}
         obj.started = data['started']
         obj.current_player_index = data['current_player_index']
-        obj.board = [obj._square_from_dict(s) for s in data['board']]
-        obj.board_dict = {s.name: s for s in obj.board}
+        for position, square in squares.items():
+            # 舊存檔每一格都有存，初始狀態的方格不必建立
+            if square.get('owner') is not None or square.get('level') or square.get('mortgaged'):
+                obj._square_from_dict(obj.board[position], square)
         obj.ledger = obj._ledger_from_dict(data['ledger'], obj.player_dict)
         obj.rolled = data['rolled']
         obj.double_confirm = data['double_confirm']
+        if 'rng' in data:
+            # 舊存檔沒有亂數狀態，沿用新建立的種子
+            obj.rng.setstate((data['rng']['seed'], data['rng']['position']))
+        obj.chance_pile = [i for i in data.get('chance_pile', []) if i < len(CHANCE_CARDS)]
+        obj.turn_timeout = data.get('turn_timeout', 0)
+        obj.timeout_action = data.get('timeout_action', TIMEOUT_ACTIONS[0])
+        obj.turn_deadline = data.get('turn_deadline', 0.0)
+        obj.timed_out_turns = data.get('timed_out_turns', 0)
 
         # id 轉為 物件 
         for p in obj.players:
-            p.properties = {name: obj.board_dict[name] for name in p.properties if name in obj.board_dict}
-            p.mortgage_properties = {name: obj.board_dict[name] for name in p.mortgage_properties if name in obj.board_dict}
-        for s in obj.board:
+            p.properties = {name: obj.get_square_by_name(name) for name in p.properties if name in template.positions}
+            p.mortgage_properties = {name: obj.get_square_by_name(name) for name in p.mortgage_properties if name in template.positions}
+        for s in obj.board.active():
             if s.owner:
                 s.owner = obj.player_dict[s.owner]
-        if obj.ledger:
-            obj.ledger['from'] = obj.player_dict[obj.ledger['from']]
-            obj.ledger['to'] = obj.player_dict[obj.ledger['to']]
+                if not s.mortgaged:
+                    obj._hold(s, 1)
+
+        obj.version = data.get('_version', 0)
+        obj.mark_clean()
+        # 舊格式（players / board 為 list、board 存完整方格資料）下次先存一份完整快照
+        obj._full_save = isinstance(data['players'], list) or 'board_template' not in data
         return obj
 
+    @staticmethod
+    def _board_from_dict(data) -> Tuple[BoardTemplate, Dict[int, dict]]:
+        """找出存檔使用的棋盤模板，回傳 (模板, {位置: 會變動的欄位})"""
+        board = data['board']
+        if 'board_template' in data:
+            template = get_board_template(data['board_template'], data['board_version'])
+            if template is None:
+                if 'board_spec' not in data:
+                    raise ValueError(f"找不到棋盤模板: {data['board_template']} v{data['board_version']}")
+                template = BoardTemplate.from_dict(data['board_spec'])
+            return template, {int(position): s for position, s in board.items()}
+
+        # 舊格式每一格都存了完整的方格資料
+        if isinstance(board, dict):
+            board = list(board.values())
+        board = sorted(board, key=lambda s: s['position'])
+        template = find_board_template(
+            SquareSpec(
+                name=s['name'],
+                type=SquareType[s['type']],
+                position=s['position'],
+                color=s['color'],
+                price=s['_price'],
+                tolls=tuple(s['tolls']) if s['tolls'] else None,
+                house_cost=s['house_cost'],
+            )
+            for s in board
+        )
+        return template, {s['position']: s for s in board}
+
     def _player_to_dict(self, player):
-        # 使用 vars() 方式簡化 player 轉 dict
-        d = vars(player).copy()
-        d['properties'] = list(player.properties.keys())  # 轉為 id 之後再從 id 轉回物件字典
-        d['mortgage_properties'] = list(player.mortgage_properties.keys())
-        return d
+        # properties 轉為 id 之後再從 id 轉回物件字典
+        return {field: self._player_field(player, field) for field in Player.FIELDS}
+
+    def _player_field(self, player, field):
+        if field in ('properties', 'mortgage_properties'):
+            return list(getattr(player, field).keys())
+        return getattr(player, field)
 
     def _player_from_dict(self, data):
         p = Player(data['name'], data['user_id'])
-        for k, v in data.items():
-            setattr(p, k, v)
+        for field in Player.FIELDS:
+            setattr(p, field, data[field])
         # properties/mortgage_properties 會在 from_dict 裡處理成物件
         return p
 
     def _square_to_dict(self, square):
-        d = vars(square).copy()
-        d['type'] = square.type.name
-        d['owner'] = square.owner.user_id if square.owner else None
-        return d
-
-    def _square_from_dict(self, data):
-        s = Square(
-            name=data['name'],
-            color=data['color'],
-            price=data['_price'],
-            tolls=data['tolls'],
-            house_cost=data['house_cost']
-        )
-        s.type = SquareType[data['type']]
-        s.position = data['position']
-        s.level = data['level']
-        s.mortgaged = data['mortgaged']
-        s.owner = data['owner']  # wait for player_dict
-        return s
+        if square is None:
+            return {'owner': None, 'level': 0, 'mortgaged': False}
+        return {
+            'owner': square.owner.user_id if square.owner else None,
+            'level': square.level,
+            'mortgaged': square.mortgaged,
+        }
+
+    def _square_field(self, square, field):
+        if field == 'owner':
+            return square.owner.user_id if square.owner else None
+        return getattr(square, field)
+
+    def _square_from_dict(self, square, data):
+        # 只以欄位路徑寫入過的方格可能缺少部分欄位
+        square.level = data.get('level', 0)
+        square.mortgaged = data.get('mortgaged', False)
+        square.owner = data.get('owner')  # wait for player_dict
 
     def _ledger_to_dict(self, ledger):
         if not ledger:
             return {}
         return {
             'from': ledger['from'].user_id,
-            'to': ledger['to'].user_id,
+            'to': ledger['to'].user_id if ledger['to'] else None,  # None 表示欠銀行
             'amount': ledger['amount']
         }
 
+    def _rng_to_dict(self):
+        seed, position = self.rng.getstate()
+        return {'seed': seed, 'position': position}
+
     def _ledger_from_dict(self, data, player_dict):
         if not data:
             return {}
         return {
-            'from': player_dict[data['from']],  # wait for player_dict
-            'to': player_dict[data['to']],      # wait for player_dict
+            'from': player_dict[data['from']],
+            'to': player_dict[data['to']] if data['to'] is not None else None,
             'amount': data['amount']
         }
 
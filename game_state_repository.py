@@ -1,10 +1,79 @@
+import gzip
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+VERSION_FIELD = '_version'  # 狀態的版本號，每次寫入遞增，用來判斷哪一份比較新
+
+
+def state_version(state: dict | None) -> int:
+    """狀態的版本號，沒有資料時為 -1，舊存檔沒有版本號時為 0"""
+    if state is None:
+        return -1
+    return state.get(VERSION_FIELD, 0)
+
+
+class VersionConflict(Exception):
+    """寫入時資料庫中的版本已經被其他人更新"""
+
+    def __init__(self, chat_id: str, expected: int, actual: int | None = None):
+        super().__init__(f"chat_id: {chat_id} 的版本衝突，預期 {expected}，實際 {actual if actual is not None else '未知'}")
+        self.chat_id = chat_id
+        self.expected = expected
+        self.actual = actual
+
+
+def apply_delta(state: dict, delta: dict) -> dict:
+    """把 {欄位路徑: 值} 形式的差異套用到完整的 state dict 上"""
+    for path, value in delta.items():
+        keys = path.split('.')
+        target = state
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+    return state
+
+
+def field_paths(delta: dict) -> dict:
+    """把 {欄位路徑: 值} 轉成 Firestore update 用的欄位路徑；map 的 key 是數字（位置、user_id），需要加上引號"""
+    return {FieldPath(*path.split('.')).to_api_repr(): value for path, value in delta.items()}
+
+
+def merge_delta(base: dict, delta: dict) -> dict:
+    """把較新的 delta 合併進尚未寫入的 delta，結果等同依序套用兩者"""
+    for path, value in delta.items():
+        # 新的值覆蓋整個欄位，底下舊的子欄位就不需要了
+        prefix = path + '.'
+        for key in [k for k in base if k.startswith(prefix)]:
+            del base[key]
+
+        # 若上層欄位已經整個在 base 裡，直接改上層的值
+        keys = path.split('.')
+        for i in range(len(keys) - 1, 0, -1):
+            parent = '.'.join(keys[:i])
+            if isinstance(base.get(parent), dict):
+                apply_delta(base[parent], {'.'.join(keys[i:]): value})
+                break
+        else:
+            base[path] = value
+    return base
 
 
 class GameStateRepository(ABC):
+    executor = None  # 執行阻塞 I/O 的執行緒池，None 表示使用 asyncio 預設的
     @abstractmethod
     def save_game_state(self, chat_id: str, state: dict):
         """儲存指定 chat_id 的遊戲狀態 (dict 結構)"""
@@ -20,6 +89,71 @@ class GameStateRepository(ABC):
         """刪除指定 chat_id 的遊戲狀態"""
         pass
 
+    def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        """只更新有變動的欄位 ({欄位路徑: 值})，預設讀出整份套用後再存回；events 為這次變動的事件"""
+        state = self.load_game_state(chat_id)
+        if state is None:
+            raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+        self.save_game_state(chat_id, apply_delta(state, delta))
+
+    def append_events(self, chat_id: str, events: List[dict]):
+        """記錄遊戲事件，預設不保存事件"""
+        pass
+
+    def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        """一次更新多個 chat 的變動欄位，回傳寫入失敗的 {chat_id: 例外}（例如文件不存在）；預設逐一更新"""
+        failures = {}
+        for chat_id, delta in deltas.items():
+            try:
+                self.update_game_state(chat_id, delta, (events or {}).get(chat_id))
+            except Exception as e:
+                failures[chat_id] = e
+        return failures
+
+    def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        """一次讀取多個 chat 的遊戲狀態，不存在的 chat 不會出現在結果中"""
+        states = {}
+        for chat_id in chat_ids:
+            state = self.load_game_state(chat_id)
+            if state is not None:
+                states[chat_id] = state
+        return states
+
+    def save_many(self, states: Dict[str, dict]):
+        """一次儲存多個 chat 的遊戲狀態"""
+        for chat_id, state in states.items():
+            self.save_game_state(chat_id, state)
+
+    def save_if_newer(self, chat_id: str, state: dict) -> bool:
+        """state 的版本不比已存的舊時才寫入，回傳是否寫入；預設先讀後寫，不是原子操作"""
+        if state_version(self.load_game_state(chat_id)) > state_version(state):
+            return False
+        self.save_game_state(chat_id, state)
+        return True
+
+    def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        """資料庫中的版本等於 expected_version（-1 表示還不存在）時，才寫入完整狀態或差異並遞增版本，
+        回傳新的版本號；版本不符時丟出 VersionConflict。預設先讀後寫，不是原子操作"""
+        current = self.load_game_state(chat_id)
+        actual = state_version(current)
+        if actual != expected_version:
+            raise VersionConflict(chat_id, expected_version, actual)
+        version = expected_version + 1
+        if state is None:
+            if current is None:
+                raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+            state = apply_delta(current, delta)
+        self.save_game_state(chat_id, {**state, VERSION_FIELD: version})
+        return version
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        """列出進行中的遊戲（啟動時預先載入用），不支援時回傳空的清單"""
+        return []
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        """列出有回合期限的遊戲 {chat_id: turn_deadline}（啟動時排程回合計時用，不必載入遊戲），不支援時回傳空的 dict"""
+        return {}
+
 
 class FirebaseGameStateRepository(GameStateRepository):
     def __init__(self, cred_path: str, collection_name: str = "PayUpPal"):
@@ -32,6 +166,10 @@ class FirebaseGameStateRepository(GameStateRepository):
     def save_game_state(self, chat_id: str, state: dict):
         self.collection.document(str(chat_id)).set(state)
 
+    def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        # map 的 key 是數字（位置、user_id），欄位路徑需要經過 FieldPath 加上引號
+        self.collection.document(str(chat_id)).update(field_paths(delta))
+
     def load_game_state(self, chat_id: str) -> dict | None:
         doc = self.collection.document(str(chat_id)).get()
         if doc.exists:
@@ -41,23 +179,414 @@ class FirebaseGameStateRepository(GameStateRepository):
     def delete_game_state(self, chat_id: str):
         self.collection.document(str(chat_id)).delete()
 
+    def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        refs = [self.collection.document(str(chat_id)) for chat_id in chat_ids]
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def save_many(self, states: Dict[str, dict]):
+        # Firestore 一個 batch 最多 500 筆寫入
+        items = list(states.items())
+        for i in range(0, len(items), 500):
+            batch = self.db.batch()
+            for chat_id, state in items[i:i + 500]:
+                batch.set(self.collection.document(str(chat_id)), state)
+            batch.commit()
+
+    def save_if_newer(self, chat_id: str, state: dict) -> bool:
+        # 在 transaction 中只讀取版本號再寫入，期間有其他寫入時 Firestore 會重試
+        document = self.collection.document(str(chat_id))
+
+        @firestore.transactional
+        def save(transaction) -> bool:
+            doc = document.get(field_paths=[VERSION_FIELD], transaction=transaction)
+            if state_version(doc.to_dict() if doc.exists else None) > state_version(state):
+                return False
+            transaction.set(document, state)
+            return True
+
+        return save(self.db.transaction())
+
+    def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        document = self.collection.document(str(chat_id))
+        version = expected_version + 1
+
+        @firestore.transactional
+        def save(transaction):
+            doc = document.get(field_paths=[VERSION_FIELD], transaction=transaction)
+            actual = state_version(doc.to_dict() if doc.exists else None)
+            if actual != expected_version:
+                raise VersionConflict(chat_id, expected_version, actual)
+            if state is not None:
+                transaction.set(document, {**state, VERSION_FIELD: version})
+            else:
+                transaction.update(document, field_paths({**delta, VERSION_FIELD: version}))
+
+        save(self.db.transaction())
+        return version
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        # 只取文件 id，不讀取內容
+        query = self.collection.where(filter=FieldFilter('started', '==', True)).select([FieldPath.document_id()])
+        if limit is not None:
+            query = query.limit(limit)
+        return [doc.id for doc in query.stream()]
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        # 只讀取 turn_deadline 欄位（單一欄位的索引由 Firestore 自動建立）
+        query = self.collection.where(filter=FieldFilter('turn_deadline', '>', 0)).select(['turn_deadline'])
+        return {doc.id: doc.get('turn_deadline') for doc in query.stream()}
+
 
 class LocalGameStateRepository(GameStateRepository):
-    # def __init__(self, file_path: str):
-    #     self.file_path = file_path
+    SCHEMA_VERSION = 1  # 檔案格式版本，格式改變時遞增
+
+    def __init__(self, directory: str = "game_states", compress: bool = False, durable: bool = False):
+        self.directory = directory
+        self.compress = compress  # 使用 gzip 壓縮
+        self.durable = durable  # 寫入後 fsync，斷電也不會遺失，但比較慢
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, chat_id: str, compressed: bool) -> str:
+        return os.path.join(self.directory, f"{chat_id}.json{'.gz' if compressed else ''}")
+
+    def _encode(self, state: dict) -> bytes:
+        data = json.dumps({'schema': self.SCHEMA_VERSION, 'state': state},
+                          ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return gzip.compress(data, compresslevel=6) if self.compress else data
+
+    def _decode(self, data: bytes, compressed: bool) -> dict:
+        if compressed:
+            data = gzip.decompress(data)
+        document = json.loads(data)
+        if document.get('schema', 0) > self.SCHEMA_VERSION:
+            raise ValueError(f"不支援的檔案格式版本: {document.get('schema')}")
+        return document['state']
+
+    def _write(self, chat_id: str, state: dict):
+        # 先寫入暫存檔再改名，寫到一半當掉也不會破壞原本的檔案
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f".{chat_id}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._encode(state))
+                if self.durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(chat_id, self.compress))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        # 切換壓縮設定後，移除另一種格式的舊檔
+        stale = self._path(chat_id, not self.compress)
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    def _sync_directory(self):
+        # 改名要 fsync 目錄才算真正寫入
+        if self.durable and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
 
     def save_game_state(self, chat_id: str, state: dict):
-        with open(chat_id + '.json', "w") as f:
-            f.write(str(state))
+        self._write(chat_id, state)
+        self._sync_directory()
 
     def load_game_state(self, chat_id: str) -> dict | None:
+        for compressed in (self.compress, not self.compress):
+            try:
+                with open(self._path(chat_id, compressed), 'rb') as f:
+                    return self._decode(f.read(), compressed)
+            except FileNotFoundError:
+                continue
+        return None
+
+    def delete_game_state(self, chat_id: str):
+        for compressed in (False, True):
+            path = self._path(chat_id, compressed)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save_many(self, states: Dict[str, dict]):
+        for chat_id, state in states.items():
+            self._write(chat_id, state)
+        self._sync_directory()
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        """列出進行中的遊戲，最近更新的排在前面（需要讀取每個檔案）"""
+        games = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            for suffix, compressed in (('.json', False), ('.json.gz', True)):
+                if entry.name.endswith(suffix):
+                    with open(entry.path, 'rb') as f:
+                        if self._decode(f.read(), compressed).get('started'):
+                            games.append((entry.stat().st_mtime, entry.name[:-len(suffix)]))
+                    break
+        games.sort(reverse=True)
+        return [chat_id for _, chat_id in games[:limit]]
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        """需要讀取每個檔案"""
+        deadlines = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            for suffix, compressed in (('.json', False), ('.json.gz', True)):
+                if entry.name.endswith(suffix):
+                    with open(entry.path, 'rb') as f:
+                        deadline = self._decode(f.read(), compressed).get('turn_deadline')
+                    if deadline:
+                        deadlines[entry.name[:-len(suffix)]] = deadline
+                    break
+        return deadlines
+
+
+class SqliteGameStateRepository(GameStateRepository):
+    # 相同的 SQL 字串會重用 sqlite3 快取的 prepared statement
+    _UPSERT = (
+        "INSERT INTO game_states (chat_id, started, turn_deadline, updated_at, state) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(chat_id) DO UPDATE SET "
+        "started = excluded.started, turn_deadline = excluded.turn_deadline, "
+        "updated_at = excluded.updated_at, state = excluded.state"
+    )
+    _SELECT = "SELECT state FROM game_states WHERE chat_id = ?"
+
+    def __init__(self, path: str = "payuppal.db", pool_size: int = 4):
+        self.path = path
+        # 每條執行緒各自取用連線，寫入由 SQLite 的鎖序列化，WAL 模式下讀取不會被寫入擋住
+        self._connections: queue.Queue[sqlite3.Connection] = queue.Queue()
+        for _ in range(pool_size):
+            self._connections.put(self._connect())
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='sqlite')
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS game_states ("
+                "chat_id TEXT PRIMARY KEY, "
+                "started INTEGER NOT NULL, "
+                "turn_deadline REAL NOT NULL DEFAULT 0, "
+                "updated_at REAL NOT NULL, "
+                "state TEXT NOT NULL)"
+            )
+            if 'turn_deadline' not in [column[1] for column in conn.execute("PRAGMA table_info(game_states)")]:
+                # 舊的資料庫：加上欄位並從存檔中取出
+                conn.execute("ALTER TABLE game_states ADD COLUMN turn_deadline REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE game_states SET turn_deadline = COALESCE(json_extract(state, '$.turn_deadline'), 0)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_game_states_started ON game_states (started, updated_at)")
+            # 大部分的遊戲沒有計時，部分索引只包含有期限的列
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_game_states_turn_deadline "
+                         "ON game_states (turn_deadline, chat_id) WHERE turn_deadline > 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下只在 checkpoint 時 fsync
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        conn = self._connections.get()
         try:
-            with open(chat_id + '.json', "r") as f:
-                return eval(f.read())
-        except FileNotFoundError:
-            return None
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _row(self, chat_id: str, state: dict) -> tuple:
+        return (str(chat_id), int(bool(state.get('started'))), float(state.get('turn_deadline') or 0), time.time(),
+                json.dumps(state, ensure_ascii=False, separators=(',', ':')))
+
+    def save_game_state(self, chat_id: str, state: dict):
+        with self._connection() as conn:
+            conn.execute(self._UPSERT, self._row(chat_id, state))
+
+    def save_many(self, states: Dict[str, dict]):
+        # 多個 chat 在同一個 transaction 寫入，只需要一次 commit
+        with self._transaction() as conn:
+            conn.executemany(self._UPSERT, [self._row(chat_id, state) for chat_id, state in states.items()])
+
+    def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        with self._transaction() as conn:
+            row = conn.execute(self._SELECT, (str(chat_id),)).fetchone()
+            if row is None:
+                raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+            conn.execute(self._UPSERT, self._row(chat_id, apply_delta(json.loads(row[0]), delta)))
+
+    def update_many(self, deltas: Dict[str, dict], events: Dict[str, List[dict]] = None) -> Dict[str, Exception]:
+        # 多個 chat 在同一個 transaction 讀出、套用差異後寫回，只需要一次 commit
+        failures = {}
+        with self._transaction() as conn:
+            states = self._select_many(conn, deltas)
+            rows = []
+            for chat_id, delta in deltas.items():
+                state = states.get(str(chat_id))
+                if state is None:
+                    failures[chat_id] = KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+                    continue
+                rows.append(self._row(chat_id, apply_delta(state, delta)))
+            conn.executemany(self._UPSERT, rows)
+        return failures
+
+    def compare_and_save(self, chat_id: str, expected_version: int, state: dict = None, delta: dict = None) -> int:
+        # 多個行程共用同一個資料庫檔案時，BEGIN IMMEDIATE 讓比對與寫入不會被其他行程插隊
+        with self._transaction() as conn:
+            row = conn.execute(self._SELECT, (str(chat_id),)).fetchone()
+            current = json.loads(row[0]) if row else None
+            actual = state_version(current)
+            if actual != expected_version:
+                raise VersionConflict(chat_id, expected_version, actual)
+            version = expected_version + 1
+            if state is None:
+                if current is None:
+                    raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+                state = apply_delta(current, delta)
+            conn.execute(self._UPSERT, self._row(chat_id, {**state, VERSION_FIELD: version}))
+        return version
+
+    def save_if_newer(self, chat_id: str, state: dict) -> bool:
+        with self._transaction() as conn:
+            row = conn.execute(self._SELECT, (str(chat_id),)).fetchone()
+            if row is not None and state_version(json.loads(row[0])) > state_version(state):
+                return False
+            conn.execute(self._UPSERT, self._row(chat_id, state))
+        return True
+
+    def load_game_state(self, chat_id: str) -> dict | None:
+        with self._connection() as conn:
+            row = conn.execute(self._SELECT, (str(chat_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        with self._connection() as conn:
+            return self._select_many(conn, chat_ids)
+
+    @staticmethod
+    def _select_many(conn: sqlite3.Connection, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        chat_ids = [str(chat_id) for chat_id in chat_ids]
+        states = {}
+        # SQLite 預設最多 999 個參數
+        for i in range(0, len(chat_ids), 500):
+            chunk = chat_ids[i:i + 500]
+            rows = conn.execute(
+                f"SELECT chat_id, state FROM game_states WHERE chat_id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            states.update((chat_id, json.loads(state)) for chat_id, state in rows)
+        return states
 
     def delete_game_state(self, chat_id: str):
-        import os
-        if os.path.exists(chat_id + '.json'):
-            os.remove(chat_id + '.json')
\ No newline at end of file
+        with self._connection() as conn:
+            conn.execute("DELETE FROM game_states WHERE chat_id = ?", (str(chat_id),))
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        """列出進行中的遊戲，最近更新的排在前面"""
+        sql = "SELECT chat_id FROM game_states WHERE started = 1 ORDER BY updated_at DESC"
+        with self._connection() as conn:
+            if limit is None:
+                rows = conn.execute(sql)
+            else:
+                rows = conn.execute(sql + " LIMIT ?", (limit,))
+            return [chat_id for chat_id, in rows]
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        with self._connection() as conn:
+            return dict(conn.execute("SELECT chat_id, turn_deadline FROM game_states WHERE turn_deadline > 0"))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+if __name__ == '__main__':
+    # 比較舊版 str()/eval() 存檔與新版本地存檔的速度與檔案大小
+    import argparse
+    import asyncio
+    import shutil
+
+    from game_state import GameState
+
+    class EvalGameStateRepository(GameStateRepository):
+        # 舊版 LocalGameStateRepository 的做法
+        def __init__(self, directory: str):
+            self.directory = directory
+            os.makedirs(directory, exist_ok=True)
+
+        def save_game_state(self, chat_id: str, state: dict):
+            with open(os.path.join(self.directory, chat_id + '.json'), "w") as f:
+                f.write(str(state))
+
+        def load_game_state(self, chat_id: str) -> dict | None:
+            with open(os.path.join(self.directory, chat_id + '.json'), "r") as f:
+                return eval(f.read())
+
+        def delete_game_state(self, chat_id: str):
+            os.remove(os.path.join(self.directory, chat_id + '.json'))
+
+    async def _discard(message):
+        pass
+
+    parser = argparse.ArgumentParser(description="本地存檔效能測試")
+    parser.add_argument('--games', type=int, default=2000)
+    parser.add_argument('--directory', default='bench_game_states')
+    args = parser.parse_args()
+
+    # 準備一場進行中的遊戲作為測試資料
+    game = GameState(_discard)
+    for i in range(4):
+        asyncio.run(game.add_player(f"玩家{i}", 1000 + i))
+    asyncio.run(game.start_game())
+    for i, square in enumerate(game.board):
+        if square.tolls:
+            square.owner = game.players[i % 4]
+            square.level = i % 3
+            game.players[i % 4].properties[square.name] = square
+    state = game.to_dict()
+    chat_ids = [str(-100000 - i) for i in range(args.games)]
+
+    os.makedirs(args.directory, exist_ok=True)
+    repositories = {
+        'str/eval': EvalGameStateRepository(os.path.join(args.directory, 'eval')),
+        'json': LocalGameStateRepository(os.path.join(args.directory, 'json')),
+        'json+gzip': LocalGameStateRepository(os.path.join(args.directory, 'gzip'), compress=True),
+        'json (save_many)': LocalGameStateRepository(os.path.join(args.directory, 'many')),
+        'sqlite': SqliteGameStateRepository(os.path.join(args.directory, 'sqlite.db')),
+        'sqlite (save_many)': SqliteGameStateRepository(os.path.join(args.directory, 'sqlite_many.db')),
+    }
+    try:
+        for name, repository in repositories.items():
+            start = time.perf_counter()
+            if name.endswith('(save_many)'):
+                repository.save_many({chat_id: state for chat_id in chat_ids})
+            else:
+                for chat_id in chat_ids:
+                    repository.save_game_state(chat_id, state)
+            save_rate = args.games / (time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for chat_id in chat_ids:
+                repository.load_game_state(chat_id)
+            load_rate = args.games / (time.perf_counter() - start)
+
+            if isinstance(repository, SqliteGameStateRepository):
+                # WAL 模式下尚未 checkpoint 的資料在 -wal 檔中，先寫回主檔再量
+                with repository._connection() as conn:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                paths = [repository.path + suffix for suffix in ('', '-wal', '-shm')]
+                size = sum(os.path.getsize(path) for path in paths if os.path.exists(path)) / args.games
+            else:
+                size = sum(entry.stat().st_size for entry in os.scandir(repository.directory)) / args.games
+            print(f"{name:>18}: 寫入 {save_rate:8.0f} 檔/秒，讀取 {load_rate:8.0f} 檔/秒，{size:6.0f} bytes/場")
+    finally:
+        shutil.rmtree(args.directory, ignore_errors=True)
@@ -0,0 +1,40 @@
+# 自動變賣地產還債：每塊地產有幾種變賣方式（降級幾級、抵押、出售），每塊最多選一種，
+# 找出湊得到所需金額、損失最小的組合（分組背包問題）
+
+from typing import List, NamedTuple, Optional, Sequence
+
+from base import Square
+
+
+class LiquidationOption(NamedTuple):
+    square: Square
+    downgrades: int  # 先降幾級
+    mortgage: bool  # 降級後抵押
+    sell: bool  # 出售（出售價格已包含房屋，不必先降級）
+    cash: int  # 這個做法拿到的錢
+    loss: int  # 損失（少收的過路費等，由呼叫的人估計）
+
+
+def plan_liquidation(groups: Sequence[Sequence[LiquidationOption]], need: int) -> Optional[List[LiquidationOption]]:
+    """每組（一塊地產）最多選一個做法，湊到至少 need 元且總損失最小；損失相同時選拿到的錢較少的
+    湊不到時回傳 None。以 Pareto 前緣做動態規劃：只保留「錢更多就一定損失更大」的組合，
+    錢超過 need 的部分不再區分，組合數最多是 need 的不同值，不會隨地產數指數成長"""
+    if need <= 0:
+        return []
+    # (湊到的錢（上限 need）, 損失, 實際拿到的錢, 選了哪些做法)
+    states = [(0, 0, 0, ())]
+    for options in groups:
+        candidates = list(states)
+        for capped, loss, cash, picks in states:
+            for option in options:
+                candidates.append((min(capped + option.cash, need), loss + option.loss, cash + option.cash,
+                                   picks + (option,)))
+        # 錢由多到少，相同時損失、實際金額由小到大；只留下損失比所有錢更多的組合都小的
+        candidates.sort(key=lambda state: (-state[0], state[1], state[2]))
+        states = []
+        for state in candidates:
+            if not states or state[1] < states[-1][1]:
+                states.append(state)
+    if states[0][0] < need:
+        return None
+    return list(states[0][3])
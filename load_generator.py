@@ -0,0 +1,119 @@
+# 本地壓力測試：對 webhook_server 送出模擬的 Telegram 更新，量測收到更新的延遲與 worker 處理指令的吞吐量
+# 先以 OFFLINE_BOT_API=1 STORAGE_BACKEND=sqlite python webhook_server.py 啟動（不連線 Telegram）
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+import aiohttp
+
+# 每個群組先加入、開始，之後輪流執行遊戲指令
+GAME_COMMANDS = ['/roll', '/buy', '/pay', '/upgrade', '/next', '/info', '/board', '/richlist']
+
+_update_ids = itertools.count(1)
+
+
+def make_update(chat_id: int, user_id: int, text: str) -> dict:
+    command = text.split(' ', 1)[0]
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_update_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group', 'title': f"壓測群組 {chat_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"玩家{user_id}"},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        },
+    }
+
+
+def chat_script(chat_id: int, players: int, commands: int, rng: random.Random):
+    """一個群組依序送出的 (user_id, 指令)"""
+    users = [chat_id * -100 + i for i in range(players)]
+    for user_id in users:
+        yield user_id, '/join'
+    yield users[0], '/start'
+    for _ in range(commands):
+        yield rng.choice(users), rng.choice(GAME_COMMANDS)
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    url = args.url.rstrip('/')
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    statuses = Counter()
+    latencies = []
+    interval = args.chats / args.rate if args.rate else 0  # 每個群組兩個指令之間的間隔
+
+    async with aiohttp.ClientSession() as session:
+        async def queue_stats() -> dict:
+            async with session.get(f"{url}/queues") as response:
+                return await response.json()
+
+        # 等所有 worker 啟動完成
+        while True:
+            async with session.get(f"{url}/healthz") as response:
+                if response.status == 200:
+                    break
+            await asyncio.sleep(0.5)
+        before = sum(worker['processed'] for worker in (await queue_stats())['workers'])
+
+        async def post(update: dict):
+            # 與 Telegram 相同：回應不是 200 時稍後重送
+            delay = 0.1
+            start = time.perf_counter()
+            while True:
+                async with session.post(f"{url}{args.path}", json=update, headers=headers) as response:
+                    statuses[response.status] += 1
+                if response.status != 503:
+                    break
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5)
+            latencies.append(time.perf_counter() - start)
+
+        async def run_chat(chat_id: int):
+            # 同一個群組的指令依序送出（與真實群組相同），不同群組同時送出
+            for user_id, text in chat_script(chat_id, args.players, args.commands, rng):
+                await post(make_update(chat_id, user_id, text))
+                if interval:
+                    await asyncio.sleep(interval * rng.uniform(0.5, 1.5))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_chat(-1000000000000 - i) for i in range(args.chats)))
+        sent_elapsed = time.perf_counter() - start
+
+        # 等待 worker 處理完所有更新
+        accepted = statuses[200]
+        while True:
+            stats = await queue_stats()
+            processed = sum(worker['processed'] for worker in stats['workers']) - before
+            if processed >= accepted or time.perf_counter() - start > args.timeout:
+                break
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"送出 {sum(statuses.values())} 個更新，{sent_elapsed:.2f} 秒，回應 {dict(statuses)}，"
+          f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms，p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"處理 {processed}/{accepted} 個更新，{elapsed:.2f} 秒，{processed / elapsed:.0f} 個/秒")
+    for worker in stats['workers']:
+        print(f"  worker {worker['index']}: 分配 {worker['routed']}，已處理 {worker['processed']}，"
+              f"排隊 {worker['queued']}，處理中 {worker['in_flight']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="對 webhook_server 送出模擬的 Telegram 更新")
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--path', default='/telegram')
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--commands', type=int, default=50, help="每個群組開始遊戲後的指令數")
+    parser.add_argument('--rate', type=float, default=0, help="全部群組每秒送出的更新數，0 表示不限制")
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
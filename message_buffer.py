@@ -0,0 +1,52 @@
+from typing import Awaitable, Callable, List
+
+TELEGRAM_MESSAGE_LIMIT = 4096  # Telegram 單則訊息的字數上限
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """依字數上限切割訊息，盡量在換行處切開"""
+    chunks = []
+    current = ''
+    for line in text.split('\n'):
+        # 單行就超過上限，只能硬切
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += '\n' + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# 收集一個指令產生的所有訊息，結束時合併成一則送出，減少 Telegram API 的呼叫次數
+class MessageBuffer:
+    def __init__(self, send: Callable[[str], Awaitable]):
+        self.send = send
+        self._messages: List[str] = []
+
+    async def __call__(self, text: str):
+        # 與 message_handler 相同的介面，只先存起來
+        self._messages.append(text)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def discard(self):
+        self._messages.clear()
+
+    async def flush(self):
+        if not self._messages:
+            return
+        text = '\n'.join(self._messages)
+        self._messages.clear()
+        for chunk in split_message(text):
+            await self.send(chunk)
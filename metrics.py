@@ -0,0 +1,209 @@
+# 行程內的延遲分布與計數，以 Prometheus 文字格式輸出（GET /metrics），/stats 指令也從這裡取摘要
+# 只記錄在記憶體中，每個行程（webhook worker）各自一份
+
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 秒，約每格 2 倍；分位數以桶內線性內插估計，誤差在一格之內
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus 文字格式
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        """(名稱, 標籤, 數值)"""
+        return ()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_key(labels), 0)
+
+    def samples(self):
+        return ((self.name, labels, value) for labels, value in self.values.items())
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[_key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(Metric):
+    """抓取時才呼叫 func 取值（沿用各元件原本的統計），func 回傳數值，或 {label 的值: 數值}"""
+
+    def __init__(self, name: str, help: str, func: Callable[[], float | Dict[str, float]], type: str = 'gauge',
+                 label: str = None):
+        super().__init__(name, help)
+        self.func = func
+        self.type = type
+        self.label = label
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            return [(self.name, ((self.label, str(key)),), v) for key, v in value.items()]
+        return [(self.name, (), value)]
+
+
+class _Series:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * (buckets + 1)  # 最後一格是 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Labels, _Series] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = _Series(len(self.buckets))
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def label_values(self, label: str) -> List[str]:
+        """已經記錄過的某個標籤的所有值"""
+        return [dict(labels)[label] for labels in self.series if label in dict(labels)]
+
+    def count(self, **labels) -> int:
+        series = self.series.get(_key(labels))
+        return series.count if series else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """與 Prometheus 的 histogram_quantile 相同：找到所在的桶，在桶的上下界之間線性內插"""
+        series = self.series.get(_key(labels))
+        if series is None or series.count == 0:
+            return None
+        rank = q * series.count
+        seen = 0
+        for i, count in enumerate(series.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # 落在 +Inf 桶只知道超過最大的上界
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def samples(self):
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (('le', _format_value(float(bound))),), cumulative
+            yield f"{self.name}_sum", labels, series.sum
+            yield f"{self.name}_count", labels, series.count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"指標名稱重複: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def callback(self, name: str, help: str, func, type: str = 'gauge', label: str = None) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, func, type, label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()  # 這個行程的預設指標
+
+
+async def start_server(registry: Registry, host: str, port: int):
+    """在背景提供 GET /metrics，回傳 aiohttp 的 AppRunner（關閉時呼叫 cleanup）"""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode('utf-8'),
+                            headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,145 @@
+# 以馬可夫鏈精確計算每一格的停留機率與期望租金，不需要靠大量模擬估計
+
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from base import Square, SquareType
+from chance import CHANCE_CARDS
+from game_setting import JAIL_TIME
+
+# 兩顆骰子點數和 2~12 的機率
+DICE_PROBABILITIES: Dict[int, float] = {
+    total: (6 - abs(total - 7)) / 36 for total in range(2, 13)
+}
+
+# 每張機會卡的移動：格數（不移動為 0），或直接前往的格子種類名稱
+CHANCE_MOVES: Tuple[int | str, ...] = tuple(card.to.name if card.to else card.move for card in CHANCE_CARDS)
+
+
+class BoardOdds:
+    def __init__(self, names: List[str], landing: np.ndarray, stationary: np.ndarray, tolls: Dict[int, List[int]]):
+        self.names = names
+        self.landing = landing  # landing[p]：任一回合結束時停在第 p 格的機率
+        self.stationary = stationary  # stationary[p, j]：長期下位於第 p 格且還要關 j 回合的機率
+        # expected_rent[p][level]：第 p 格在該等級時，每個對手回合的期望租金
+        self.expected_rent: Dict[int, np.ndarray] = {
+            position: landing[position] * np.asarray(tolls, dtype=float)
+            for position, tolls in tolls.items()
+        }
+
+    def landing_probability(self, position: int) -> float:
+        return float(self.landing[position])
+
+    def rent_per_turn(self, position: int, level: int) -> float:
+        return float(self.expected_rent[position][level])
+
+
+def _layout_key(board: List[Square]) -> Tuple[str, ...]:
+    # 停留機率只跟每一格的種類有關，相同配置的棋盤共用快取
+    return tuple(square.type.name for square in board)
+
+
+def _chance_target(types: Tuple[str, ...], position: int, move: int | str) -> int:
+    """抽到這張卡後移動到的位置（不移動時為原位置）"""
+    n = len(types)
+    if isinstance(move, str):
+        for steps in range(1, n + 1):
+            if types[(position + steps) % n] == move:
+                return (position + steps) % n
+        return position
+    return (position + move) % n
+
+
+def _chance_resolution(types: Tuple[str, ...], chance_moves: Tuple[int | str, ...]) -> np.ndarray:
+    """resolve[p, q]：停在第 p 格後（抽機會卡移動完）最後停在第 q 格的機率
+    每張卡機率相同（長期下整副牌每張都會抽到一次），移動後又停在機會格會再抽一張"""
+    n = len(types)
+    stay = np.eye(n)
+    jumps = np.zeros((n, n))
+    if chance_moves:
+        weight = 1 / len(chance_moves)
+        for position, square_type in enumerate(types):
+            if square_type != SquareType.CHANCE.name:
+                continue
+            stay[position, position] = 0.0
+            for move in chance_moves:
+                target = _chance_target(types, position, move)
+                if target == position:
+                    stay[position, position] += weight
+                else:
+                    jumps[position, target] += weight
+    # resolve = stay + jumps @ resolve
+    return np.linalg.solve(np.eye(n) - jumps, stay)
+
+
+def _transition_matrix(types: Tuple[str, ...], jail_time: int, chance_moves: Tuple[int | str, ...] = ()) -> np.ndarray:
+    """狀態為 (位置, 剩餘關押回合)，攤平成 index = 位置 * (jail_time + 1) + 回合"""
+    n = len(types)
+    width = jail_time + 1
+    totals = np.array(list(DICE_PROBABILITIES.keys()))
+    probabilities = np.array(list(DICE_PROBABILITIES.values()))
+
+    # 擲骰移動：從每個位置到 (位置 + 點數) % n，超過起點會繞回，停在機會格再依機會卡移動
+    positions = np.arange(n)
+    moves = np.zeros((n, n))
+    np.add.at(moves, (np.repeat(positions, len(totals)), ((positions[:, None] + totals[None, :]) % n).ravel()),
+              np.tile(probabilities, n))
+    moves = moves @ _chance_resolution(types, chance_moves)
+    is_jail = np.array([t == SquareType.JAIL.name for t in types])
+    target_jail = np.where(is_jail, jail_time, 0)
+
+    matrix = np.zeros((n * width, n * width))
+    matrix[(positions * width)[:, None], (positions * width + target_jail)[None, :]] = moves
+
+    # 關在監獄中：這回合不能擲骰，剩餘回合減一
+    for j in range(1, width):
+        matrix[positions * width + j, positions * width + j - 1] = 1.0
+    return matrix
+
+
+@lru_cache(maxsize=32)
+def _solve(types: Tuple[str, ...], jail_time: int, chance_moves: Tuple[int | str, ...] = ()) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(types)
+    width = jail_time + 1
+    matrix = _transition_matrix(types, jail_time, chance_moves)
+
+    # 解 pi P = pi 且 sum(pi) = 1
+    size = n * width
+    a = matrix.T - np.eye(size)
+    a[-1, :] = 1.0
+    b = np.zeros(size)
+    b[-1] = 1.0
+    stationary = np.linalg.lstsq(a, b, rcond=None)[0]
+    stationary = np.clip(stationary, 0, None)
+    stationary /= stationary.sum()
+
+    # 只有不在監獄中的狀態會擲骰移動，停留機率 = 這些狀態移動到各格的機率總和
+    movable = stationary.reshape(n, width)[:, 0]
+    moves = matrix.reshape(n, width, n, width)[:, 0].sum(axis=2)
+    landing = movable @ moves
+    return landing, stationary.reshape(n, width)
+
+
+def board_odds(board: List[Square]) -> BoardOdds:
+    """計算棋盤的停留機率與期望租金，結果依棋盤配置快取"""
+    landing, stationary = _solve(_layout_key(board), JAIL_TIME, CHANCE_MOVES)
+    tolls = {square.position: square.tolls for square in board if square.type == SquareType.PROPERTY}
+    return BoardOdds([square.name for square in board], landing, stationary, tolls)
+
+
+def format_board_odds(board: List[Square], opponents: int = 1) -> str:
+    """/odds 顯示的文字：每塊地產的停留機率、目前等級每輪（所有對手各一回合）的期望租金與回本輪數"""
+    odds = board_odds(board)
+    lines = ["停留機率與每輪期望租金: "]
+    for square in board:
+        if square.type != SquareType.PROPERTY:
+            continue
+        probability = odds.landing_probability(square.position)
+        rent = odds.rent_per_turn(square.position, square.level) * max(opponents, 1)
+        line = f"{square.position:2}: {square.name} {probability:.1%} 期望租金 {rent:.0f} 元"
+        if rent > 0:
+            line += f"，約 {square.price / rent:.0f} 輪回本"
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,252 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+PRIORITY_TURN = 0  # 遊戲進行中的訊息（擲骰、輪到誰），優先送出
+PRIORITY_INFO = 1  # /board、/richlist、/info 等查詢結果
+PRIORITY_LEVELS = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate  # 每秒補充的數量
+        self.capacity = capacity  # 最多可累積的數量（瞬間可連發的則數）
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # 收到 retry_after 後暫停到這個時間
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """還要等多久才能取得一個 token，0 表示現在就可以"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+    def pause(self, seconds: float, now: float):
+        self._refill(now)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+class _Outgoing:
+    __slots__ = ('text', 'future', 'attempts')
+
+    def __init__(self, text: str, future: asyncio.Future):
+        self.text = text
+        self.future = future  # 送出後結果為 True，失敗為 False
+        self.attempts = 0
+
+
+class _ChatQueue:
+    __slots__ = ('lanes', 'bucket', 'sending', 'gen')
+
+    def __init__(self, bucket: TokenBucket):
+        self.lanes = [deque() for _ in range(PRIORITY_LEVELS)]
+        self.bucket = bucket
+        self.sending = False  # 同一個 chat 一次只送一則，保持訊息順序
+        self.gen = 0  # 每次重新排程就加一，舊的排程紀錄會被略過
+
+    def head_priority(self) -> Optional[int]:
+        for priority, lane in enumerate(self.lanes):
+            if lane:
+                return priority
+        return None
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    # telegram.error.RetryAfter 的 retry_after 可能是秒數或 timedelta
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return None
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# 集中排程所有送出的訊息：每個 chat 與全域各有 token bucket 限速，
+# 遊戲訊息優先於查詢結果，遇到 429 依 retry_after 暫停該 chat 後重送
+class SendScheduler:
+    def __init__(self,
+                 per_chat_rate: float = 1.0,
+                 global_rate: float = 30.0,
+                 per_chat_burst: float = 1,
+                 global_burst: float = 1,
+                 max_retries: int = 5):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_retries = max_retries
+        self._send: Callable[[int, str], Awaitable] = None
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._ready = []  # (priority, seq, chat_id, gen)：可以立即送出的 chat
+        self._delayed = []  # (ready_at, seq, chat_id, gen)：等待限速的 chat
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._deliveries = set()
+
+        # 統計數據
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0  # 收到 retry_after 而重送的次數
+        self.queued = 0  # 目前排隊中的訊息數
+
+    def start(self, send: Callable[[int, str], Awaitable]):
+        """send(chat_id, text) 為實際送出訊息的函數，例如 bot.send_message"""
+        self._send = send
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10):
+        """等待排隊中的訊息送完（最多 timeout 秒）後停止"""
+        deadline = time.monotonic() + timeout
+        while (self.queued or self._deliveries) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_TURN) -> asyncio.Future:
+        """放入佇列後立即返回，需要知道是否送達時可以 await 回傳的 future"""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(TokenBucket(self.per_chat_rate, self.per_chat_burst))
+        future = asyncio.get_running_loop().create_future()
+        chat.lanes[priority].append(_Outgoing(text, future))
+        self.submitted += 1
+        self.queued += 1
+        if not chat.sending:
+            self._schedule(chat_id, chat)
+        return future
+
+    def sender(self, chat_id: int, priority: int = PRIORITY_TURN) -> Callable[[str], Awaitable]:
+        """回傳與 message_handler 相同介面的函數，送出時不等待"""
+        async def send(text: str):
+            self.submit(chat_id, text, priority)
+        return send
+
+    def _schedule(self, chat_id: int, chat: _ChatQueue):
+        now = time.monotonic()
+        chat.gen += 1
+        priority = chat.head_priority()
+        if priority is None:
+            # 沒有訊息了，等 bucket 補滿後再清除，避免重建 bucket 繞過限速
+            ready_at = now + (chat.bucket.capacity - chat.bucket.tokens) / chat.bucket.rate
+            heapq.heappush(self._delayed, (max(ready_at, chat.bucket.blocked_until), next(self._seq), chat_id, chat.gen))
+            return
+        wait = chat.bucket.wait_time(now)
+        if wait <= 0:
+            heapq.heappush(self._ready, (priority, next(self._seq), chat_id, chat.gen))
+        else:
+            heapq.heappush(self._delayed, (now + wait, next(self._seq), chat_id, chat.gen))
+        self._wakeup.set()
+
+    def _current(self, chat_id: int, gen: int) -> Optional[_ChatQueue]:
+        chat = self._chats.get(chat_id)
+        if chat is None or chat.gen != gen or chat.sending:
+            return None
+        return chat
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, chat_id, gen = heapq.heappop(self._delayed)
+                chat = self._current(chat_id, gen)
+                if chat is None:
+                    continue
+                priority = chat.head_priority()
+                if priority is None:
+                    if chat.bucket.is_full(now):
+                        del self._chats[chat_id]
+                    continue
+                heapq.heappush(self._ready, (priority, next(self._seq), chat_id, gen))
+
+            while self._ready and self._current(self._ready[0][2], self._ready[0][3]) is None:
+                heapq.heappop(self._ready)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = self.global_bucket.wait_time(now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            priority, _, chat_id, _ = heapq.heappop(self._ready)
+            chat = self._chats[chat_id]
+            chat.bucket.take(now)
+            self.global_bucket.take(now)
+            message = chat.lanes[priority].popleft()
+            chat.sending = True
+            chat.gen += 1
+            task = asyncio.create_task(self._deliver(chat_id, chat, priority, message))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, chat_id: int, chat: _ChatQueue, priority: int, message: _Outgoing):
+        try:
+            await self._send(chat_id, message.text)
+            self.sent += 1
+            self.queued -= 1
+            message.future.set_result(True)
+        except Exception as e:
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None and message.attempts < self.max_retries:
+                # 被限速，放回最前面，暫停這個 chat 後重送
+                self.retried += 1
+                message.attempts += 1
+                chat.lanes[priority].appendleft(message)
+                chat.bucket.pause(retry_after, time.monotonic())
+                logging.warning(f"chat_id: {chat_id} 被限速，{retry_after} 秒後重送")
+            else:
+                self.failed += 1
+                self.queued -= 1
+                logging.error(f"送出訊息失敗，chat_id: {chat_id}: {e}")
+                message.future.set_result(False)
+        finally:
+            chat.sending = False
+            self._schedule(chat_id, chat)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queued,
+            'in_flight': len(self._deliveries),
+            'chats': len(self._chats),
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+        }
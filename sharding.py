@@ -0,0 +1,72 @@
+# 一致性雜湊：把群組（chat_id）分配到多個 bot 實例，增減實例時只有約 1/N 的群組需要搬移
+# 分配只是讓同一個群組盡量落在同一個實例（快取命中、少衝突），正確性由資料庫的版本比對保證
+
+import bisect
+import hashlib
+from typing import Dict, Iterable, List
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 100):
+        self.vnodes = vnodes  # 每個節點在環上的虛擬節點數，越多分配越平均
+        self._ring: List[int] = []  # 排序過的雜湊值
+        self._owners: Dict[int, str] = {}  # 雜湊值: 節點
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._ring, point)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        for i in range(self.vnodes):
+            point = _hash(f"{node}#{i}")
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._ring.remove(point)
+
+    def node_for(self, key) -> str:
+        """順時針方向第一個節點"""
+        if not self._ring:
+            raise LookupError("雜湊環上沒有節點")
+        index = bisect.bisect(self._ring, _hash(str(key))) % len(self._ring)
+        return self._owners[self._ring[index]]
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+if __name__ == '__main__':
+    # 分配是否平均，以及增加一個節點時有多少群組需要搬移
+    import argparse
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="一致性雜湊的分配與搬移比例")
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--chats', type=int, default=100000)
+    parser.add_argument('--vnodes', type=int, default=100)
+    args = parser.parse_args()
+
+    ring = HashRing([f"bot-{i}" for i in range(args.nodes)], args.vnodes)
+    chat_ids = [-1000000000000 - i for i in range(args.chats)]  # 群組的 chat_id 是負數
+    before = {chat_id: ring.node_for(chat_id) for chat_id in chat_ids}
+    counts = Counter(before.values())
+    print(f"{args.nodes} 個節點：每個節點 {min(counts.values())} ~ {max(counts.values())} 個群組"
+          f"（平均 {args.chats // args.nodes}）")
+
+    ring.add(f"bot-{args.nodes}")
+    moved = sum(1 for chat_id in chat_ids if ring.node_for(chat_id) != before[chat_id])
+    print(f"增加 1 個節點：{moved / args.chats:.1%} 的群組搬移（理想值 {1 / (args.nodes + 1):.1%}）")
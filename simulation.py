@@ -0,0 +1,253 @@
+# 不經過 Telegram，直接用 GameState 大量模擬整場遊戲，用來調整遊戲數值
+
+import argparse
+import logging
+import statistics
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import base
+import game_state
+from board import DEFAULT_BOARD, get_board_template
+from game_state import GameState, Player, Square, SquareType
+
+
+# 玩家策略：決定要不要買地、升級，以及欠款時如何籌錢
+class Strategy:
+    name = 'base'
+
+    def want_buy(self, game: GameState, player: Player, square: Square) -> bool:
+        return player.money >= square.price
+
+    def want_upgrade(self, game: GameState, player: Player, square: Square) -> bool:
+        return player.money >= square.house_cost
+
+    def raise_cash(self, game: GameState, player: Player, amount: int):
+        # 先降級（全額退回房屋費用），再抵押，最後賣掉抵押中的地產
+        while player.money < amount:
+            upgraded = [s for s in player.properties.values() if s.level > 0]
+            if upgraded:
+                game.apply_downgrade_property(player, max(upgraded, key=lambda s: s.level))
+                continue
+            if player.properties:
+                game.apply_mortgage_property(player, next(iter(player.properties.values())))
+                continue
+            if player.mortgage_properties:
+                game.apply_sell_property(player, next(iter(player.mortgage_properties.values())))
+                continue
+            return
+
+
+class AlwaysBuy(Strategy):
+    name = 'always-buy'
+
+
+class NeverUpgrade(Strategy):
+    name = 'never-upgrade'
+
+    def want_upgrade(self, game, player, square):
+        return False
+
+
+class CashThreshold(Strategy):
+    name = 'cash-threshold'
+
+    def __init__(self, reserve: int = 5000):
+        self.reserve = reserve  # 買地或升級後至少要留下的現金
+
+    def want_buy(self, game, player, square):
+        return player.money - square.price >= self.reserve
+
+    def want_upgrade(self, game, player, square):
+        return player.money - square.house_cost >= self.reserve
+
+
+class NeverBuy(Strategy):
+    name = 'never-buy'
+
+    def want_buy(self, game, player, square):
+        return False
+
+    def want_upgrade(self, game, player, square):
+        return False
+
+
+class AutoPay(Strategy):
+    name = 'autopay'
+
+    def raise_cash(self, game, player, amount):
+        # 和 /autopay 相同：變賣損失最小的組合並直接付清
+        game.apply_autopay(player)
+
+
+STRATEGIES = {cls.name: cls for cls in (AlwaysBuy, NeverUpgrade, CashThreshold, NeverBuy, AutoPay)}
+
+
+def apply_settings(settings: dict):
+    """覆寫遊戲數值（在每個 worker 行程中執行）"""
+    logging.getLogger().setLevel(logging.WARNING)
+    if settings.get('start_money') is not None:
+        base.START_MONEY = settings['start_money']
+    if settings.get('pass_go_money') is not None:
+        game_state.PASS_GO_MONEY = settings['pass_go_money']
+    if settings.get('monopoly_multiplier') is not None:
+        game_state.MONOPOLY_RENT_MULTIPLIER = settings['monopoly_multiplier']
+
+
+def play_game(seed: int, strategy_names: List[str], settings: dict) -> dict:
+    """模擬一場遊戲，回傳回合數、勝利者與破產時間"""
+    toll_scale = settings.get('toll_scale', 1.0)
+    template = get_board_template(settings['board']) if settings.get('board') else DEFAULT_BOARD
+    # 只用同步的規則核心，不產生訊息也不需要 event loop；同一個種子在任何行程都會得到相同的遊戲
+    game = GameState(None, template.scaled(toll_scale) if toll_scale != 1.0 else template, seed=seed)
+
+    strategies: Dict[int, Strategy] = {}
+    for i, name in enumerate(strategy_names):
+        game.apply_add_player(f"{name}#{i}", i + 1)
+        strategies[i + 1] = STRATEGIES[name]()
+    game.apply_start_game()
+    players = list(game.players)  # 遊戲結束會 reset，先保留玩家物件
+
+    max_turns = settings.get('max_turns', 1000)
+    turns = 0
+    bankrupt_at = {}
+    while game.started and turns < max_turns:
+        player = game.get_current_player()
+        strategy = strategies[player.user_id]
+        game.apply_roll_dice(player)
+        turns += 1
+
+        if game.started and game.get_current_player() is player and game.rolled:
+            square = game.get_square(player.position)
+            if game.ledger:
+                strategy.raise_cash(game, player, game.ledger['amount'])
+                if game.ledger:
+                    game.apply_pay(player)
+            elif square.type == SquareType.PROPERTY and square.owner is None:
+                if strategy.want_buy(game, player, square):
+                    game.apply_buy_property(player, square)
+            elif square.owner is player and square.level < len(square.tolls) - 1 and not square.mortgaged:
+                if strategy.want_upgrade(game, player, square):
+                    game.apply_upgrade_property(player, square)
+        if game.started and game.get_current_player() is player and game.rolled and not game.ledger:
+            game.apply_next_turn(player)
+
+        for p in players:
+            if p.money < 0 and p.user_id not in bankrupt_at:
+                bankrupt_at[p.user_id] = turns
+
+    active = [p for p in players if p.money >= 0]
+    winner = active[0] if not game.started and len(active) == 1 else None
+    return {
+        'turns': turns,
+        'players': [strategies[p.user_id].name for p in players],
+        'winner': strategies[winner.user_id].name if winner else None,
+        'bankruptcies': [(strategies[uid].name, turn) for uid, turn in bankrupt_at.items()],
+    }
+
+
+def _run_chunk(seeds: List[int], strategy_names: List[str], settings: dict) -> List[dict]:
+    return [play_game(seed, strategy_names, settings) for seed in seeds]
+
+
+def run_simulation(games: int,
+                   strategy_names: List[str],
+                   settings: dict = None,
+                   workers: int = None,
+                   seed: int = 0,
+                   chunk_size: int = 100) -> dict:
+    """把遊戲分批丟到多個行程執行並彙整結果"""
+    settings = settings or {}
+    seeds = list(range(seed, seed + games))
+    chunks = [seeds[i:i + chunk_size] for i in range(0, games, chunk_size)]
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=apply_settings, initargs=(settings,)) as executor:
+        futures = [executor.submit(_run_chunk, chunk, strategy_names, settings) for chunk in chunks]
+        for future in futures:
+            results.extend(future.result())
+    elapsed = time.perf_counter() - start
+    return summarize(results, elapsed, settings.get('max_turns', 1000))
+
+
+def summarize(results: List[dict], elapsed: float, max_turns: int) -> dict:
+    turns = sorted(r['turns'] for r in results)
+    played = Counter()
+    wins = Counter()
+    bankrupt_turns = defaultdict(list)
+    for r in results:
+        played.update(set(r['players']))
+        if r['winner']:
+            wins[r['winner']] += 1
+        for name, turn in r['bankruptcies']:
+            bankrupt_turns[name].append(turn)
+
+    def percentile(p):
+        return turns[min(len(turns) - 1, int(len(turns) * p))]
+
+    return {
+        'games': len(results),
+        'elapsed': elapsed,
+        'games_per_sec': len(results) / elapsed if elapsed else 0.0,
+        'turns': {
+            'min': turns[0],
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': turns[-1],
+            'mean': statistics.fmean(turns),
+        },
+        'unfinished': sum(1 for r in results if r['winner'] is None and r['turns'] >= max_turns),
+        'win_rate': {name: wins[name] / played[name] for name in played},
+        'bankruptcy': {
+            name: {'count': len(ts), 'mean_turn': statistics.fmean(ts), 'median_turn': statistics.median(ts)}
+            for name, ts in bankrupt_turns.items()
+        },
+    }
+
+
+def print_report(report: dict):
+    print(f"共 {report['games']} 場，耗時 {report['elapsed']:.2f} 秒，{report['games_per_sec']:.1f} 場/秒")
+    t = report['turns']
+    print(f"回合數: min {t['min']}  p50 {t['p50']}  p90 {t['p90']}  p99 {t['p99']}  max {t['max']}  平均 {t['mean']:.1f}")
+    print(f"未分出勝負（達到回合上限）: {report['unfinished']} 場")
+    print("勝率:")
+    for name, rate in sorted(report['win_rate'].items(), key=lambda x: -x[1]):
+        print(f"  {name:>15}: {rate:.1%}")
+    print("破產:")
+    for name, b in sorted(report['bankruptcy'].items()):
+        print(f"  {name:>15}: {b['count']} 次，平均第 {b['mean_turn']:.1f} 回合，中位數第 {b['median_turn']} 回合")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="大量模擬遊戲，用來調整起始金額、過路費等數值")
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--players', default='always-buy,never-upgrade,cash-threshold',
+                        help=f"以逗號分隔的玩家策略，可用: {', '.join(STRATEGIES)}")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-turns', type=int, default=1000)
+    parser.add_argument('--start-money', type=int, default=None)
+    parser.add_argument('--pass-go-money', type=int, default=None)
+    parser.add_argument('--toll-scale', type=float, default=1.0)
+    parser.add_argument('--board', default=None, help="棋盤代號（boards/ 中的 id），預設為 taiwan")
+    parser.add_argument('--monopoly-multiplier', type=int, default=None)
+    args = parser.parse_args()
+
+    report = run_simulation(
+        args.games,
+        args.players.split(','),
+        settings={
+            'start_money': args.start_money,
+            'pass_go_money': args.pass_go_money,
+            'toll_scale': args.toll_scale,
+            'board': args.board,
+            'monopoly_multiplier': args.monopoly_multiplier,
+            'max_turns': args.max_turns,
+        },
+        workers=args.workers,
+        seed=args.seed,
+    )
+    print_report(report)
@@ -1,50 +1,264 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List
+
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes
 
+from async_repository import *
 from config import *
+from event_log import EventSourcedGameStateRepository, FileEventLog
+from fake_bot_api import OfflineBot
+from game_cache import GameCache
+from game_messages import format_board_choices, format_turn_timeout
 from game_state import *
 from game_state_repository import *
+from message_buffer import MessageBuffer
+import metrics
+from odds import format_board_odds
+from send_scheduler import PRIORITY_INFO, PRIORITY_TURN, SendScheduler
+from sharding import HashRing
+from tiered_repository import TieredGameStateRepository
+from turn_timer import TurnTimers
+from write_behind import WriteBehindQueue
+
+event_loop = None  # Bot 啟動時設定，給其他執行緒排程工作用
+
+# 分層儲存發現本地副本比遠端舊時（在複寫執行緒中呼叫），丟掉記憶體中的遊戲，下次指令重新載入
+def discard_stale_game(chat_id: str):
+    if event_loop is not None:
+        event_loop.call_soon_threadsafe(game_cache.invalidate, int(chat_id))
+
+# 建立遊戲狀態的儲存位置，同步的 repository 會放到執行緒池執行，不會卡住 event loop
+def create_repository() -> AsyncGameStateRepository:
+    if SHARED_STORAGE and (EVENT_LOG_DIR or TIER_CACHE_DIR):
+        # 事件紀錄與本地副本只屬於一個實例，無法和其他實例比對版本
+        raise ValueError("SHARED_STORAGE 不能與 EVENT_LOG_DIR、TIER_CACHE_DIR 同時使用")
+    if STORAGE_BACKEND == "sqlite":
+        repository = SqliteGameStateRepository(SQLITE_PATH)
+    elif STORAGE_BACKEND == "local":
+        repository = LocalGameStateRepository(LOCAL_STATE_DIR)
+    elif EVENT_LOG_DIR or TIER_CACHE_DIR:
+        # 事件紀錄與分層儲存是同步的，也使用同步的 Firestore client
+        repository = FirebaseGameStateRepository(FIREBASE_CRED_PATH)
+        if TIER_CACHE_DIR:
+            repository = TieredGameStateRepository(LocalGameStateRepository(TIER_CACHE_DIR), repository,
+                                                   TIER_REPLICATE_INTERVAL, TIER_VERIFY_LOCAL, discard_stale_game)
+    else:
+        return AsyncFirestoreGameStateRepository.from_credentials(FIREBASE_CRED_PATH, pool_size=FIRESTORE_POOL_SIZE)
+    if EVENT_LOG_DIR:
+        # 指令只追加到事件紀錄，每 SNAPSHOT_EVERY 筆才寫入一次完整快照
+        repository = EventSourcedGameStateRepository(repository, FileEventLog(EVENT_LOG_DIR), SNAPSHOT_EVERY)
+    return ExecutorGameStateRepository(repository)
 
-repository = FirebaseGameStateRepository(FIREBASE_CRED_PATH)
-# repository = LocalGameStateRepository()
+# 指標：/metrics（METRICS_PORT）與 /stats
+command_latency = metrics.registry.histogram('payuppal_command_seconds', "指令從收到到處理完成的時間（含等待鎖與重新執行）")
+lock_wait = metrics.registry.histogram('payuppal_lock_wait_seconds', "指令等待群組鎖的時間")
+lock_contended = metrics.registry.counter('payuppal_lock_contended_total', "開始時群組鎖已被其他指令占用的次數")
+rule_latency = metrics.registry.histogram('payuppal_rule_seconds', "執行遊戲規則的時間（不含等待鎖與寫入資料庫）")
+storage_latency = metrics.registry.histogram('payuppal_storage_seconds', "儲存操作的時間")
+storage_errors = metrics.registry.counter('payuppal_storage_errors_total', "儲存操作失敗的次數")
+commit_conflicts = metrics.registry.counter('payuppal_commit_conflicts_total', "共用資料庫時版本衝突而重新執行的次數")
+metrics.registry.callback('payuppal_resident_games', "記憶體中的遊戲數", lambda: len(game_cache))
+metrics.registry.callback('payuppal_lock_waiting', "正在等待群組鎖的指令數", lambda: game_cache.waiting())
+metrics.registry.callback('payuppal_game_cache_total', "遊戲快取查詢次數",
+                          lambda: {'hit': game_cache.hits, 'miss': game_cache.misses}, 'counter', 'result')
+metrics.registry.callback('payuppal_telegram_messages_total', "送出 Telegram 訊息的次數",
+                          lambda: {key: send_scheduler.stats()[key] for key in ('sent', 'failed', 'retried')},
+                          'counter', 'result')
+metrics.registry.callback('payuppal_send_queue', "排隊等待送出的訊息數", lambda: send_scheduler.queued)
+metrics.registry.callback('payuppal_write_queue', "等待寫入資料庫的群組數", lambda: writer.queue_depth)
+metrics.registry.callback('payuppal_turn_timers', "排程中的回合計時器數", lambda: len(turn_timers))
+metrics.registry.callback('payuppal_turn_timeouts_total', "回合逾時的處理次數",
+                          lambda: {'fired': turn_timers.fired, 'failed': turn_timers.failed}, 'counter', 'result')
+metrics_runner = None  # /metrics 的 aiohttp server
+
+repository = InstrumentedGameStateRepository(create_repository(), storage_latency, storage_errors)
+
+if CUSTOM_BOARD_DIR:
+    # 要在載入任何遊戲之前註冊，存檔中的棋盤模板才找得到
+    logging.info(f"載入自訂棋盤: {[template.key for template in load_board_dir(CUSTOM_BOARD_DIR)]}")
 
 # 關閉 httpx 的日誌
 logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('httpcore').setLevel(logging.WARNING)
 
-# 多群組遊戲狀態與同步鎖
-chat_games = {}  # chat_id: GameState
-chat_locks = {}  # chat_id: asyncio.Lock
+# 差異寫入失敗時，改用記憶體中的完整快照
+def snapshot_game_state(chat_id: str) -> dict | None:
+    game_state = game_cache.peek(int(chat_id))
+    return game_state.to_dict() if game_state else None
+
+# 延遲寫入，指令不需要等待資料庫寫入
+writer = WriteBehindQueue(repository, SAVE_FLUSH_INTERVAL, SAVE_BATCH_SIZE, snapshot_game_state)
+
+# 把遊戲狀態的變動放入延遲寫入佇列（共用資料庫時改在指令結束時由 commit_game_state 寫入）
+def persist_game_state(chat_id, game_state: GameState):
+    if SHARED_STORAGE:
+        return
+    # 只寫入變動的欄位，第一次儲存或舊格式才存完整快照
+    delta = game_state.collect_delta()
+    events = [event.to_dict() for event in game_state.pop_events()]
+    if delta is None:
+        writer.enqueue(str(chat_id), game_state.to_dict(), events)
+    elif delta or events:
+        writer.enqueue_delta(str(chat_id), delta, events)
+    game_state.mark_clean()
+
+# 共用資料庫時，指令結束後立即以版本比對寫入；其他實例已經寫入較新的版本時丟出 VersionConflict
+async def commit_game_state(chat_id, game_state: GameState):
+    delta = game_state.collect_delta()
+    if delta is None:
+        state = game_state.to_dict()
+    elif delta:
+        state = None
+    else:
+        return
+    game_state.version = await repository.compare_and_save(str(chat_id), game_state.version, state, delta)
+    game_state.pop_events()
+    game_state.mark_clean()
+
+# 遊戲移出記憶體前先寫回資料庫，下次指令再從資料庫載入
+async def evict_game_state(chat_id, game_state: GameState):
+    # 沒有玩家也從未存過的遊戲（只看過 /board、/info，或 /reset 刪除資料後）不寫入，免得建立空的文件
+    if not game_state.players and game_state.is_unsaved():
+        return
+    if SHARED_STORAGE:
+        try:
+            await commit_game_state(chat_id, game_state)
+        except VersionConflict:
+            # 其他實例已經寫入較新的版本，記憶體中的遊戲直接丟掉
+            logging.warning(f"chat_id: {chat_id} 淘汰時版本衝突，捨棄未寫入的變動")
+        return
+    persist_game_state(chat_id, game_state)
+    await writer.flush(str(chat_id))
+    if writer.has_pending(str(chat_id)):
+        raise RuntimeError(f"chat_id: {chat_id} 的遊戲狀態尚未寫入")
+
+# 過期的遊戲丟掉時，佇列中還沒寫入的舊變動也一起丟掉，否則會疊在重新載入的狀態上
+def discard_pending_writes(chat_id: int):
+    writer.discard(str(chat_id))
 
-# 獲取遊戲狀態，優先從 Firebase 載入
-def get_game_state(update: Update) -> GameState:
+# 多群組遊戲狀態與同步鎖，有數量上限並會清除閒置的遊戲
+game_cache = GameCache(GAME_CACHE_SIZE, GAME_IDLE_TTL, evict_game_state, discard_pending_writes)
+chat_messages = {}  # chat_id: MessageBuffer，執行中指令的訊息緩衝
+# webhook worker 只負責雜湊環分配給它的群組，全域限速也由所有 worker 平分（由 configure_worker 設定）
+worker_index = None  # 單一行程時為 None
+shard_ring = None
+
+def owns_chat(chat_id: int) -> bool:
+    return shard_ring is None or shard_ring.node_for(chat_id) == str(worker_index)
+
+# 所有送出的訊息都經過排程器限速
+send_scheduler = SendScheduler(SEND_PER_CHAT_RATE, SEND_GLOBAL_RATE)
+
+def configure_worker(index: int, workers: int):
+    """webhook worker 在 build_application 之前呼叫，設定自己的編號與雜湊環（要和 ingress 的分配相同）"""
+    global worker_index, shard_ring
+    worker_index = index
+    shard_ring = HashRing(str(i) for i in range(workers))
+    send_scheduler.global_bucket.rate = SEND_GLOBAL_RATE / workers
+
+# 所有群組的回合期限放在同一個計時器中，期限到了由 expire_turn 自動擲骰子或跳過
+turn_timers = TurnTimers(lambda chat_id: run_locked(chat_id, lambda: expire_turn(chat_id), command='expire_turn'),
+                         TURN_TIMER_CONCURRENCY)
+
+def schedule_turn_timer(chat_id: int, game_state: GameState):
+    if game_state.turn_deadline:
+        turn_timers.schedule(chat_id, game_state.turn_deadline)
+    else:
+        turn_timers.cancel(chat_id)
+
+# 從資料庫載入遊戲狀態，沒有資料時建立新的遊戲；存檔中的回合期限重新排程（已經過期的會立即處理）
+async def load_game_state(chat_id: int) -> GameState:
+    data = await repository.load_game_state(str(chat_id))
+    if data:
+        game_state = GameState.from_dict(data, send_scheduler.sender(chat_id))
+        schedule_turn_timer(chat_id, game_state)
+        return game_state
+    return GameState(send_scheduler.sender(chat_id))
+
+# 批次載入多個遊戲（啟動時預先載入用）
+async def load_game_states(chat_ids: List[int]) -> Dict[int, GameState]:
+    states = await repository.load_many([str(chat_id) for chat_id in chat_ids])
+    games = {int(chat_id): GameState.from_dict(data, send_scheduler.sender(int(chat_id))) for chat_id, data in states.items()}
+    for chat_id, game_state in games.items():
+        schedule_turn_timer(chat_id, game_state)
+    return games
+
+# 獲取遊戲狀態，不在記憶體中時從資料庫載入（同一個群組同時只載入一次）
+async def get_game_state(update: Update) -> GameState:
     # 群組的 ID
     chat_id = update.effective_chat.id
-    if chat_id not in chat_games:
-        # 嘗試從 Firebase 載入
-        data = repository.load_game_state(str(chat_id))
-        if data:
-            chat_games[chat_id] = GameState.from_dict(data, update.message.reply_text)
-        else:
-            chat_games[chat_id] = GameState(update.message.reply_text)
-    chat_games[chat_id].message_handler = update.message.reply_text
-    return chat_games[chat_id]
+    game_state = await game_cache.load(chat_id, load_game_state)
+    # 指令執行中的訊息先放進緩衝，結束時一次送出
+    game_state.message_handler = chat_messages.get(chat_id, update.message.reply_text)
+    return game_state
 
 # 使用鎖來確保同一時間只有一個使用者在操作遊戲狀態
-async def with_lock(update: Update, context: ContextTypes.DEFAULT_TYPE, handler):
-    chat_id = update.effective_chat.id
-    if chat_id not in chat_locks:
-        chat_locks[chat_id] = asyncio.Lock()
-    lock = chat_locks[chat_id]
-    async with lock:
-        await handler(update, context)
-
-# 在每次遊戲狀態變動後自動儲存
-async def save_and_call(chat_id, func, *args, **kwargs):
-    result = await func(*args, **kwargs)
-    repository.save_game_state(str(chat_id), chat_games[chat_id].to_dict())
+async def with_lock(update: Update, context: ContextTypes.DEFAULT_TYPE, handler, priority: int = PRIORITY_TURN):
+    await run_locked(update.effective_chat.id, lambda: handler(update, context), priority, handler.__name__)
+
+# 取得群組的鎖執行 handler（指令與回合逾時共用），共用資料庫時版本衝突會重新執行
+async def run_locked(chat_id: int, handler, priority: int = PRIORITY_TURN, command: str = None):
+    command = command or handler.__name__
+    start = time.perf_counter()
+    lock = game_cache.acquire(chat_id)
+    if lock.locked():
+        lock_contended.inc(command=command)
+    try:
+        async with lock:
+            lock_wait.observe(time.perf_counter() - start, command=command)
+            for attempt in range(COMMIT_RETRIES + 1):
+                messages = chat_messages[chat_id] = MessageBuffer(send_scheduler.sender(chat_id, priority))
+                try:
+                    await handler()
+                    if SHARED_STORAGE and game_cache.peek(chat_id) is not None:
+                        await commit_game_state(chat_id, game_cache.peek(chat_id))
+                except VersionConflict as e:
+                    # 其他實例先寫入了：這次的結果不算數，訊息不送出，載入最新狀態後重新執行
+                    logging.info(f"{e}，第 {attempt + 1} 次重新執行")
+                    commit_conflicts.inc(command=command)
+                    messages.discard()
+                    game_cache.invalidate(chat_id, force=True)
+                    if attempt == COMMIT_RETRIES:
+                        await messages("其他玩家正在操作，請稍後再試一次。")
+                    continue
+                finally:
+                    del chat_messages[chat_id]
+                    await messages.flush()
+                break
+    finally:
+        game_cache.release(chat_id)
+        command_latency.observe(time.perf_counter() - start, command=command)
+    await game_cache.sweep()
+
+# 在每次遊戲狀態變動後自動儲存（放入延遲寫入佇列）
+# 玩家的指令改變了狀態就重新計算回合期限，和狀態一起儲存
+# game_state 由指令傳入：執行期間記憶體中的遊戲可能已被標記為過期，不能再從快取取一次
+async def save_and_call(chat_id, game_state: GameState, func, *args, **kwargs):
+    revision = game_state.revision
+    with rule_latency.time(command=func.__name__):
+        result = await func(*args, **kwargs)
+    if game_state.revision != revision:
+        game_state.touch_turn_timer(time.time())
+    persist_game_state(chat_id, game_state)
+    schedule_turn_timer(chat_id, game_state)
     return result
 
+# 回合期限到了（由 turn_timers 在群組的鎖中呼叫）：期限已經延後或取消時只重新排程
+async def expire_turn(chat_id: int):
+    game_state = await game_cache.load(chat_id, load_game_state)
+    now = time.time()
+    if not game_state.turn_deadline or game_state.turn_deadline > now:
+        schedule_turn_timer(chat_id, game_state)
+        return
+    game_state.message_handler = chat_messages[chat_id]
+    with rule_latency.time(command='expire_turn'):
+        await game_state.expire_turn(now)
+    persist_game_state(chat_id, game_state)
+    schedule_turn_timer(chat_id, game_state)
+
 # 處理使用者輸入的訊息
 async def handle_message_property(update: Update, context: ContextTypes.DEFAULT_TYPE, game_state: GameState) -> Square:
     # 假設訊息格式為 /command <property_name>
@@ -55,7 +269,7 @@ async def handle_message_property(update: Update, context: ContextTypes.DEFAULT_
 
     message_split = message.split(" ", 1)
     if len(message_split) < 2 or not message_split[1].strip():
-        await update.message.reply_text(f"請在指令後面輸入地名。例如: {message_split[0]} 台北")
+        await game_state.message_handler(f"請在指令後面輸入地名。例如: {message_split[0]} 台北")
         return None
     
     square = game_state.get_square_by_name(message_split[1].strip())
@@ -65,99 +279,262 @@ async def handle_message_property(update: Update, context: ContextTypes.DEFAULT_
 
 # 指令處理函數
 async def join(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     player_name = update.effective_user.first_name
     user_id = update.effective_user.id
-    await save_and_call(update.effective_chat.id, game_state.add_player, player_name, user_id)
+    await save_and_call(update.effective_chat.id, game_state, game_state.add_player, player_name, user_id)
             
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
-    await save_and_call(update.effective_chat.id, game_state.start_game)
+    game_state = await get_game_state(update)
+    await save_and_call(update.effective_chat.id, game_state, game_state.start_game)
 
 async def roll(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
-    await save_and_call(update.effective_chat.id, game_state.roll_dice, game_state.get_player(user_id))
+    await save_and_call(update.effective_chat.id, game_state, game_state.roll_dice, game_state.get_player(user_id))
 
 async def buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
     if player:
         current_square = game_state.get_square(player.position)
-        await save_and_call(update.effective_chat.id, game_state.buy_property, player, current_square)
+        await save_and_call(update.effective_chat.id, game_state, game_state.buy_property, player, current_square)
 
 async def sell(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
     square = await handle_message_property(update, context, game_state)
     if square:
-        await save_and_call(update.effective_chat.id, game_state.sell_property, player, square)
+        await save_and_call(update.effective_chat.id, game_state, game_state.sell_property, player, square)
 
 async def upgrade(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
     if player:
         current_square = game_state.get_square(player.position)
-        await save_and_call(update.effective_chat.id, game_state.upgrade_property, player, current_square)
+        await save_and_call(update.effective_chat.id, game_state, game_state.upgrade_property, player, current_square)
 
 async def downgrade(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
     square = await handle_message_property(update, context, game_state)
     if square:
-        await save_and_call(update.effective_chat.id, game_state.downgrade_property, player, square)
+        await save_and_call(update.effective_chat.id, game_state, game_state.downgrade_property, player, square)
 
 async def mortgage(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
     square = await handle_message_property(update, context, game_state)
     if square:
-        await save_and_call(update.effective_chat.id, game_state.mortgage_property, player, square)
+        await save_and_call(update.effective_chat.id, game_state, game_state.mortgage_property, player, square)
 
 async def pay(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
-    await save_and_call(update.effective_chat.id, game_state.pay, player)
+    await save_and_call(update.effective_chat.id, game_state, game_state.pay, player)
 
-async def nextplayer(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+async def autopay(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
-    await save_and_call(update.effective_chat.id, game_state.next_turn, player)
+    await save_and_call(update.effective_chat.id, game_state, game_state.autopay, player)
 
-async def info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+async def nextplayer(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    game_state = await get_game_state(update)
     user_id = update.effective_user.id
     player = game_state.get_player(user_id)
-    await game_state.info(player)
+    await save_and_call(update.effective_chat.id, game_state, game_state.next_turn, player)
+
+# /map 列出可選擇的棋盤，/map <代號> 在遊戲開始前更換這個群組的棋盤
+async def choose_map(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    game_state = await get_game_state(update)
+    if not context.args:
+        await game_state.message_handler(format_board_choices(list_board_templates(), game_state.board_template))
+        return
+    template = get_board_template(context.args[0])
+    if template is None:
+        await game_state.message_handler("找不到該棋盤！使用 /map 查看可選擇的棋盤。")
+        return
+    await save_and_call(update.effective_chat.id, game_state, game_state.choose_board, template)
+
+# /timeout 顯示回合時間限制，/timeout <秒數> [roll|skip] 設定，/timeout off 關閉
+async def set_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    game_state = await get_game_state(update)
+    usage = f"使用 /timeout <秒數> [{'|'.join(TIMEOUT_ACTIONS)}] 設定，/timeout off 關閉。"
+    if not context.args:
+        await game_state.message_handler(
+            f"目前{format_turn_timeout(game_state.turn_timeout, game_state.timeout_action)}。\n{usage}")
+        return
+    seconds = 0 if context.args[0].lower() == 'off' else context.args[0]
+    action = context.args[1].lower() if len(context.args) > 1 else game_state.timeout_action
+    if not str(seconds).isdigit() or action not in TIMEOUT_ACTIONS:
+        await game_state.message_handler(usage)
+        return
+    await save_and_call(update.effective_chat.id, game_state, game_state.set_turn_timeout, int(seconds), action)
+
+# 唯讀指令：回傳要顯示的文字，狀態沒有變動時使用快取
+def info(game_state: GameState, update: Update) -> str:
+    return game_state.info_text(game_state.get_player(update.effective_user.id))
+
+def richlist(game_state: GameState, update: Update) -> str:
+    return game_state.players_text()
+
+def board(game_state: GameState, update: Update) -> str:
+    return game_state.board_text()
+
+def odds(game_state: GameState, update: Update) -> str:
+    opponents = len([p for p in game_state.players if p.money >= 0]) - 1
+    return game_state.view('odds', lambda: format_board_odds(game_state.board, opponents))
+
+# 唯讀指令不取得群組的鎖，也不改動 message_handler（可能屬於正在執行的指令）
+# 規則核心是同步的，文字在兩次 await 之間一次產生，不會看到執行到一半的狀態
+# 遊戲不在記憶體中而且有指令正在使用時，改為等待群組的鎖再載入，不在鎖外另外放入一份遊戲
+async def read_only(update: Update, context: ContextTypes.DEFAULT_TYPE, view):
+    chat_id = update.effective_chat.id
+    with command_latency.time(command=view.__name__):
+        if game_cache.peek(chat_id) is None and game_cache.in_use(chat_id):
+            lock = game_cache.acquire(chat_id)
+            try:
+                async with lock:
+                    game_state = await game_cache.load(chat_id, load_game_state)
+                    text = view(game_state, update)
+            finally:
+                game_cache.release(chat_id)
+        else:
+            game_state = await game_cache.load(chat_id, load_game_state)
+            text = view(game_state, update)
+        messages = MessageBuffer(send_scheduler.sender(chat_id, PRIORITY_INFO))
+        await messages(text)
+        await messages.flush()
+
+def _ms(seconds: float | None) -> str:
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
 
-async def richlist(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
-    await game_state.show_players()
+def format_stats() -> str:
+    """/stats 顯示的摘要（webhook 模式下只有這個 worker 的數據）"""
+    lines = [f"統計{f'（worker {worker_index}）' if worker_index is not None else ''}，延遲為 p50 / p95 / p99 毫秒"]
+    for title, histogram, label in (("指令", command_latency, 'command'), ("等待鎖", lock_wait, 'command'),
+                                    ("規則", rule_latency, 'command'), ("儲存", storage_latency, 'operation')):
+        lines.append(f"{title}:")
+        for value in sorted(histogram.label_values(label)):
+            quantiles = ' / '.join(_ms(histogram.quantile(q, **{label: value})) for q in (0.5, 0.95, 0.99))
+            lines.append(f"  {value}: {histogram.count(**{label: value})} 次，{quantiles}")
+    cache = game_cache.stats()
+    sends = send_scheduler.stats()
+    lines.append(f"記憶體中的遊戲: {cache['size']}，命中率 {cache['hit_ratio']:.1%}")
+    lines.append(f"鎖: 目前等待 {game_cache.waiting()}，累計遇到占用 {sum(lock_contended.values.values()):.0f} 次，"
+                 f"版本衝突重新執行 {sum(commit_conflicts.values.values()):.0f} 次")
+    lines.append(f"訊息: 已送出 {sends['sent']}，排隊 {sends['queued']}，失敗 {sends['failed']}，限速重送 {sends['retried']}")
+    lines.append(f"寫入佇列: {writer.queue_depth}，儲存失敗 {sum(storage_errors.values.values()):.0f} 次")
+    timers = turn_timers.stats()
+    lines.append(f"回合計時: 排程中 {timers['pending']}，已逾時 {timers['fired']}，處理失敗 {timers['failed']}")
+    return '\n'.join(lines)
 
-async def board(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
-    await game_state.show_board()
+# 管理員查看統計，其他人使用時不回應
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    messages = MessageBuffer(send_scheduler.sender(update.effective_chat.id, PRIORITY_INFO))
+    await messages(format_stats())
+    await messages.flush()
 
 async def reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    game_state = get_game_state(update)
+    game_state = await get_game_state(update)
     if not game_state.double_confirm:
-        await update.message.reply_text("請再次輸入 /reset 來確認重置遊戲。")
+        await game_state.message_handler("請再次輸入 /reset 來確認重置遊戲。")
         game_state.double_confirm = True
         return
-    await save_and_call(update.effective_chat.id, game_state.reset_game)
-    repository.delete_game_state(str(update.effective_chat.id))
-    await update.message.reply_text("使用 /join 來加入遊戲。")
+    chat_id = update.effective_chat.id
+    await save_and_call(chat_id, game_state, game_state.reset_game)
+    # 先把佇列中的狀態寫完，避免刪除後又被舊的快照寫回
+    await writer.flush(str(chat_id))
+    await repository.delete_game_state(str(chat_id))
+    game_state.mark_unsaved()
+    game_state.version = -1
+    await game_state.message_handler("使用 /join 來加入遊戲。")
 
+# 啟動時先批次載入進行中的遊戲，避免重新部署後大量群組同時從資料庫載入
+async def warm_up_games():
+    start = time.perf_counter()
+    try:
+        chat_ids = await repository.list_started_games(min(WARMUP_LIMIT, GAME_CACHE_SIZE))
+        chat_ids = [int(chat_id) for chat_id in chat_ids if owns_chat(int(chat_id))]
+        warmed = await game_cache.warm_up(chat_ids, load_game_states,
+                                          WARMUP_BATCH_SIZE, WARMUP_CONCURRENCY)
+    except Exception:
+        logging.exception("預先載入遊戲失敗，改為收到指令時才載入")
+        return
+    logging.info(f"預先載入 {warmed} 場進行中的遊戲，耗時 {time.perf_counter() - start:.2f} 秒")
 
-if __name__ == '__main__':
-    application = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+# 啟動時從資料庫排程所有遊戲的回合期限，不必載入遊戲（到期時 expire_turn 才載入）
+# 已經預先載入的遊戲在載入時就排程過，以記憶體中的為準
+async def restore_turn_timers():
+    try:
+        deadlines = await repository.list_turn_deadlines()
+    except Exception:
+        logging.exception("讀取回合期限失敗，改為遊戲載入時才排程")
+        return
+    restored = 0
+    for chat_id, deadline in deadlines.items():
+        chat_id = int(chat_id)
+        if owns_chat(chat_id) and game_cache.peek(chat_id) is None:
+            turn_timers.schedule(chat_id, deadline)
+            restored += 1
+    logging.info(f"排程 {restored} 個回合期限（共 {len(turn_timers)} 個）")
+
+# Bot 啟動後（開始接收訊息前）預先載入遊戲並開始背景寫入
+async def on_startup(application):
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    send_scheduler.start(application.bot.send_message)
+    if WARMUP_ON_START:
+        await warm_up_games()
+    await restore_turn_timers()
+    writer.start()
+    game_cache.start()
+    turn_timers.start()
+    if METRICS_PORT:
+        global metrics_runner
+        # webhook worker 各自使用 METRICS_PORT + 編號
+        port = METRICS_PORT + (worker_index or 0)
+        metrics_runner = await metrics.start_server(metrics.registry, METRICS_HOST, port)
+        logging.info(f"指標: http://{METRICS_HOST}:{port}/metrics")
+
+# Bot 停止時送完排隊中的訊息（之後 bot 連線就會關閉）
+async def on_stop(application):
+    await send_scheduler.close()
+    logging.info(f"訊息排程統計: {send_scheduler.stats()}")
+
+# Bot 關閉前把尚未寫入的狀態全部寫完
+async def on_shutdown(application):
+    await turn_timers.close()
+    await game_cache.close()
+    await writer.close()
+    await repository.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    logging.info(f"寫入佇列統計: {writer.stats()}")
+    logging.info(f"遊戲快取統計: {game_cache.stats()}")
+    logging.info(f"儲存統計: {repository.stats()}")
+
+
+# 建立 Bot 並註冊指令（polling 與 webhook worker 共用）
+def build_application(polling: bool = True) -> Application:
+    builder = ApplicationBuilder().concurrent_updates(True).post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+    if OFFLINE_BOT_API:
+        builder = builder.bot(OfflineBot(TELEGRAM_TOKEN or "0:offline"))
+    else:
+        builder = builder.token(TELEGRAM_TOKEN)
+    if not polling:
+        # 更新由 webhook_server 轉送過來，不需要 Updater
+        builder = builder.updater(None)
+    application = builder.build()
 
     # 註冊指令
     application.add_handler(CommandHandler("join", lambda u, c: with_lock(u, c, join)))
@@ -169,11 +546,19 @@ if __name__ == '__main__':
     application.add_handler(CommandHandler("downgrade", lambda u, c: with_lock(u, c, downgrade)))
     application.add_handler(CommandHandler("mortgage", lambda u, c: with_lock(u, c, mortgage)))
     application.add_handler(CommandHandler("pay", lambda u, c: with_lock(u, c, pay)))
+    application.add_handler(CommandHandler("autopay", lambda u, c: with_lock(u, c, autopay)))
     application.add_handler(CommandHandler("next", lambda u, c: with_lock(u, c, nextplayer)))
-    application.add_handler(CommandHandler("info", lambda u, c: with_lock(u, c, info)))
-    application.add_handler(CommandHandler("richlist", lambda u, c: with_lock(u, c, richlist)))
-    application.add_handler(CommandHandler("board", lambda u, c: with_lock(u, c, board)))
+    application.add_handler(CommandHandler("info", lambda u, c: read_only(u, c, info)))
+    application.add_handler(CommandHandler("richlist", lambda u, c: read_only(u, c, richlist)))
+    application.add_handler(CommandHandler("board", lambda u, c: read_only(u, c, board)))
+    application.add_handler(CommandHandler("odds", lambda u, c: read_only(u, c, odds)))
     application.add_handler(CommandHandler("reset", lambda u, c: with_lock(u, c, reset)))
+    application.add_handler(CommandHandler("map", lambda u, c: with_lock(u, c, choose_map)))
+    application.add_handler(CommandHandler("timeout", lambda u, c: with_lock(u, c, set_timeout)))
+    application.add_handler(CommandHandler("stats", show_stats))
+    return application
+
 
-    # 啟動 Bot
-    application.run_polling()
\ No newline at end of file
+if __name__ == '__main__':
+    # 單一行程以 long polling 接收更新；webhook 模式請執行 webhook_server.py
+    build_application().run_polling()
@@ -0,0 +1,334 @@
+# 分層儲存：記憶體（GameCache）→ 本地磁碟快照 → 遠端（Firebase）
+# 讀取由最近的一層提供；寫入立即落在本地，再由背景執行緒合併後複寫到遠端，減少遠端的讀寫次數與延遲
+# 每份狀態帶有版本號，複寫時遠端的版本比較新就不會覆蓋，改為捨棄本地副本
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from game_state_repository import GameStateRepository, VERSION_FIELD, state_version
+
+
+class TieredGameStateRepository(GameStateRepository):
+    def __init__(self,
+                 local: GameStateRepository,
+                 remote: GameStateRepository,
+                 replicate_interval: float = 5.0,
+                 verify_local: bool = True,
+                 on_stale: Callable[[str], None] = None):
+        self.local = local
+        self.remote = remote
+        self.replicate_interval = replicate_interval  # 每隔幾秒把本地的寫入複寫到遠端
+        # 每個 chat 在這個行程第一次載入時，先和遠端比對版本（多台機器共用遠端，或本地副本可能過期時需要）
+        self.verify_local = verify_local
+        self.on_stale = on_stale  # 本地副本比遠端舊、被捨棄時呼叫（在複寫執行緒中）
+        self.executor = local.executor
+        self._versions: Dict[str, int] = {}  # chat_id: 本地最新的版本號
+        self._verified: Set[str] = set()  # 已和遠端比對過版本的 chat
+        self._stale: Set[str] = set()  # 本地副本已捨棄，重新載入前的寫入都要丟掉
+        self._pending: Dict[str, float] = {}  # chat_id: 最早一筆尚未複寫的寫入時間
+        self._lock = threading.Lock()  # 保護 _pending
+        self._wakeup = threading.Condition(self._lock)
+        self._replicating = threading.Lock()  # 複寫與刪除不能交錯，否則刪掉的遊戲會被複寫回去
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='tier-replication', daemon=True)
+        self._thread.start()
+
+        # 統計數據
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.remote_reads = 0  # 讀取遠端的次數（包含比對版本）
+        self.replicated = 0
+        self.replication_failures = 0
+        self.stale_rejected = 0  # 複寫時遠端比較新而捨棄的本地副本
+        self.dropped_writes = 0  # 捨棄本地副本後、重新載入前被丟掉的寫入
+        self.last_replication_lag = 0.0  # 最近一次複寫距離第一筆寫入的秒數
+
+    def _loaded(self, chat_id: str, state: dict) -> dict:
+        self._versions[chat_id] = state.pop(VERSION_FIELD, 0)
+        self._stale.discard(chat_id)
+        return state
+
+    def _trusted(self, chat_id: str) -> bool:
+        return chat_id in self._verified or not self.verify_local
+
+    def _resolve(self, chat_id: str, local: dict | None, remote: dict | None) -> dict | None:
+        """同時有本地與遠端的資料時，使用版本較新的一份"""
+        self._verified.add(chat_id)
+        if state_version(remote) > state_version(local):
+            self.remote_hits += 1
+            self.local.save_game_state(chat_id, remote)
+            return self._loaded(chat_id, remote)
+        if local is None:
+            self.misses += 1
+            return None
+        self.local_hits += 1
+        if state_version(local) > state_version(remote):
+            # 上次關閉前還沒複寫完，補上
+            self._mark_pending(chat_id)
+        return self._loaded(chat_id, local)
+
+    def load_game_state(self, chat_id: str) -> dict | None:
+        local = self.local.load_game_state(chat_id)
+        if local is not None and self._trusted(chat_id):
+            self.local_hits += 1
+            return self._loaded(chat_id, local)
+        self.remote_reads += 1
+        return self._resolve(chat_id, local, self.remote.load_game_state(chat_id))
+
+    def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+        chat_ids = [str(chat_id) for chat_id in chat_ids]
+        local = self.local.load_many(chat_ids)
+        states = {}
+        unresolved = []
+        for chat_id in chat_ids:
+            if chat_id in local and self._trusted(chat_id):
+                self.local_hits += 1
+                states[chat_id] = self._loaded(chat_id, local[chat_id])
+            else:
+                unresolved.append(chat_id)
+        if unresolved:
+            # 本地沒有或需要比對版本的 chat 一次向遠端讀取
+            remote = self.remote.load_many(unresolved)
+            self.remote_reads += len(unresolved)
+            for chat_id in unresolved:
+                state = self._resolve(chat_id, local.get(chat_id), remote.get(chat_id))
+                if state is not None:
+                    states[chat_id] = state
+        return states
+
+    def _writable(self, chat_id: str) -> bool:
+        if chat_id in self._stale:
+            logging.warning(f"chat_id: {chat_id} 的本地副本已過期，捨棄這次寫入")
+            self.dropped_writes += 1
+            return False
+        return True
+
+    def save_game_state(self, chat_id: str, state: dict):
+        self.save_many({chat_id: state})
+
+    def save_many(self, states: Dict[str, dict]):
+        stamped = {}
+        for chat_id, state in states.items():
+            if self._writable(chat_id):
+                stamped[chat_id] = {**state, VERSION_FIELD: self._versions.get(chat_id, 0) + 1}
+        if not stamped:
+            return
+        self.local.save_many(stamped)
+        for chat_id, state in stamped.items():
+            self._versions[chat_id] = state[VERSION_FIELD]
+            self._mark_pending(chat_id)
+
+    def update_game_state(self, chat_id: str, delta: dict, events: List[dict] = None):
+        if not self._writable(chat_id):
+            return
+        if chat_id not in self._versions and self.load_game_state(chat_id) is None:
+            raise KeyError(f"找不到 chat_id: {chat_id} 的遊戲狀態")
+        version = self._versions[chat_id] + 1
+        self.local.update_game_state(chat_id, {**delta, VERSION_FIELD: version}, events)
+        self._versions[chat_id] = version
+        self._mark_pending(chat_id)
+
+    def delete_game_state(self, chat_id: str):
+        with self._replicating:
+            with self._lock:
+                self._pending.pop(chat_id, None)
+            self.local.delete_game_state(chat_id)
+            self.remote.delete_game_state(chat_id)
+            self._versions.pop(chat_id, None)
+            self._verified.add(chat_id)
+            self._stale.discard(chat_id)
+
+    def list_started_games(self, limit: int = None) -> List[str]:
+        # 本地的遊戲可能還沒複寫到遠端，遠端則有其他機器的遊戲
+        chat_ids = dict.fromkeys(self.local.list_started_games(limit))
+        chat_ids.update(dict.fromkeys(self.remote.list_started_games(limit)))
+        return list(chat_ids)[:limit]
+
+    def list_turn_deadlines(self) -> Dict[str, float]:
+        # 兩邊不一致時取較早的期限：到期時會載入最新的狀態再確認，提早只是多載入一次
+        deadlines = self.remote.list_turn_deadlines()
+        for chat_id, deadline in self.local.list_turn_deadlines().items():
+            deadlines[chat_id] = min(deadline, deadlines.get(chat_id, deadline))
+        return deadlines
+
+    def _mark_pending(self, chat_id: str):
+        with self._lock:
+            self._pending.setdefault(chat_id, time.monotonic())
+
+    def _replicate(self, chat_id: str) -> bool:
+        """把本地最新的狀態寫到遠端，遠端比較新時捨棄本地副本"""
+        with self._replicating:
+            state = self.local.load_game_state(chat_id)
+            if state is None:
+                # 已經刪除
+                return False
+            if self.remote.save_if_newer(chat_id, state):
+                self.replicated += 1
+                return True
+            self.stale_rejected += 1
+            self._stale.add(chat_id)
+            self._verified.discard(chat_id)
+            self._versions.pop(chat_id, None)
+            self.local.delete_game_state(chat_id)
+        logging.warning(f"chat_id: {chat_id} 的遠端版本比本地新，已捨棄本地副本")
+        if self.on_stale is not None:
+            self.on_stale(chat_id)
+        return False
+
+    def flush(self) -> int:
+        """把尚未複寫的寫入全部送到遠端，回傳成功複寫的數量"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        replicated = 0
+        for chat_id, since in pending.items():
+            try:
+                if self._replicate(chat_id):
+                    replicated += 1
+                    self.last_replication_lag = time.monotonic() - since
+            except Exception:
+                logging.exception(f"複寫 chat_id: {chat_id} 到遠端失敗，稍後重試")
+                self.replication_failures += 1
+                with self._lock:
+                    self._pending[chat_id] = min(since, self._pending.get(chat_id, since))
+        return replicated
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._closing:
+                    self._wakeup.wait(self.replicate_interval)
+                closing = self._closing
+            self.flush()
+            if closing:
+                return
+
+    def close(self):
+        # 最後一次複寫由背景執行緒完成
+        with self._wakeup:
+            self._closing = True
+            self._wakeup.notify()
+        self._thread.join()
+        for repository in (self.local, self.remote):
+            if hasattr(repository, 'close'):
+                repository.close()
+
+    def stats(self) -> dict:
+        loads = self.local_hits + self.remote_hits + self.misses
+        with self._lock:
+            pending = len(self._pending)
+            oldest: Optional[float] = min(self._pending.values(), default=None)
+        return {
+            'local_hits': self.local_hits,
+            'remote_hits': self.remote_hits,
+            'misses': self.misses,
+            'local_hit_ratio': self.local_hits / loads if loads else 0.0,
+            'remote_hit_ratio': self.remote_hits / loads if loads else 0.0,
+            'remote_reads': self.remote_reads,
+            'replicated': self.replicated,
+            'replication_failures': self.replication_failures,
+            'stale_rejected': self.stale_rejected,
+            'dropped_writes': self.dropped_writes,
+            'pending': pending,
+            # 目前最舊的未複寫寫入已等待的秒數
+            'replication_lag': time.monotonic() - oldest if oldest is not None else 0.0,
+            'last_replication_lag': self.last_replication_lag,
+        }
+
+
+if __name__ == '__main__':
+    # 比較直接使用遠端與分層儲存時，遠端的讀寫次數與指令等待時間（遠端以加上延遲的 SQLite 模擬）
+    import argparse
+    import os
+    import random
+    import shutil
+    import tempfile
+
+    from game_state_repository import LocalGameStateRepository, SqliteGameStateRepository
+
+    class SlowRepository(GameStateRepository):
+        """模擬網路延遲並計算讀寫次數"""
+
+        def __init__(self, repository: GameStateRepository, latency: float):
+            self.repository = repository
+            self.latency = latency
+            self.reads = 0
+            self.writes = 0
+
+        def _round_trip(self):
+            time.sleep(self.latency)
+
+        def save_game_state(self, chat_id: str, state: dict):
+            self._round_trip()
+            self.writes += 1
+            self.repository.save_game_state(chat_id, state)
+
+        def save_if_newer(self, chat_id: str, state: dict) -> bool:
+            self._round_trip()
+            self.reads += 1
+            self.writes += 1
+            return self.repository.save_if_newer(chat_id, state)
+
+        def load_game_state(self, chat_id: str) -> dict | None:
+            self._round_trip()
+            self.reads += 1
+            return self.repository.load_game_state(chat_id)
+
+        def load_many(self, chat_ids: Iterable[str]) -> Dict[str, dict]:
+            self._round_trip()
+            chat_ids = list(chat_ids)
+            self.reads += len(chat_ids)
+            return self.repository.load_many(chat_ids)
+
+        def delete_game_state(self, chat_id: str):
+            self._round_trip()
+            self.writes += 1
+            self.repository.delete_game_state(chat_id)
+
+    def run(repository: GameStateRepository, args) -> float:
+        """每個指令：不在記憶體中就載入，改變狀態後儲存；回傳指令花在儲存層的總時間"""
+        random.seed(args.seed)
+        in_memory = set()
+        waited = 0.0
+        for _ in range(args.commands):
+            chat_id = str(random.randrange(args.chats))
+            start = time.perf_counter()
+            if chat_id not in in_memory:
+                state = repository.load_game_state(chat_id) or {'started': True, 'turn': 0}
+                in_memory.add(chat_id)
+            state['turn'] += 1
+            repository.save_game_state(chat_id, state)
+            waited += time.perf_counter() - start
+            if random.random() < args.evict_rate:
+                # 閒置過久被移出記憶體
+                in_memory.discard(random.choice(list(in_memory)))
+        return waited
+
+    def main(args):
+        directory = tempfile.mkdtemp()
+        try:
+            direct = SlowRepository(SqliteGameStateRepository(os.path.join(directory, 'direct.db')), args.latency)
+            waited = run(direct, args)
+            print(f"  直接寫入遠端: 讀取 {direct.reads}，寫入 {direct.writes}，等待儲存 {waited:.2f} 秒")
+
+            remote = SlowRepository(SqliteGameStateRepository(os.path.join(directory, 'remote.db')), args.latency)
+            tiered = TieredGameStateRepository(LocalGameStateRepository(os.path.join(directory, 'local')), remote,
+                                               args.replicate_interval)
+            waited = run(tiered, args)
+            tiered.close()
+            stats = tiered.stats()
+            print(f"      分層儲存: 讀取 {remote.reads}，寫入 {remote.writes}，等待儲存 {waited:.2f} 秒，"
+                  f"本地命中 {stats['local_hit_ratio']:.0%}，最近一次複寫延遲 {stats['last_replication_lag']:.2f} 秒")
+        finally:
+            shutil.rmtree(directory)
+
+    parser = argparse.ArgumentParser(description="比較直接寫入遠端與分層儲存的遠端讀寫次數")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--commands', type=int, default=2000)
+    parser.add_argument('--evict-rate', type=float, default=0.05, help="每個指令後有遊戲被移出記憶體的機率")
+    parser.add_argument('--latency', type=float, default=0.02, help="遠端每次往返的延遲（秒）")
+    parser.add_argument('--replicate-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+
+# 所有群組共用一個回合計時器：期限放在一個 heap 中，由單一背景任務睡到最早的期限
+# 不必為每個群組建立 asyncio 任務；更新或取消期限時不從 heap 中刪除，取出時比對 _deadlines 跳過過期的項目
+# 期限使用 time.time()（存檔後重新啟動仍然有效），排程、取消都是 O(log n)
+class TurnTimers:
+    def __init__(self, on_expire: Callable[[int], Awaitable[None]] = None, concurrency: int = 16):
+        self.on_expire = on_expire  # 期限到時呼叫，參數為 chat_id
+        self.concurrency = concurrency  # 同時處理的逾時數（重新啟動後可能一次有很多已經到期）
+        self._heap: List[Tuple[float, int]] = []  # (期限, chat_id)，包含已經更新或取消的舊項目
+        self._deadlines: Dict[int, float] = {}  # chat_id: 目前有效的期限
+        self._wakeup = asyncio.Event()
+        self._sleep_until: Optional[float] = None  # 背景任務正在等待的期限，None 表示沒有等待
+        self._running: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計數據
+        self.fired = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def get(self, chat_id: int) -> Optional[float]:
+        return self._deadlines.get(chat_id)
+
+    def schedule(self, chat_id: int, deadline: float):
+        """設定 chat 的期限（取代原本的期限）"""
+        if self._deadlines.get(chat_id) == deadline:
+            return
+        self._deadlines[chat_id] = deadline
+        heapq.heappush(self._heap, (deadline, chat_id))
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._compact()
+        if self._sleep_until is None or deadline < self._sleep_until:
+            self._wakeup.set()
+
+    def cancel(self, chat_id: int):
+        self._deadlines.pop(chat_id, None)
+
+    def _compact(self):
+        # 舊項目太多時重建 heap，記憶體只跟有效的期限數有關
+        self._heap = [(deadline, chat_id) for chat_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        """最早的有效期限，沒有時回傳 None"""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[int]:
+        """取出所有到期的 chat_id（取出後就不再排程）"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, chat_id = heapq.heappop(self._heap)
+            if self._deadlines.get(chat_id) == deadline:
+                del self._deadlines[chat_id]
+                due.append(chat_id)
+        return due
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        tasks = list(self._running)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            self._sleep_until = self.next_deadline()
+            self._wakeup.clear()
+            if self._sleep_until is None or self._sleep_until > time.time():
+                timeout = None if self._sleep_until is None else self._sleep_until - time.time()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except TimeoutError:
+                    pass
+            for chat_id in self.pop_due(time.time()):
+                task = asyncio.create_task(self._expire(chat_id, semaphore))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _expire(self, chat_id: int, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                await self.on_expire(chat_id)
+                self.fired += 1
+            except Exception:
+                self.failed += 1
+                logging.exception(f"chat_id: {chat_id} 回合逾時處理失敗")
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._deadlines),
+            'heap': len(self._heap),
+            'running': len(self._running),
+            'fired': self.fired,
+            'failed': self.failed,
+        }
+
+
+if __name__ == '__main__':
+    # 量測大量計時器時排程、延後與取出到期項目的成本
+    import argparse
+    import random
+    import tracemalloc
+
+    def main(args):
+        rng = random.Random(0)
+        timers = TurnTimers()
+        now = time.time()
+        chat_ids = [-1_000_000_000_000 - i for i in range(args.timers)]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        for chat_id in chat_ids:
+            timers.schedule(chat_id, now + rng.uniform(60, 600))
+        scheduled = time.perf_counter() - start
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # 每個群組都有人下指令，期限往後延
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for chat_id in chat_ids:
+                timers.schedule(chat_id, timers.get(chat_id) + rng.uniform(1, 60))
+        rescheduled = time.perf_counter() - start
+
+        start = time.perf_counter()
+        next_deadline = timers.next_deadline()
+        due = timers.pop_due(now + 600)
+        popped = time.perf_counter() - start
+
+        n = args.timers
+        print(f"{n} 個計時器: 排程 {scheduled / n * 1e6:.2f} µs/個，記憶體 {used / n:.0f} bytes/個")
+        print(f"延後 {args.rounds} 輪: {rescheduled / (n * args.rounds) * 1e6:.2f} µs/次，heap {timers.stats()['heap']} 項")
+        print(f"最早期限 {next_deadline - now:.1f} 秒後，取出 {len(due)} 個到期: {popped * 1000:.1f} ms，剩 {len(timers)} 個")
+
+    parser = argparse.ArgumentParser(description="回合計時器效能")
+    parser.add_argument('--timers', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=5)
+    main(parser.parse_args())
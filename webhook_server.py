@@ -0,0 +1,230 @@
+# Webhook 模式：aiohttp 接收 Telegram 的更新，依 chat_id 的一致性雜湊轉給 N 個 worker 行程
+# 每個 worker 是完整的 bot（自己的 GameCache、鎖、寫入佇列、訊息排程），只處理分配給它的群組，
+# 同一個群組的指令永遠在同一個行程，指令吞吐量可隨 CPU 核心數增加
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+
+from aiohttp import web
+
+from config import *
+from metrics import CONTENT_TYPE, Registry
+from sharding import HashRing
+
+
+def chat_id_of(update: dict) -> int | None:
+    """更新所屬的群組，沒有群組的更新（例如 inline query）回傳 None"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post',
+                'my_chat_member', 'chat_member', 'chat_join_request'):
+        if key in update:
+            return update[key]['chat']['id']
+    callback = update.get('callback_query')
+    if callback and 'message' in callback:
+        return callback['message']['chat']['id']
+    return None
+
+
+def worker_main(index: int, workers: int, updates: multiprocessing.Queue, counters, ready):
+    # Ctrl+C 由 ingress 處理，worker 等 ingress 通知後才結束，排隊中的更新不會遺失
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, workers, updates, counters, ready))
+
+
+async def _worker(index: int, workers: int, updates: multiprocessing.Queue, counters, ready):
+    import telegram_bot
+    from telegram import Update
+
+    # spawn 的 worker 會重新載入這個模組，config 已經讀過環境變數，編號要明確交給 telegram_bot
+    # 預先載入、回合計時、全域限速與指標埠都依編號決定，必須在 build_application 之前設定
+    telegram_bot.configure_worker(index, workers)
+    if telegram_bot.worker_index != index or len(telegram_bot.shard_ring) != workers:
+        raise RuntimeError(f"worker {index} 的分配與 ingress 不一致")
+
+    application = telegram_bot.build_application(polling=False)
+    # 與 run_polling 相同的啟動與關閉順序
+    await application.initialize()
+    await telegram_bot.on_startup(application)
+    await application.start()
+    ready.set()
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def process(data: bytes):
+        try:
+            await application.process_update(Update.de_json(json.loads(data), application.bot))
+        except Exception:
+            logging.exception("處理更新失敗")
+        finally:
+            with counters.get_lock():
+                counters[0] += 1
+                counters[1] -= 1
+
+    while True:
+        data = await loop.run_in_executor(None, updates.get)
+        if data is None:
+            break
+        with counters.get_lock():
+            counters[1] += 1
+        task = asyncio.create_task(process(data))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks)
+    await application.stop()
+    await telegram_bot.on_stop(application)
+    await application.shutdown()
+    await telegram_bot.on_shutdown(application)
+
+
+class _Worker:
+    def __init__(self, index: int, workers: int, context, queue_size: int):
+        self.index = index
+        self.queue = context.Queue(queue_size)
+        self.counters = context.Array('q', 2)  # [已處理, 處理中]，由 worker 更新
+        self.ready = context.Event()  # worker 完成啟動（含預先載入）
+        self.process = context.Process(target=worker_main,
+                                       args=(index, workers, self.queue, self.counters, self.ready),
+                                       name=f"bot-worker-{index}")
+        self.routed = 0
+
+    def queued(self) -> int | None:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:
+            # macOS 不支援 qsize
+            return None
+
+    def stats(self) -> dict:
+        return {
+            'index': self.index,
+            'alive': self.process.is_alive(),
+            'ready': self.ready.is_set(),
+            'routed': self.routed,
+            'queued': self.queued(),
+            'in_flight': self.counters[1],
+            'processed': self.counters[0],
+        }
+
+
+class WebhookIngress:
+    def __init__(self, workers: int = WEBHOOK_WORKERS, queue_size: int = WEBHOOK_QUEUE_SIZE, secret: str = WEBHOOK_SECRET):
+        # spawn：worker 不繼承 ingress 的 event loop 與連線
+        context = multiprocessing.get_context('spawn')
+        self.workers = [_Worker(i, workers, context, queue_size) for i in range(workers)]
+        self.ring = HashRing(str(i) for i in range(workers))  # 與 telegram_bot.owns_chat 使用相同的分配
+        self.secret = secret
+        self.started_at = time.monotonic()
+
+        # 統計數據
+        self.received = 0
+        self.rejected = 0  # 佇列已滿或 worker 已停止，回 503 的次數
+        self.invalid = 0
+
+        # ingress 自己的指標；指令延遲等由各 worker 在 METRICS_PORT + 編號提供
+        self.metrics = Registry()
+        self.metrics.callback('payuppal_ingress_updates_total', "收到的更新",
+                              lambda: {'accepted': self.received, 'rejected': self.rejected, 'invalid': self.invalid},
+                              'counter', 'result')
+        self.metrics.callback('payuppal_worker_queue', "每個 worker 排隊中的更新",
+                              lambda: {w.index: w.queued() or 0 for w in self.workers}, label='worker')
+        self.metrics.callback('payuppal_worker_in_flight', "每個 worker 處理中的更新",
+                              lambda: {w.index: w.counters[1] for w in self.workers}, label='worker')
+        self.metrics.callback('payuppal_worker_processed_total', "每個 worker 處理完成的更新",
+                              lambda: {w.index: w.counters[0] for w in self.workers}, 'counter', 'worker')
+        self.metrics.callback('payuppal_worker_up', "worker 行程是否存活",
+                              lambda: {w.index: int(w.process.is_alive()) for w in self.workers}, label='worker')
+
+    def route(self, update: dict) -> _Worker:
+        chat_id = chat_id_of(update)
+        return self.workers[int(self.ring.node_for(chat_id if chat_id is not None else 0))]
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return web.Response(status=403)
+        data = await request.read()
+        try:
+            worker = self.route(json.loads(data))
+        except (ValueError, KeyError, TypeError):
+            self.invalid += 1
+            return web.Response(status=400)
+        if not worker.process.is_alive():
+            # worker 已經停止，放進佇列也不會處理；回 503 讓 Telegram 稍後重送
+            self.rejected += 1
+            return web.Response(status=503)
+        try:
+            worker.queue.put_nowait(data)
+        except queue.Full:
+            # worker 忙不過來，Telegram 收到錯誤會稍後重送
+            self.rejected += 1
+            return web.Response(status=503)
+        worker.routed += 1
+        self.received += 1
+        return web.Response()
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        # 啟動中的 worker 仍可接收更新（先排隊），但還不算健康
+        dead = [worker.index for worker in self.workers if not worker.process.is_alive()]
+        starting = [worker.index for worker in self.workers if not worker.ready.is_set()]
+        ok = not dead and not starting
+        return web.json_response({'ok': ok, 'dead_workers': dead, 'starting_workers': starting},
+                                 status=200 if ok else 503)
+
+    async def queues(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'uptime': time.monotonic() - self.started_at,
+            'received': self.received,
+            'rejected': self.rejected,
+            'invalid': self.invalid,
+            'workers': [worker.stats() for worker in self.workers],
+        })
+
+    async def metrics_text(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.metrics.render().encode('utf-8'),
+                            headers={'Content-Type': CONTENT_TYPE})
+
+    async def _start(self, app: web.Application):
+        for worker in self.workers:
+            worker.process.start()
+        if WEBHOOK_URL and not OFFLINE_BOT_API:
+            from telegram import Bot
+            async with Bot(TELEGRAM_TOKEN) as bot:
+                await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+            logging.info(f"已註冊 webhook: {WEBHOOK_URL}")
+
+    async def _stop(self, app: web.Application):
+        # 通知 worker 處理完排隊中的更新後結束
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.queue.put, None)
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.process.join, 30)
+            if worker.process.is_alive():
+                logging.warning(f"worker {worker.index} 沒有正常結束，強制終止")
+                worker.process.terminate()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_update)
+        app.router.add_get('/healthz', self.healthz)
+        app.router.add_get('/queues', self.queues)
+        app.router.add_get('/metrics', self.metrics_text)
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._stop)
+        return app
+
+
+def run_webhook():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    ingress = WebhookIngress()
+    logging.info(f"webhook 模式：{len(ingress.workers)} 個 worker，監聽 {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    web.run_app(ingress.app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)
+
+
+if __name__ == '__main__':
+    run_webhook()
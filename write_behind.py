@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from async_repository import AsyncGameStateRepository
+from game_state_repository import apply_delta, merge_delta
+
+
+class _PendingWrite:
+    __slots__ = ('full', 'state', 'events')
+
+    def __init__(self, full: bool, state: dict, events: List[dict]):
+        self.full = full  # state 是完整快照還是差異
+        self.state = state
+        self.events = events  # 這段期間發生的事件，依發生順序
+
+
+# 延遲寫入佇列：指令結束後只把狀態放進佇列，由背景任務批次寫回資料庫
+class WriteBehindQueue:
+    def __init__(self,
+                 repository: AsyncGameStateRepository,
+                 flush_interval: float = 1.0,
+                 batch_size: int = 50,
+                 snapshot_source: Callable[[str], Optional[dict]] = None):
+        self.repository = repository
+        self.snapshot_source = snapshot_source  # 差異寫入失敗時，用來取得目前的完整快照
+        self.flush_interval = flush_interval  # 定時寫入間隔（秒）
+        self.batch_size = batch_size  # 累積多少個 chat 就提早寫入
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()  # 確保同一時間只有一個 flush，寫入順序不會亂
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計數據
+        self.enqueued = 0  # 放入佇列的次數
+        self.coalesced = 0  # 被合併掉（覆蓋舊快照）的次數
+        self.saved = 0  # 實際寫入的次數
+        self.failed = 0  # 寫入失敗的次數
+        self.discarded = 0  # 遊戲已過期而捨棄、沒有寫入的次數
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def has_pending(self, chat_id: str) -> bool:
+        return chat_id in self._pending
+
+    def discard(self, chat_id: str):
+        """捨棄尚未寫入的狀態（記憶體中的遊戲已經過期，重新載入後不能再疊上舊的變動）"""
+        if self._pending.pop(chat_id, None) is not None:
+            self.discarded += 1
+
+    def enqueue(self, chat_id: str, state: dict, events: List[dict] = ()):
+        """放入最新的完整快照，同一個 chat 只保留最後一次（事件則全部保留）"""
+        pending = self._pending.get(chat_id)
+        if pending is not None:
+            self.coalesced += 1
+            pending.full = True
+            pending.state = state
+            pending.events.extend(events)
+        else:
+            self._pending[chat_id] = _PendingWrite(True, state, list(events))
+        self._enqueued()
+
+    def enqueue_delta(self, chat_id: str, delta: dict, events: List[dict] = ()):
+        """放入變動的欄位，與尚未寫入的快照或差異合併"""
+        pending = self._pending.get(chat_id)
+        if pending is not None:
+            self.coalesced += 1
+            if pending.full:
+                apply_delta(pending.state, delta)
+            else:
+                merge_delta(pending.state, delta)
+            pending.events.extend(events)
+        else:
+            self._pending[chat_id] = _PendingWrite(False, dict(delta), list(events))
+        self._enqueued()
+
+    def _enqueued(self):
+        self.enqueued += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止背景任務並把剩下的狀態全部寫入"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("背景寫入失敗")
+
+    async def flush(self, chat_id: str = None):
+        """立即寫入佇列中的狀態，指定 chat_id 時只寫入該 chat"""
+        async with self._flush_lock:
+            if chat_id is None:
+                batch, self._pending = self._pending, {}
+            elif chat_id in self._pending:
+                batch = {chat_id: self._pending.pop(chat_id)}
+            else:
+                return
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            # 完整快照一次批次寫入
+            snapshots = {cid: pending.state for cid, pending in batch.items() if pending.full}
+            if snapshots:
+                try:
+                    await self.repository.save_many(snapshots)
+                    self.saved += len(snapshots)
+                except Exception:
+                    self.failed += len(snapshots)
+                    logging.exception(f"批次儲存遊戲狀態失敗，共 {len(snapshots)} 筆")
+                    for cid in snapshots:
+                        self._requeue(cid, batch.pop(cid))
+                # 快照已寫入，事件另外記錄（不支援事件紀錄的 repository 會直接忽略）
+                for cid in snapshots:
+                    if cid in batch and batch[cid].events:
+                        try:
+                            await self.repository.append_events(cid, batch[cid].events)
+                        except Exception:
+                            logging.exception(f"記錄遊戲事件失敗，chat_id: {cid}")
+
+            # 差異也一次批次寫入（SQLite 在同一個 transaction），個別失敗的 chat 改存完整快照
+            deltas = {cid: pending for cid, pending in batch.items() if not pending.full}
+            if deltas:
+                try:
+                    failures = await self.repository.update_many(
+                        {cid: pending.state for cid, pending in deltas.items()},
+                        {cid: pending.events for cid, pending in deltas.items() if pending.events})
+                except Exception as e:
+                    logging.exception(f"批次更新遊戲狀態失敗，共 {len(deltas)} 筆")
+                    failures = dict.fromkeys(deltas, e)
+                for cid, error in failures.items():
+                    logging.warning(f"儲存遊戲狀態失敗，chat_id: {cid}: {error!r}")
+                    self._requeue(cid, deltas[cid])
+                self.saved += len(deltas) - len(failures)
+                self.failed += len(failures)
+
+            latency = time.perf_counter() - start
+            self.flush_count += 1
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+    def _requeue(self, chat_id: str, failed: _PendingWrite):
+        newer = self._pending.get(chat_id)
+        # 寫入失敗的事件排在期間新發生的事件之前
+        events = failed.events + newer.events if newer is not None else failed.events
+        # 差異寫入失敗（例如文件不存在）時改存目前的完整快照
+        if not failed.full and self.snapshot_source is not None:
+            snapshot = self.snapshot_source(chat_id)
+            if snapshot is not None:
+                self._pending[chat_id] = _PendingWrite(True, snapshot, events)
+                return
+        if newer is None:
+            self._pending[chat_id] = failed
+            return
+        if not newer.full:
+            # 期間又有新的差異，要疊在寫入失敗的那份之上
+            if failed.full:
+                newer.state = apply_delta(failed.state, newer.state)
+            else:
+                newer.state = merge_delta(failed.state, newer.state)
+            newer.full = failed.full
+        newer.events = events
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth,
+            'enqueued': self.enqueued,
+            'coalesced': self.coalesced,
+            'saved': self.saved,
+            'failed': self.failed,
+            'discarded': self.discarded,
+            'flush_count': self.flush_count,
+            'last_flush_latency': self.last_flush_latency,
+            'max_flush_latency': self.max_flush_latency,
+            'avg_flush_latency': self.total_flush_latency / self.flush_count if self.flush_count else 0.0,
+        }